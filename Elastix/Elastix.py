@@ -1,6 +1,7 @@
 from __future__ import print_function
 import os
 import subprocess
+import time
 import vtk, qt, slicer
 
 from ElastixLib.utils import *
@@ -96,7 +97,7 @@ class ElastixWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
 
     self.logic = ElastixLogic()
     self.logic.logCallback = self.addLog
-    self.registrationInProgress = False
+    self.registrationJob = None
 
     # Instantiate and connect widgets ...
 
@@ -112,6 +113,7 @@ class ElastixWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     self.ui.parameterNodeSelector.setNodeTypeLabel("ElastixParameters", "vtkMRMLScriptedModuleNode")
 
     self.refreshRegistrationPresetList()
+    self.ui.progressBar.visible = False
 
     # These connections ensure that we update parameter node when scene is closed
     self.addObserver(slicer.mrmlScene, slicer.mrmlScene.StartCloseEvent, self.onSceneStartClose)
@@ -132,6 +134,8 @@ class ElastixWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     self.ui.outputTransformSelector.connect("currentNodeChanged(vtkMRMLNode*)", self.updateParameterNodeFromGUI)
     self.ui.initialTransformSelector.connect("currentNodeChanged(vtkMRMLNode*)", self.updateParameterNodeFromGUI)
     self.ui.forceDisplacementFieldOutputCheckbox.toggled.connect(self.updateParameterNodeFromGUI)
+    self.ui.numberOfThreadsSpinBox.valueChanged.connect(self.updateParameterNodeFromGUI)
+    self.ui.previewCheckBox.toggled.connect(self.updateParameterNodeFromGUI)
     self.ui.registrationPresetSelector.currentIndexChanged.connect(self.updateParameterNodeFromGUI)
     self.ui.customElastixBinDirSelector.currentPathChanged.connect(self.onCustomElastixBinDirChanged)
 
@@ -147,7 +151,7 @@ class ElastixWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     with slicer.util.tryWithErrorDisplay("Failed to reload the module."):
 
       packageName='ElastixLib'
-      submoduleNames=['preset', 'utils', 'database', 'manager', 'ElastixPresetSubjectHierarchyPlugin']
+      submoduleNames=['preset', 'utils', 'cache', 'workspace', 'monitor', 'job', 'resample', 'parameters', 'transforms', 'crop', 'similarity', 'progress', 'timing', 'benchmark', 'database', 'manager', 'ElastixPresetSubjectHierarchyPlugin']
       import importlib
       package = importlib.import_module(packageName)
       for submoduleName in submoduleNames:
@@ -215,6 +219,8 @@ class ElastixWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     self._parameterNode.SetNodeReferenceID(self.logic.OUTPUT_TRANSFORM_REF, self.ui.outputTransformSelector.currentNodeID)
     self._parameterNode.SetNodeReferenceID(self.logic.INITIAL_TRANSFORM_REF, self.ui.initialTransformSelector.currentNodeID)
     self._parameterNode.SetParameter(self.logic.FORCE_GRID_TRANSFORM_PARAM, str(self.ui.forceDisplacementFieldOutputCheckbox.checked))
+    self._parameterNode.SetParameter(self.logic.NUMBER_OF_THREADS_PARAM, str(self.ui.numberOfThreadsSpinBox.value))
+    self._parameterNode.SetParameter(self.logic.PREVIEW_PARAM, str(self.ui.previewCheckBox.checked))
 
     registrationPreset = self.logic.getRegistrationPresets()[self.ui.registrationPresetSelector.currentIndex]
     self._parameterNode.SetParameter(self.logic.REGISTRATION_PRESET_ID_PARAM, registrationPreset.getID())
@@ -243,6 +249,8 @@ class ElastixWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
 
     self.ui.forceDisplacementFieldOutputCheckbox.checked = \
       slicer.util.toBool(self._parameterNode.GetParameter(self.logic.FORCE_GRID_TRANSFORM_PARAM))
+    self.ui.numberOfThreadsSpinBox.value = int(self._parameterNode.GetParameter(self.logic.NUMBER_OF_THREADS_PARAM) or 0)
+    self.ui.previewCheckBox.checked = slicer.util.toBool(self._parameterNode.GetParameter(self.logic.PREVIEW_PARAM))
 
     registrationPresetIndex = \
       self.logic.getIdxByPresetId(self._parameterNode.GetParameter(self.logic.REGISTRATION_PRESET_ID_PARAM))
@@ -276,34 +284,67 @@ class ElastixWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     self.logic.deleteTemporaryFiles = toggle
 
   def onApplyButton(self):
-    if self.registrationInProgress:
-      self.logic.cancelRequested = True
-      self.registrationInProgress = False
-    else:
-      with slicer.util.tryWithErrorDisplay("Failed to compute results.", waitCursor=True):
-        self.ui.statusLabel.plainText = ''
-        try:
-          self.registrationInProgress = True
-          self.updateApplyButtonState()
-
-          self.logic.setCustomElastixBinDir(self.ui.customElastixBinDirSelector.currentPath)
-          self.logic.deleteTemporaryFiles = not self.ui.keepTemporaryFilesCheckBox.checked
-          self.logic.logStandardOutput = self.ui.showDetailedLogDuringExecutionCheckBox.checked
-          self.logic.registerVolumesUsingParameterNode(self._parameterNode)
-
-          # Apply computed transform to moving volume if output transform is computed to immediately see registration results
-          movingVolumeNode = self.ui.movingVolumeSelector.currentNode()
-          if self.ui.outputTransformSelector.currentNode() is not None \
-            and movingVolumeNode is not None \
-            and self.ui.outputVolumeSelector.currentNode() is None:
-            movingVolumeNode.SetAndObserveTransformNodeID(self.ui.outputTransformSelector.currentNode().GetID())
-        finally:
-          self.registrationInProgress = False
+    if self.registrationJob is not None:
+      self.registrationJob.cancel()
+      self.updateApplyButtonState()
+      return
+
+    with slicer.util.tryWithErrorDisplay("Failed to compute results.", waitCursor=True):
+      self.ui.statusLabel.plainText = ''
+      self.logic.setCustomElastixBinDir(self.ui.customElastixBinDirSelector.currentPath)
+      self.logic.deleteTemporaryFiles = not self.ui.keepTemporaryFilesCheckBox.checked
+      self.logic.logStandardOutput = self.ui.showDetailedLogDuringExecutionCheckBox.checked
+      self.logic.loadIntermediateResults = self.ui.intermediateResultsCheckBox.checked
+      if slicer.util.toBool(self._parameterNode.GetParameter(self.logic.PREVIEW_PARAM)):
+        job = self.logic.registerVolumesWithPreviewUsingParameterNodeAsync(
+          self._parameterNode, self.onFullRegistrationStarted)
+      else:
+        job = self.logic.registerVolumesUsingParameterNodeAsync(self._parameterNode)
+      self.setRegistrationJob(job)
+    self.updateApplyButtonState()
+
+  def setRegistrationJob(self, job):
+    self.registrationJob = job
+    job.addEventCallback(self.onRegistrationProgress)
+    job.addCompletionCallback(self.onRegistrationJobFinished)
+    self.ui.progressBar.value = 0
+    self.ui.progressBar.format = "%p%"
+    self.ui.progressBar.visible = True
+
+  def onFullRegistrationStarted(self, job):
+    self.setRegistrationJob(job)
+    self.updateApplyButtonState()
+
+  def onRegistrationProgress(self, job, event):
+    self.ui.progressBar.value = int(event["progress"] * 100)
+    status = (f"stage {event['stage'] + 1}/{event['numberOfStages']}, "
+              f"resolution {event['resolution'] + 1}/{event['numberOfResolutions']}, iteration {event['iteration']}")
+    remainingTime = job.getRemainingTime()
+    if remainingTime is not None:
+      status += f", about {remainingTime:.0f} s left"
+    if getattr(job, "preview", False):
+      status = "preview, " + status
+    self.ui.progressBar.format = f"%p% ({status})"
+
+  def onRegistrationJobFinished(self, job):
+    # the full quality registration may be already started when the preview registration is finished
+    if job is self.registrationJob:
+      self.registrationJob = None
+      self.ui.progressBar.visible = False
+    if job.state == job.FAILED:
+      slicer.util.errorDisplay(f"Failed to compute results: {job.error}")
+    elif job.state == job.COMPLETED:
+      # Apply computed transform to moving volume if output transform is computed to immediately see registration results
+      movingVolumeNode = self.ui.movingVolumeSelector.currentNode()
+      if self.ui.outputTransformSelector.currentNode() is not None \
+        and movingVolumeNode is not None \
+        and self.ui.outputVolumeSelector.currentNode() is None:
+        movingVolumeNode.SetAndObserveTransformNodeID(self.ui.outputTransformSelector.currentNode().GetID())
     self.updateApplyButtonState()
 
   def updateApplyButtonState(self):
-    if self.registrationInProgress or self.logic.isRunning:
-      if self.logic.cancelRequested:
+    if self.registrationJob is not None:
+      if self.registrationJob.cancelRequested:
         self.ui.applyButton.text = "Cancelling..."
         self.ui.applyButton.enabled = False
       else:
@@ -368,9 +409,25 @@ class ElastixLogic(ScriptedLoadableModuleLogic, PresetManagerLogic):
   OUTPUT_TRANSFORM_REF = "OutputTransform"
   FORCE_GRID_TRANSFORM_PARAM = "ForceGridTransform"
   INITIAL_TRANSFORM_REF = "InitialTransform"
+  NUMBER_OF_THREADS_PARAM = "NumberOfThreads"
   REGISTRATION_PRESET_ID_PARAM = "RegistrationPresetId"
+  PROGRESS_PARAM = "Progress" # percentage of the registration that is completed, updated while it is running
+  PREVIEW_PARAM = "Preview" # compute an approximate result first (see registerVolumesWithPreviewUsingParameterNodeAsync)
+
+  # preview registration settings (see getPreviewParameterOverrides)
+  PREVIEW_ITERATIONS_FRACTION = 0.2
+  PREVIEW_MAXIMUM_NUMBER_OF_SPATIAL_SAMPLES = 1000
+  PREVIEW_GRID_SPACING_FACTOR = 2.0
 
   DEFAULT_PRESET_ID = "default0"
+  DEFAULT_BATCH_WORKERS = 2
+
+  # name -> (file extension, compression), used for writing input volumes for elastix
+  INPUT_VOLUME_FORMATS = {
+    "mha": (".mha", False),
+    "mhd": (".mhd", False), # header and uncompressed .raw pixel data in separate files
+    "mha-compressed": (".mha", True)
+  }
 
   INPUT_DIR_NAME = "input"
   OUTPUT_RESAMPLE_DIR_NAME = "result-resample"
@@ -380,10 +437,32 @@ class ElastixLogic(ScriptedLoadableModuleLogic, PresetManagerLogic):
     ScriptedLoadableModuleLogic.__init__(self)
     PresetManagerLogic.__init__(self)
 
-    self.isRunning = False
-    self.cancelRequested = False
+    self.jobs = [] # registration jobs that are not completed yet
     self.deleteTemporaryFiles = True
     self.logStandardOutput = False
+    self.numberOfThreads = 0 # 0 = split available cores between concurrently running jobs
+    self.backgroundProcessNiceness = 10 # nice value of processes of background jobs (Linux/macOS)
+    self.backgroundCpuAffinity = None # set of CPU core indices that background jobs may use (Linux)
+    self.processMemoryLimitMB = 0 # stop registrations whose elastix/transformix process uses more memory (Linux), 0 = no limit
+    self.loadIntermediateResults = False # update the output transform after each resolution level during registration
+    self.resampleOutputVolumeInProcess = True # use transformix only if the result transform cannot be loaded
+    self.useNativeResultTransform = True # create B-spline transforms from their coefficients instead of displacement fields
+    self.inputVolumeFormat = "mha" # see INPUT_VOLUME_FORMATS
+    self.exportInInternalPixelType = False # export volumes in the internal pixel type of the preset (elastix does not need to convert)
+    self.matchResultPixelTypeToMovingVolume = True # transformix writes the output volume with the pixel type of the moving volume
+    self.cropInputsToMasks = False # export only the mask bounding box (extended by cropMarginMM) of masked volumes
+    self.cropMarginMM = 10.0
+    self.useInputStagingCache = False # reuse exported input volumes in repeated registrations (only if temporary files are deleted)
+    self.inputStagingCache = None # created on first use
+    self.useResultCache = False # reuse results of identical registrations, also across sessions
+    self.resultCache = None # created on first use
+    self.useStageCache = False # run each stage of multi-stage presets separately and reuse results of unchanged stages
+    self.stageCache = None # created on first use
+    self.workspaceManager = None # created on first use
+    self.timingReports = [] # timing reports of completed registrations (most recent last), see getTimingReport
+    self.maximumNumberOfTimingReports = 1000
+    self.chromeTraceFilePath = None # if set then timing reports are written to this file after each registration
+    self._elastixVersion = None
     self.customElastixBinDirSettingsKey = 'Elastix/CustomElastixPath'
 
     self.scriptPath = os.path.dirname(os.path.abspath(__file__))
@@ -402,6 +481,10 @@ class ElastixLogic(ScriptedLoadableModuleLogic, PresetManagerLogic):
       parameterNode.SetParameter(self.FORCE_GRID_TRANSFORM_PARAM, "False")
     if not parameterNode.GetParameter(self.REGISTRATION_PRESET_ID_PARAM):
       parameterNode.SetParameter(self.REGISTRATION_PRESET_ID_PARAM, self.DEFAULT_PRESET_ID)
+    if not parameterNode.GetParameter(self.NUMBER_OF_THREADS_PARAM):
+      parameterNode.SetParameter(self.NUMBER_OF_THREADS_PARAM, "0")
+    if not parameterNode.GetParameter(self.PREVIEW_PARAM):
+      parameterNode.SetParameter(self.PREVIEW_PARAM, "False")
 
   def addLog(self, text):
     logging.info(text)
@@ -447,6 +530,7 @@ class ElastixLogic(ScriptedLoadableModuleLogic, PresetManagerLogic):
     settings.setValue(self.customElastixBinDirSettingsKey, customPath)
     # Update elastix bin dir
     self.elastixBinDir = None
+    self._elastixVersion = None
     self.getElastixBinDir()
 
   def getElastixEnv(self):
@@ -462,22 +546,68 @@ class ElastixLogic(ScriptedLoadableModuleLogic, PresetManagerLogic):
 
     return elastixEnv
 
-  def startElastix(self, cmdLineArguments):
-    self.addLog("Register volumes...")
+  def getElastixVersion(self):
+    """Returns the version information that elastix reports (used for identifying cached results)."""
+    if self._elastixVersion is None:
+      executableFilePath = os.path.join(self.getElastixBinDir(), self.elastixFilename)
+      result = subprocess.run([executableFilePath, '--version'], env=self.getElastixEnv(), stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT, universal_newlines=True, startupinfo=self.getStartupInfo())
+      self._elastixVersion = result.stdout.strip()
+    return self._elastixVersion
+
+  def startElastix(self, cmdLineArguments, job=None):
     executableFilePath = os.path.join(self.getElastixBinDir(), self.elastixFilename)
+    cmdLineArguments = cmdLineArguments + ['-threads', str(self.getNumberOfThreadsPerProcess(job))]
     logging.info(f"Register volumes using: {executableFilePath}: {cmdLineArguments!r}")
-    return self._createSubProcess(executableFilePath, cmdLineArguments)
+    return self._createSubProcess(executableFilePath, cmdLineArguments, background=job is not None and job.background)
 
-  def startTransformix(self, cmdLineArguments):
-    self.addLog("Generate output...")
+  def startTransformix(self, cmdLineArguments, job=None):
     executableFilePath = os.path.join(self.getElastixBinDir(), self.transformixFilename)
+    cmdLineArguments = cmdLineArguments + ['-threads', str(self.getNumberOfThreadsPerProcess(job))]
     logging.info(f"Generate output using: {executableFilePath}: {cmdLineArguments!r}")
-    return self._createSubProcess(executableFilePath, cmdLineArguments)
+    return self._createSubProcess(executableFilePath, cmdLineArguments, background=job is not None and job.background)
+
+  def getNumberOfThreadsPerProcess(self, job=None):
+    """Number of threads that a new elastix/transformix process may use.
+
+    If the number of threads is not specified for the job or in the logic then the available CPU cores
+    are split evenly between the registration jobs that are running at the same time.
+    """
+    numberOfThreads = job.numberOfThreads if job is not None and job.numberOfThreads else self.numberOfThreads
+    if numberOfThreads > 0:
+      return numberOfThreads
+    background = job is not None and job.background
+    if background and self.backgroundCpuAffinity:
+      numberOfCores = len(self.backgroundCpuAffinity)
+    else:
+      numberOfCores = getNumberOfAvailableCores()
+    numberOfConcurrentJobs = max(len([runningJob for runningJob in self.jobs if runningJob.isRunning()]),
+                                 job.expectedConcurrency if job is not None else 1, 1)
+    return max(1, numberOfCores // numberOfConcurrentJobs)
 
-  def _createSubProcess(self, executableFilePath, cmdLineArguments):
+  def _createSubProcess(self, executableFilePath, cmdLineArguments, background=False):
+    import platform
+    if platform.system() == 'Windows':
+      BELOW_NORMAL_PRIORITY_CLASS = 0x00004000
+      return subprocess.Popen([executableFilePath] + cmdLineArguments, env=self.getElastixEnv(),
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True,
+                              startupinfo=self.getStartupInfo(),
+                              creationflags=BELOW_NORMAL_PRIORITY_CLASS if background else 0)
+
+    niceness = self.backgroundProcessNiceness if background else 0
+    cpuAffinity = self.backgroundCpuAffinity if background else None
+
+    def setScheduling():
+      # executed in the child process, before elastix/transformix starts, so that all its threads inherit it
+      if niceness:
+        os.nice(niceness)
+      if cpuAffinity and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpuAffinity)
+
+    # Start in a new session so that cancelling can kill the process with all its children
     return subprocess.Popen([executableFilePath] + cmdLineArguments, env=self.getElastixEnv(),
                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True,
-                            startupinfo=self.getStartupInfo())
+                            start_new_session=True, preexec_fn=setScheduling if niceness or cpuAffinity else None)
 
   def getStartupInfo(self):
     import platform
@@ -491,43 +621,153 @@ class ElastixLogic(ScriptedLoadableModuleLogic, PresetManagerLogic):
     info.wShowWindow = 0
     return info
 
-  def logProcessOutput(self, process):
-    # save process output (if not logged) so that it can be displayed in case of an error
-    processOutput = ''
-    import subprocess
+  def registerVolumesUsingParameterNode(self, parameterNode):
+    self.registerVolumesUsingParameterNodeAsync(parameterNode).wait()
+
+  def registerVolumesUsingParameterNodeAsync(self, parameterNode, **argumentOverrides):
+    """Start registration of volumes specified in the parameter node, see registerVolumesAsync.
+
+    :param argumentOverrides: arguments of registerVolumesAsync that replace the ones specified in the parameter node
+    """
+    from ElastixLib.preset import releaseParameterFiles
+    registrationArguments = self._getRegistrationArgumentsFromParameterNode(parameterNode)
+    presetParameterFilenames = registrationArguments["parameterFilenames"]
+    registrationArguments.update(argumentOverrides)
+    try:
+      job = self.registerVolumesAsync(**registrationArguments)
+    finally:
+      # the job keeps its own reference to the parameter files
+      releaseParameterFiles(presetParameterFilenames)
+    self._addParameterNodeProgressObserver(job, parameterNode)
+    job.addCompletionCallback(lambda job: self._setTimingAttributes(parameterNode, job.timingReport))
+    return job
+
+  def getPreviewParameterOverrides(self, registrationPreset):
+    """Returns parameter overrides for each stage of the preset that make the registration much faster but less accurate:
+    fewer iterations, fewer spatial samples, and coarser B-spline grid."""
+    parameterOverrides = []
+    for parameterMap in registrationPreset.getParameterMaps():
+      stageOverrides = {}
+      iterations = parameterMap.getValues("MaximumNumberOfIterations")
+      if iterations:
+        stageOverrides["MaximumNumberOfIterations"] = [
+          max(1, int(value * self.PREVIEW_ITERATIONS_FRACTION)) for value in iterations]
+      samples = parameterMap.getValues("NumberOfSpatialSamples")
+      if samples:
+        stageOverrides["NumberOfSpatialSamples"] = [
+          min(value, self.PREVIEW_MAXIMUM_NUMBER_OF_SPATIAL_SAMPLES) for value in samples]
+      for gridSpacingKey in ["FinalGridSpacingInPhysicalUnits", "FinalGridSpacingInVoxels"]:
+        gridSpacing = parameterMap.getValues(gridSpacingKey)
+        if gridSpacing:
+          stageOverrides[gridSpacingKey] = [value * self.PREVIEW_GRID_SPACING_FACTOR for value in gridSpacing]
+      parameterOverrides.append(stageOverrides)
+    return parameterOverrides
+
+  def registerVolumesWithPreviewUsingParameterNodeAsync(self, parameterNode, fullRegistrationStartedCallback=None):
+    """Start a fast, approximate (preview) registration and when it is completed, start the full quality
+    registration as a background job, initialized by the preview result.
+
+    The preview result is written into the output nodes as soon as it is available, and it is replaced
+    by the full quality result when that is completed.
+
+    :param fullRegistrationStartedCallback: called with the job of the full quality registration when it is started,
+      it can be used for observing progress or cancelling the registration
+    :return: job of the preview registration
+    """
+    registrationPreset = self.getPresetByID(parameterNode.GetParameter(self.REGISTRATION_PRESET_ID_PARAM))
+    temporaryNodes = []
+    previewTransformNode = parameterNode.GetNodeReference(self.OUTPUT_TRANSFORM_REF)
+    if previewTransformNode is None:
+      # the full registration is initialized by the preview transform, therefore it is always computed
+      previewTransformNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLTransformNode", "ElastixPreviewTransform")
+      previewTransformNode.SetHideFromEditors(True)
+      temporaryNodes.append(previewTransformNode)
+
+    try:
+      previewJob = self.registerVolumesUsingParameterNodeAsync(
+        parameterNode, outputTransformNode=previewTransformNode,
+        parameterOverrides=self.getPreviewParameterOverrides(registrationPreset))
+    except:
+      self._removeTemporaryNodes(temporaryNodes)
+      raise
+    previewJob.preview = True
 
-    while True:
+    def onPreviewCompleted(previewJob):
+      if previewJob.state != previewJob.COMPLETED:
+        self._removeTemporaryNodes(temporaryNodes)
+        return
+      self.addLog("Preview registration is completed, start full quality registration")
       try:
-        stdout_line = process.stdout.readline()
-        if not stdout_line:
-          break
-        stdout_line = stdout_line.rstrip()
-        if self.logStandardOutput:
-          self.addLog(stdout_line)
-        else:
-          processOutput += stdout_line + '\n'
-      except UnicodeDecodeError as e:
-        # Probably system locale is set to non-English, we cannot easily capture process output.
-        # Code page conversion happens because `universal_newlines=True` sets process output to text mode.
-        pass
-      slicer.app.processEvents()  # give a chance to click Cancel button
-      if self.cancelRequested:
-        process.kill()
-        break
-
-    process.stdout.close()
-    return_code = process.wait()
-    if return_code and not self.cancelRequested:
-      if processOutput:
-        self.addLog(processOutput)
-      raise subprocess.CalledProcessError(return_code, "elastix")
+        fullJob = self.registerVolumesUsingParameterNodeAsync(
+          parameterNode, initialTransformNode=previewTransformNode, background=True)
+      except Exception as e:
+        self._removeTemporaryNodes(temporaryNodes)
+        self.addLog(f"Failed to start full quality registration: {e}")
+        return
+      fullJob.addCompletionCallback(lambda job: self._removeTemporaryNodes(temporaryNodes))
+      if fullRegistrationStartedCallback:
+        fullRegistrationStartedCallback(fullJob)
 
-  def registerVolumesUsingParameterNode(self, parameterNode):
+    previewJob.addCompletionCallback(onPreviewCompleted)
+    return previewJob
+
+  def _addParameterNodeProgressObserver(self, job, parameterNode, minimumUpdateIntervalSec=0.5):
+    """Keep PROGRESS_PARAM of the parameter node up-to-date. The parameter node is modified at most
+    once in every minimumUpdateIntervalSec, because observers of the parameter node may update the GUI."""
+    lastUpdateTime = [0.0]
+
+    def updateProgress(job, event):
+      now = time.time()
+      if event["type"] == "iteration" and now - lastUpdateTime[0] < minimumUpdateIntervalSec:
+        return
+      progress = f"{event['progress'] * 100:.0f}"
+      if progress != parameterNode.GetParameter(self.PROGRESS_PARAM):
+        parameterNode.SetParameter(self.PROGRESS_PARAM, progress)
+      lastUpdateTime[0] = now
+
+    parameterNode.SetParameter(self.PROGRESS_PARAM, "0")
+    job.addEventCallback(updateProgress)
+    job.addCompletionCallback(lambda job: parameterNode.SetParameter(self.PROGRESS_PARAM, f"{job.getProgress() * 100:.0f}"))
+
+  TIMING_ATTRIBUTE_PREFIX = "Elastix.Timing."
+
+  def _setTimingAttributes(self, parameterNode, timingReport):
+    """Store duration of each phase (in seconds) and total amount of data read and written as parameter node attributes."""
+    for attributeName in parameterNode.GetAttributeNames() or []:
+      if attributeName.startswith(self.TIMING_ATTRIBUTE_PREFIX):
+        parameterNode.RemoveAttribute(attributeName)
+    for phaseName, duration in timingReport.getPhaseDurations().items():
+      parameterNode.SetAttribute(f"{self.TIMING_ATTRIBUTE_PREFIX}{phaseName}", f"{duration:.3f}")
+    parameterNode.SetAttribute(f"{self.TIMING_ATTRIBUTE_PREFIX}Total", f"{timingReport.getTotalTime():.3f}")
+    parameterNode.SetAttribute(f"{self.TIMING_ATTRIBUTE_PREFIX}BytesRead",
+                               str(sum(phase["bytesRead"] for phase in timingReport.phases)))
+    parameterNode.SetAttribute(f"{self.TIMING_ATTRIBUTE_PREFIX}BytesWritten",
+                               str(sum(phase["bytesWritten"] for phase in timingReport.phases)))
+
+  def getTimingReport(self):
+    """Returns the TimingReport of the most recently completed registration (None if there is none)."""
+    return self.timingReports[-1] if self.timingReports else None
+
+  def writeChromeTrace(self, filePath):
+    """Write timing of all completed registrations in Chrome trace format (can be viewed in https://ui.perfetto.dev)."""
+    from ElastixLib.timing import writeChromeTrace
+    writeChromeTrace(self.timingReports, filePath)
+
+  def _onRegistrationJobTimingCompleted(self, job):
+    if job.state != job.COMPLETED:
+      return
+    logging.info(job.timingReport.toText())
+    self.timingReports.append(job.timingReport)
+    del self.timingReports[:-self.maximumNumberOfTimingReports]
+    if self.chromeTraceFilePath:
+      self.writeChromeTrace(self.chromeTraceFilePath)
+
+  def _getRegistrationArgumentsFromParameterNode(self, parameterNode):
     presetId = parameterNode.GetParameter(self.REGISTRATION_PRESET_ID_PARAM)
     registrationPreset = self.getPresetByID(presetId)
-    parameterFilenames = registrationPreset.getParameterFiles()
+    parameterFilenames = registrationPreset.createParameterFiles()
 
-    self.registerVolumes(
+    return dict(
       fixedVolumeNode=parameterNode.GetNodeReference(self.FIXED_VOLUME_REF),
       movingVolumeNode=parameterNode.GetNodeReference(self.MOVING_VOLUME_REF),
       parameterFilenames=parameterFilenames,
@@ -536,62 +776,499 @@ class ElastixLogic(ScriptedLoadableModuleLogic, PresetManagerLogic):
       fixedVolumeMaskNode=parameterNode.GetNodeReference(self.FIXED_VOLUME_MASK_REF),
       movingVolumeMaskNode=parameterNode.GetNodeReference(self.MOVING_VOLUME_MASK_REF),
       forceDisplacementFieldOutputTransform=slicer.util.toBool(parameterNode.GetParameter(self.FORCE_GRID_TRANSFORM_PARAM)),
-      initialTransformNode=parameterNode.GetNodeReference(self.INITIAL_TRANSFORM_REF))
+      initialTransformNode=parameterNode.GetNodeReference(self.INITIAL_TRANSFORM_REF),
+      numberOfThreads=int(parameterNode.GetParameter(self.NUMBER_OF_THREADS_PARAM) or 0),
+      maximumWorkingSpacing=registrationPreset.getMaximumWorkingSpacing())
 
   def registerVolumes(self, fixedVolumeNode, movingVolumeNode, parameterFilenames=None, outputVolumeNode=None,
                       outputTransformNode=None, fixedVolumeMaskNode=None, movingVolumeMaskNode=None,
-                      forceDisplacementFieldOutputTransform=True, initialTransformNode=None):
-
-    self.isRunning = True
-    tempDir = createTempDirectory()
+                      forceDisplacementFieldOutputTransform=True, initialTransformNode=None, numberOfThreads=0,
+                      bypassResultCache=False, maximumWorkingSpacing=0.0, parameterOverrides=None):
+    """Register volumes and return when the registration is completed. Raises an exception if registration fails."""
+    job = self.registerVolumesAsync(fixedVolumeNode, movingVolumeNode, parameterFilenames, outputVolumeNode,
+                                    outputTransformNode, fixedVolumeMaskNode, movingVolumeMaskNode,
+                                    forceDisplacementFieldOutputTransform, initialTransformNode, numberOfThreads,
+                                    bypassResultCache=bypassResultCache, maximumWorkingSpacing=maximumWorkingSpacing,
+                                    parameterOverrides=parameterOverrides)
+    job.wait()
+
+  def registerVolumesAsync(self, fixedVolumeNode, movingVolumeNode, parameterFilenames=None, outputVolumeNode=None,
+                           outputTransformNode=None, fixedVolumeMaskNode=None, movingVolumeMaskNode=None,
+                           forceDisplacementFieldOutputTransform=True, initialTransformNode=None, numberOfThreads=0,
+                           background=False, bypassResultCache=False, maximumWorkingSpacing=0.0,
+                           parameterOverrides=None):
+    """Start registration of volumes and return immediately with a RegistrationJob.
+
+    Use the job to get notified about progress and completion, to cancel the registration, or to wait for it.
+    Multiple registrations may run at the same time.
+
+    :param numberOfThreads: number of threads used by elastix and transformix, 0 = use the logic's numberOfThreads
+    :param background: run processes with lower priority (backgroundProcessNiceness) and only on backgroundCpuAffinity cores
+    :param bypassResultCache: if useResultCache or useStageCache is enabled, run the registration even if the result
+      is already in the cache (the cached result is replaced by the new one)
+    :param maximumWorkingSpacing: input volumes are downsampled to this voxel size (mm) before registration,
+      the output volume is still resampled from the full resolution moving volume. 0 = use full resolution.
+    :param parameterOverrides: parameter values that replace the values in the parameter files, without changing
+      the files, e.g. {"MaximumNumberOfIterations": 100}. A dict is applied to all stages, a list of dicts
+      (or None) specifies overrides for each stage.
+    """
+    job = self._createRegistrationJob(fixedVolumeNode, movingVolumeNode, parameterFilenames, outputVolumeNode,
+                                      outputTransformNode, fixedVolumeMaskNode, movingVolumeMaskNode,
+                                      forceDisplacementFieldOutputTransform, initialTransformNode,
+                                      maximumWorkingSpacing=maximumWorkingSpacing, parameterOverrides=parameterOverrides)
+    job.numberOfThreads = numberOfThreads
+    job.background = background
+    job.bypassResultCache = bypassResultCache
+    job.start()
+    return job
+
+  def registerVolumesBatch(self, fixedVolumeNode, movingNodes, parameterFilenames=None, fixedVolumeMaskNode=None,
+                           maximumNumberOfWorkers=None, createOutputVolumes=True, createOutputTransforms=False,
+                           forceDisplacementFieldOutputTransform=True, background=True, maximumWorkingSpacing=0.0,
+                           parameterOverrides=None):
+    """Register many moving volumes to the same fixed volume, running several registrations at the same time.
+
+    :param movingNodes: list of moving volume nodes and/or Elastix parameter nodes. For parameter nodes all
+      inputs and outputs are taken from the parameter node, except the fixed volume and fixed volume mask.
+    :param maximumNumberOfWorkers: number of registrations that run at the same time (default: DEFAULT_BATCH_WORKERS)
+    :param createOutputVolumes: create an output volume for each moving volume node (not used for parameter nodes)
+    :param createOutputTransforms: create an output transform for each moving volume node (not used for parameter nodes)
+    :param background: run the registrations as background jobs (see registerVolumesAsync)
+    :param maximumWorkingSpacing: see registerVolumesAsync, the shared fixed volume is always downsampled to this
+      spacing, for parameter nodes the moving volume is downsampled to the spacing of their preset
+    :param parameterOverrides: applied to all registrations, see registerVolumesAsync
+    :return: BatchRegistration that can be used for waiting, cancelling, and getting results of each job.
+      Results are added to the scene as soon as each job is completed.
+    """
+    from ElastixLib.job import BatchRegistration
+    from ElastixLib.preset import releaseParameterFiles
+
+    if maximumNumberOfWorkers is None:
+      maximumNumberOfWorkers = self.DEFAULT_BATCH_WORKERS
+    # parameter files that this function got from presets, each job keeps its own reference to them
+    releaseFilenames = []
+    if parameterFilenames is None:
+      parameterFilenames = self.getPresetByID(self.DEFAULT_PRESET_ID).createParameterFiles()
+      releaseFilenames += parameterFilenames
+
+    batchDir = createTempDirectory()
+    markDirectoryOwner(batchDir)
+    temporaryNodes = []
+    # fixed volume is exported only once (for each internal pixel type) and it is shared by all the jobs
+    stagedInputFilesByPixelTypes = {}
+    jobs = []
+    try:
+      stagedFixedVolumeNode, stagedFixedVolumeMaskNode = self._prepareInputVolume(
+        fixedVolumeNode, fixedVolumeMaskNode, maximumWorkingSpacing, temporaryNodes, self.addLog)
+      sharedInputVolumes = [
+        [stagedFixedVolumeNode, 'fixed', '-f'],
+        [stagedFixedVolumeMaskNode, 'fixedMask', '-fMask']
+      ]
 
+      for movingNode in movingNodes:
+        if movingNode.IsA("vtkMRMLScriptedModuleNode"):
+          registrationArguments = self._getRegistrationArgumentsFromParameterNode(movingNode)
+          registrationArguments["fixedVolumeNode"] = fixedVolumeNode
+          registrationArguments["fixedVolumeMaskNode"] = fixedVolumeMaskNode
+          releaseFilenames += registrationArguments["parameterFilenames"]
+        else:
+          registrationArguments = dict(
+            fixedVolumeNode=fixedVolumeNode,
+            movingVolumeNode=movingNode,
+            parameterFilenames=parameterFilenames,
+            fixedVolumeMaskNode=fixedVolumeMaskNode,
+            forceDisplacementFieldOutputTransform=forceDisplacementFieldOutputTransform,
+            maximumWorkingSpacing=maximumWorkingSpacing)
+          if createOutputVolumes:
+            registrationArguments["outputVolumeNode"] = slicer.mrmlScene.AddNewNodeByClass(
+              "vtkMRMLScalarVolumeNode", f"{movingNode.GetName()} registered")
+          if createOutputTransforms:
+            registrationArguments["outputTransformNode"] = slicer.mrmlScene.AddNewNodeByClass(
+              "vtkMRMLTransformNode", f"{movingNode.GetName()} registration transform")
+        numberOfThreads = registrationArguments.pop("numberOfThreads", 0)
+        stagedInputFiles = self._stageSharedInputVolumes(
+          batchDir, sharedInputVolumes, self._getInputPixelTypes(registrationArguments["parameterFilenames"]),
+          stagedInputFilesByPixelTypes)
+        job = self._createRegistrationJob(**registrationArguments, stagedInputFiles=stagedInputFiles,
+                                          parameterOverrides=parameterOverrides)
+        job.numberOfThreads = numberOfThreads
+        job.background = background
+        jobs.append(job)
+    except:
+      for job in jobs:
+        job.cancel()
+      self._removeTemporaryNodes(temporaryNodes)
+      self._releaseSharedInputVolumes(stagedInputFilesByPixelTypes)
+      if self.deleteTemporaryFiles:
+        import shutil
+        shutil.rmtree(batchDir, ignore_errors=True)
+      raise
+    finally:
+      # each job keeps its own reference to the parameter files
+      releaseParameterFiles(releaseFilenames)
+    self._removeTemporaryNodes(temporaryNodes)
+
+    def cleanup():
+      self._releaseSharedInputVolumes(stagedInputFilesByPixelTypes)
+      if self.deleteTemporaryFiles:
+        import shutil
+        shutil.rmtree(batchDir, ignore_errors=True)
+
+    batch = BatchRegistration(jobs, maximumNumberOfWorkers, logCallback=self.addLog, cleanup=cleanup)
+    batch.start()
+    return batch
+
+  def sweepPresets(self, fixedVolumeNode, movingVolumeNode, presetIds, outputVolumeNode=None,
+                   outputTransformNode=None, fixedVolumeMaskNode=None, maximumNumberOfWorkers=None,
+                   metric="normalizedMutualInformation", maximumWorkingSpacing=0.0):
+    """Register the same volumes with several presets at the same time and select the best result.
+
+    Input volumes are cropped and downsampled the same way as for a single registration (see cropInputsToMasks
+    and maximumWorkingSpacing) and exported only once (for each internal pixel type that the presets use).
+    All registrations share the thread budget (see BatchRegistration).
+    Each result is scored by resampling the moving volume into the fixed volume's voxel grid and computing
+    the same similarity metric (see ElastixLib.similarity), within the fixed volume mask, if specified.
+
+    :param presetIds: list of preset IDs to compare. Presets must be suitable for the input volumes
+      (e.g., presets for 2D images cannot register 3D volumes), therefore there is no default.
+    :param maximumWorkingSpacing: see registerVolumesAsync
+    :param outputVolumeNode: if specified, the moving volume resampled with the best transform is stored in it
+    :param outputTransformNode: if specified, the best transform is stored in it
+    :param maximumNumberOfWorkers: number of registrations that run at the same time (default: DEFAULT_BATCH_WORKERS)
+    :param metric: similarity metric name, see ElastixLib.similarity.METRICS
+    :return: list of dicts (presetId, state, similarity, elapsedTime, rank, error), best result first.
+      Results of failed registrations are at the end of the list, with similarity and rank set to None.
+    """
+    from ElastixLib.job import BatchRegistration
+    from ElastixLib.preset import releaseParameterFiles
+    from ElastixLib.resample import resampleVolume
+    from ElastixLib.similarity import computeSimilarity, METRICS
+
+    if metric not in METRICS:
+      raise ValueError(f"Unknown similarity metric '{metric}', supported metrics: {', '.join(METRICS.keys())}")
+    if not presetIds:
+      raise ValueError("No registration presets are specified for the sweep")
+    if maximumNumberOfWorkers is None:
+      maximumNumberOfWorkers = self.DEFAULT_BATCH_WORKERS
+
+    # all registrations use the same input files so that the results are comparable
+    sweepDir = createTempDirectory()
+    markDirectoryOwner(sweepDir)
+    temporaryNodes = []
+    preparedInputNodes = []
+    stagedInputFilesByPixelTypes = {}
+    jobs = []
     try:
-      if parameterFilenames is None:
-        self.addLog(f"Using default registration preset with id '{self.DEFAULT_PRESET_ID}'")
-        defaultPreset = self.getPresetByID(self.DEFAULT_PRESET_ID)
-        parameterFilenames = defaultPreset.getParameterFiles()
+      stagedFixedVolumeNode, stagedFixedVolumeMaskNode = self._prepareInputVolume(
+        fixedVolumeNode, fixedVolumeMaskNode, maximumWorkingSpacing, preparedInputNodes, self.addLog)
+      stagedMovingVolumeNode, _ = self._prepareInputVolume(
+        movingVolumeNode, None, maximumWorkingSpacing, preparedInputNodes, self.addLog)
+      sharedInputVolumes = [
+        [stagedFixedVolumeNode, 'fixed', '-f'],
+        [stagedMovingVolumeNode, 'moving', '-m'],
+        [stagedFixedVolumeMaskNode, 'fixedMask', '-fMask']
+      ]
+      for presetId in presetIds:
+        preset = self.getPresetByID(presetId)
+        if preset is None:
+          raise ValueError(f"Registration preset with id '{presetId}' not found")
+        resultTransformNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLTransformNode", f"ElastixSweep_{presetId}")
+        resultTransformNode.SetHideFromEditors(True)
+        temporaryNodes.append(resultTransformNode)
+        parameterFilenames = preset.createParameterFiles()
+        try:
+          stagedInputFiles = self._stageSharedInputVolumes(
+            sweepDir, sharedInputVolumes, self._getInputPixelTypes(parameterFilenames), stagedInputFilesByPixelTypes)
+          job = self._createRegistrationJob(fixedVolumeNode, movingVolumeNode, parameterFilenames,
+                                            outputTransformNode=resultTransformNode,
+                                            fixedVolumeMaskNode=fixedVolumeMaskNode,
+                                            forceDisplacementFieldOutputTransform=False,
+                                            stagedInputFiles=stagedInputFiles)
+        finally:
+          releaseParameterFiles(parameterFilenames)
+        job.name = presetId
+        job.presetId = presetId
+        jobs.append(job)
+      self._removeTemporaryNodes(preparedInputNodes)
+
+      batch = BatchRegistration(jobs, maximumNumberOfWorkers, logCallback=self.addLog)
+      batch.start()
+      batch.wait()
+
+      # score the results
+      fixedVoxels = slicer.util.arrayFromVolume(fixedVolumeNode)
+      maskVoxels = None
+      if fixedVolumeMaskNode:
+        # the mask may have a different voxel grid than the fixed volume
+        resampledMaskNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode", "ElastixSweepMask")
+        temporaryNodes.append(resampledMaskNode)
+        resampleVolume(fixedVolumeMaskNode, fixedVolumeNode, None, resampledMaskNode, interpolationOrder=0)
+        maskVoxels = slicer.util.arrayFromVolume(resampledMaskNode)
+      resampledMovingNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode", "ElastixSweepResampled")
+      temporaryNodes.append(resampledMovingNode)
+      results = []
+      for job in jobs:
+        result = {"presetId": job.presetId, "state": job.state, "similarity": None,
+                  "elapsedTime": job.getElapsedTime(), "rank": None,
+                  "error": str(job.error) if job.error else None}
+        if job.state == job.COMPLETED:
+          resampleVolume(movingVolumeNode, fixedVolumeNode, job.outputTransformNode, resampledMovingNode,
+                         interpolationOrder=1)
+          result["similarity"] = computeSimilarity(fixedVoxels, slicer.util.arrayFromVolume(resampledMovingNode),
+                                                   maskVoxels, metric)
+        result["transformNode"] = job.outputTransformNode
+        results.append(result)
+    except:
+      for job in jobs:
+        job.cancel()
+      self._removeTemporaryNodes(preparedInputNodes)
+      self._removeTemporaryNodes(temporaryNodes)
+      raise
+    finally:
+      self._releaseSharedInputVolumes(stagedInputFilesByPixelTypes)
+      if self.deleteTemporaryFiles:
+        import shutil
+        shutil.rmtree(sweepDir, ignore_errors=True)
+
+    scoredResults = sorted([result for result in results if result["similarity"] is not None],
+                           key=lambda result: result["similarity"], reverse=True)
+    for rank, result in enumerate(scoredResults):
+      result["rank"] = rank + 1
+    results = scoredResults + [result for result in results if result["similarity"] is None]
+
+    self.addLog(f"Preset sweep results ({metric}):")
+    for result in results:
+      similarity = f"{result['similarity']:.4f}" if result["similarity"] is not None else result["state"]
+      self.addLog(f"  {result['rank'] if result['rank'] else '-'}. {result['presetId']}: {similarity}, "
+                  f"{result['elapsedTime']:.1f} s")
+
+    if scoredResults:
+      bestTransformNode = scoredResults[0]["transformNode"]
+      if outputTransformNode:
+        outputTransformNode.CopyContent(bestTransformNode)
+      if outputVolumeNode:
+        resampleVolume(movingVolumeNode, fixedVolumeNode, bestTransformNode, outputVolumeNode)
+    for result in results:
+      del result["transformNode"]
+    self._removeTemporaryNodes(temporaryNodes)
+    return results
+
+  def _createRegistrationJob(self, fixedVolumeNode, movingVolumeNode, parameterFilenames=None, outputVolumeNode=None,
+                             outputTransformNode=None, fixedVolumeMaskNode=None, movingVolumeMaskNode=None,
+                             forceDisplacementFieldOutputTransform=True, initialTransformNode=None,
+                             stagedInputFiles=None, maximumWorkingSpacing=0.0, parameterOverrides=None):
+    from ElastixLib.job import RegistrationJob
+    from ElastixLib.progress import ElastixOutputParser
+    from ElastixLib.timing import TimingReport
+    from ElastixLib.preset import acquireParameterFiles, releaseParameterFiles, createParameterFilesWithOverrides
+    from ElastixLib.parameters import getStageOverrides
+
+    if parameterFilenames is None:
+      self.addLog(f"Using default registration preset with id '{self.DEFAULT_PRESET_ID}'")
+      defaultPreset = self.getPresetByID(self.DEFAULT_PRESET_ID)
+      parameterFilenames = defaultPreset.createParameterFiles()
+    else:
+      acquireParameterFiles(parameterFilenames)
+
+    if self.loadIntermediateResults and outputTransformNode is not None:
+      # elastix writes the transform after each resolution level, see _addIntermediateResultObserver
+      parameterOverrides = [dict(getStageOverrides(parameterOverrides, stageIndex), WriteTransformParametersEachResolution=True)
+                            for stageIndex in range(len(parameterFilenames))]
 
-      self.cancelRequested = False
+    if parameterOverrides:
+      presetParameterFilenames = parameterFilenames
+      try:
+        parameterFilenames = createParameterFilesWithOverrides(presetParameterFilenames, parameterOverrides)
+      finally:
+        releaseParameterFiles(presetParameterFilenames)
+
+    def createSteps(job):
+      return self._registrationSteps(job, fixedVolumeNode, movingVolumeNode, parameterFilenames, outputVolumeNode,
+                                     outputTransformNode, fixedVolumeMaskNode, movingVolumeMaskNode,
+                                     forceDisplacementFieldOutputTransform, initialTransformNode,
+                                     stagedInputFiles if stagedInputFiles else {}, maximumWorkingSpacing)
+
+    job = RegistrationJob(createSteps, movingVolumeNode.GetName() if movingVolumeNode else "", logCallback=self.addLog)
+    job.logStandardOutput = self.logStandardOutput
+    job.parameterFilenames = parameterFilenames
+    job.outputParser = ElastixOutputParser(parameterFilenames)
+    job.timingReport = TimingReport(job.name)
+    job.memoryLimitBytes = self.processMemoryLimitMB * 1024 * 1024
+    job.addEventCallback(self._recordStageTiming)
+    job.addCompletionCallback(self._onRegistrationJobTimingCompleted)
+    job.fixedVolumeNode = fixedVolumeNode
+    job.movingVolumeNode = movingVolumeNode
+    job.outputVolumeNode = outputVolumeNode
+    job.outputTransformNode = outputTransformNode
+    self.jobs.append(job)
+    job.addCompletionCallback(self.jobs.remove)
+    job.addCompletionCallback(lambda job: releaseParameterFiles(parameterFilenames))
+    return job
+
+  @staticmethod
+  def _recordStageTiming(job, event):
+    """Record each elastix stage (parameter file) as a separate phase in the timing report of the job."""
+    if event["type"] not in ["stageStarted", "registrationCompleted"]:
+      return
+    for phase in job.timingReport.phases:
+      if phase["name"].startswith("ElastixStage"):
+        job.timingReport.endPhase(phase)
+    if event["type"] == "stageStarted":
+      job.timingReport.beginPhase(f"ElastixStage{event['stage']}",
+                                  parameterFile=os.path.basename(event["parameterFilename"]))
+
+  def cancelAllJobs(self):
+    for job in list(self.jobs):
+      job.cancel()
+
+  @property
+  def isRunning(self):
+    return len(self.jobs) > 0
+
+  @property
+  def cancelRequested(self):
+    return any(job.cancelRequested for job in self.jobs)
+
+  @cancelRequested.setter
+  def cancelRequested(self, value):
+    if value:
+      self.cancelAllJobs()
+
+  def _registrationSteps(self, job, fixedVolumeNode, movingVolumeNode, parameterFilenames, outputVolumeNode,
+                         outputTransformNode, fixedVolumeMaskNode, movingVolumeMaskNode,
+                         forceDisplacementFieldOutputTransform, initialTransformNode, stagedInputFiles,
+                         maximumWorkingSpacing=0.0):
+    """Generator that performs the registration. It yields each started process and it is resumed by the job
+    when the process has completed successfully."""
+    from ElastixLib.cache import getDirectorySize
+    from ElastixLib.timing import getFileSize
+
+    timingReport = job.timingReport
+    workspaceManager = self.getWorkspaceManager()
+    tempDir = workspaceManager.createWorkspace(
+      self._estimateWorkspaceSize(fixedVolumeNode, movingVolumeNode, outputVolumeNode, outputTransformNode),
+      allowRam=self.deleteTemporaryFiles)
+    job.tempDir = tempDir
+    inputFiles = {}
+    temporaryNodes = []
 
-      self.addLog(f'Volume registration is started in working directory: {tempDir}')
+    try:
+      job.addLog(f'Volume registration is started in working directory: {tempDir}'
+                 f'{" (in RAM)" if workspaceManager.isInRam(tempDir) else ""}')
 
       # Specify (and create) input/output locations
       inputDir = createDirectory(os.path.join(tempDir, self.INPUT_DIR_NAME))
       resultTransformDir = createDirectory(os.path.join(tempDir, self.OUTPUT_TRANSFORM_DIR_NAME))
 
-      # compose parameters for running Elastix
-      inputParamsElastix = self._addInputVolumes(inputDir, [
-        [fixedVolumeNode, 'fixed.mha', '-f'],
-        [movingVolumeNode, 'moving.mha', '-m'],
-        [fixedVolumeMaskNode, 'fixedMask.mha', '-fMask'],
-        [movingVolumeMaskNode, 'movingMask.mha', '-mMask']
-      ])
-
+      # crop masked volumes to the mask region and downsample them to the working resolution
+      # (staged fixed volume is already processed by the caller)
+      exportedFixedVolumeNode, exportedFixedVolumeMaskNode = fixedVolumeNode, fixedVolumeMaskNode
+      exportedMovingVolumeNode, exportedMovingVolumeMaskNode = movingVolumeNode, movingVolumeMaskNode
+      if self.cropInputsToMasks:
+        with timingReport.measure("InputCrop"):
+          if '-f' not in stagedInputFiles:
+            exportedFixedVolumeNode, exportedFixedVolumeMaskNode = self._cropInputVolumeToMask(
+              fixedVolumeNode, fixedVolumeMaskNode, temporaryNodes, job.addLog)
+          exportedMovingVolumeNode, exportedMovingVolumeMaskNode = self._cropInputVolumeToMask(
+            movingVolumeNode, movingVolumeMaskNode, temporaryNodes, job.addLog)
+      if maximumWorkingSpacing > 0:
+        with timingReport.measure("InputDownsample"):
+          if '-f' not in stagedInputFiles:
+            exportedFixedVolumeNode, exportedFixedVolumeMaskNode = self._downsampleInputVolume(
+              exportedFixedVolumeNode, exportedFixedVolumeMaskNode, maximumWorkingSpacing, temporaryNodes, job.addLog)
+          exportedMovingVolumeNode, exportedMovingVolumeMaskNode = self._downsampleInputVolume(
+            exportedMovingVolumeNode, exportedMovingVolumeMaskNode, maximumWorkingSpacing, temporaryNodes, job.addLog)
+
+      # compose parameters for running Elastix (volumes in stagedInputFiles are already exported by the caller)
+      with timingReport.measure("InputExport") as phase:
+        inputFiles = self._addInputVolumes(inputDir, [inputVolume for inputVolume in [
+          [exportedFixedVolumeNode, 'fixed', '-f'],
+          [exportedMovingVolumeNode, 'moving', '-m'],
+          [exportedFixedVolumeMaskNode, 'fixedMask', '-fMask'],
+          [exportedMovingVolumeMaskNode, 'movingMask', '-mMask']
+        ] if inputVolume[2] not in stagedInputFiles], phase, self._getInputPixelTypes(parameterFilenames))
+      self._removeTemporaryNodes(temporaryNodes)
+      allInputFiles = {**stagedInputFiles, **inputFiles}
+      inputVolumeArguments = []
+      for paramName, filePath in allInputFiles.items():
+        inputVolumeArguments += [paramName, filePath]
+
+      initialTransformArguments = []
       if initialTransformNode is not None:
-        inputParamsElastix += self._addInitialTransform(initialTransformNode, inputDir)
-
-      inputParamsElastix += self._addParameterFiles(parameterFilenames)
-      inputParamsElastix += ['-out', resultTransformDir]
-
-      elastixProcess = self.startElastix(inputParamsElastix)
-      self.logProcessOutput(elastixProcess)
-
-      if self.cancelRequested:
-        self.addLog("User requested cancel.")
+        with timingReport.measure("InitialTransformExport") as phase:
+          initialTransformArguments = self._addInitialTransform(initialTransformNode, inputDir)
+          phase["bytesWritten"] = (getFileSize(initialTransformArguments[1])
+                                   + getFileSize(os.path.join(inputDir, 'initialTransform.h5')))
+
+      resultCache = self.getResultCache() if self.useResultCache else None
+      runStagesSeparately = self.useStageCache and len(parameterFilenames) > 1
+      if resultCache or runStagesSeparately:
+        inputVolumes = {'-f': fixedVolumeNode, '-m': movingVolumeNode,
+                        '-fMask': fixedVolumeMaskNode, '-mMask': movingVolumeMaskNode}
+        registrationKeyArguments = dict(
+          inputVolumes={paramName: volumeNode for paramName, volumeNode in inputVolumes.items() if volumeNode},
+          initialTransformFilePath=os.path.join(inputDir, 'initialTransform.h5') if initialTransformNode is not None else None,
+          elastixVersion=self.getElastixVersion(),
+          variant=(f"crop {self.cropMarginMM}" if self.cropInputsToMasks else "")
+                  + (f" spacing {maximumWorkingSpacing}" if maximumWorkingSpacing > 0 else ""))
+      if resultCache:
+        resultCacheKey = resultCache.getRegistrationKey(parameterFilenames=parameterFilenames, **registrationKeyArguments)
+
+      if resultCache and not job.bypassResultCache and resultCache.restoreResult(resultCacheKey, resultTransformDir, tempDir):
+        job.addLog("Registration result is restored from the result cache")
       else:
-        self._processElastixOutput(tempDir, parameterFilenames, fixedVolumeNode, movingVolumeNode,
-                                   outputVolumeNode, outputTransformNode, forceDisplacementFieldOutputTransform)
-        self.addLog("Registration is completed")
+        job.addLog("Register volumes...")
+        with timingReport.measure("Elastix") as phase:
+          if runStagesSeparately:
+            yield from self._runElastixStages(job, inputVolumeArguments, initialTransformArguments, parameterFilenames,
+                                              tempDir, outputTransformNode, registrationKeyArguments)
+          else:
+            yield from self._runElastix(
+              job, inputVolumeArguments + initialTransformArguments + self._addParameterFiles(parameterFilenames),
+              resultTransformDir, outputTransformNode)
+          self._recordStageTiming(job, {"type": "registrationCompleted"})
+          phase["bytesRead"] = sum(getFileSize(path) for path in allInputFiles.values())
+          phase["bytesWritten"] = getDirectorySize(resultTransformDir)
+          phase["details"].update(job.getLastProcessStatistics())
+        if resultCache:
+          resultCache.storeResult(resultCacheKey, resultTransformDir, tempDir)
+
+      if resultCache:
+        statistics = resultCache.getStatistics()
+        job.addLog(f"Result cache: {statistics['hits']} hits, {statistics['misses']} misses "
+                   f"(hit rate {statistics['hitRate'] * 100:.0f}%), {statistics['sizeBytes'] / 1024 / 1024:.1f} MB used")
+
+      resultTransformParameters = {}
+      if (self.cropInputsToMasks and fixedVolumeMaskNode is not None) or maximumWorkingSpacing > 0:
+        # resampling grid must be the original fixed volume, not the cropped or downsampled one
+        from ElastixLib.crop import getVolumeGeometryParameters
+        resultTransformParameters.update(getVolumeGeometryParameters(fixedVolumeNode))
+      if self.matchResultPixelTypeToMovingVolume:
+        resultTransformParameters.update(self._getResultPixelTypeParameters(movingVolumeNode))
+      if resultTransformParameters:
+        self._setTransformParameters(
+          os.path.join(resultTransformDir, f'TransformParameters.{len(parameterFilenames) - 1}.txt'),
+          resultTransformParameters)
+
+      # the cropped or downsampled moving volume cannot be used for resampling, transformix exports the original if needed
+      movingVolumePath = allInputFiles.get('-m') if exportedMovingVolumeNode is movingVolumeNode else None
+      yield from self._processElastixOutput(job, tempDir, parameterFilenames, fixedVolumeNode, movingVolumeNode,
+                                            outputVolumeNode, outputTransformNode,
+                                            forceDisplacementFieldOutputTransform, movingVolumePath)
+      job.addLog("Registration is completed")
 
     finally: # Clean up
-      if self.deleteTemporaryFiles:
-        import shutil
-        shutil.rmtree(tempDir)
-      self.isRunning = False
-      self.cancelRequested = False
+      self._removeTemporaryNodes(temporaryNodes)
+      self._releaseInputVolumes(inputFiles)
+      workspaceManager.releaseWorkspace(tempDir, delete=self.deleteTemporaryFiles)
+
+  def _processElastixOutput(self, job, tempDir, parameterFilenames, fixedVolumeNode, movingVolumeNode,
+                            outputVolumeNode, outputTransformNode, forceDisplacementFieldOutputTransform,
+                            movingVolumePath):
 
-  def _processElastixOutput(self, tempDir, parameterFilenames, fixedVolumeNode, movingVolumeNode, outputVolumeNode,
-                            outputTransformNode, forceDisplacementFieldOutputTransform):
+    from ElastixLib.cache import getDirectorySize
+    from ElastixLib.timing import getFileSize
+    timingReport = job.timingReport
 
     resultTransformDir = os.path.join(tempDir, self.OUTPUT_TRANSFORM_DIR_NAME)
     transformFileNameBase = os.path.join(resultTransformDir, 'TransformParameters.' + str(len(parameterFilenames) - 1))
@@ -600,39 +1277,78 @@ class ElastixLogic(ScriptedLoadableModuleLogic, PresetManagerLogic):
     elastixTransformFileImported = False
     if outputTransformNode is not None and not forceDisplacementFieldOutputTransform:
       # NB: if return value is False, Could not load transform (probably not linear and bspline)
-      try:
-        self.loadTransformFromFile(f"{transformFileNameBase}-Composite.h5", outputTransformNode)
-        elastixTransformFileImported = True
-      except:
-        elastixTransformFileImported = False
+      with timingReport.measure("TransformLoad", source="composite") as phase:
+        try:
+          self.loadTransformFromFile(f"{transformFileNameBase}-Composite.h5", outputTransformNode)
+          elastixTransformFileImported = True
+          phase["bytesRead"] = getFileSize(f"{transformFileNameBase}-Composite.h5")
+        except:
+          elastixTransformFileImported = False
+
+    # Create the transform from the transform parameter files if the composite transform could not be loaded
+    # or a grid transform is requested (it is sampled at the control point spacing instead of at every voxel)
+    nativeTransformImported = False
+    if outputTransformNode is not None and not elastixTransformFileImported and self.useNativeResultTransform:
+      with timingReport.measure("TransformLoad", source="parameters") as phase:
+        nativeTransformImported = self._loadNativeResultTransform(
+          f"{transformFileNameBase}.txt", outputTransformNode, fixedVolumeNode, forceDisplacementFieldOutputTransform)
+        phase["bytesRead"] = getDirectorySize(resultTransformDir) if nativeTransformImported else 0
+      elastixTransformFileImported = nativeTransformImported
+
+    # Resample output volume in-process if the result transform can be loaded in Slicer
+    outputVolumeResampled = False
+    if outputVolumeNode is not None and self.resampleOutputVolumeInProcess:
+      with timingReport.measure("OutputVolumeResample"):
+        outputVolumeResampled = self._resampleOutputVolume(
+          outputVolumeNode, fixedVolumeNode, movingVolumeNode,
+          outputTransformNode if elastixTransformFileImported else None, transformFileNameBase)
 
     resultResampleDir = createDirectory(os.path.join(tempDir, self.OUTPUT_RESAMPLE_DIR_NAME))
     # Run Transformix to get resampled moving volume or transformation as a displacement field
-    if outputVolumeNode is not None or not elastixTransformFileImported:
+    runTransformixForVolume = outputVolumeNode is not None and not outputVolumeResampled
+    runTransformixForTransform = outputTransformNode is not None and not elastixTransformFileImported
+    if runTransformixForVolume or runTransformixForTransform:
+      movingVolumeFiles = {}
       inputParamsTransformix = [
         '-tp', f'{transformFileNameBase}.txt',
         '-out', resultResampleDir
       ]
-      if outputVolumeNode:
-        inputDir = os.path.join(tempDir, self.INPUT_DIR_NAME)
-        inputParamsTransformix += ['-in', os.path.join(inputDir, 'moving.mha')]
+      if runTransformixForVolume:
+        if movingVolumePath is None:
+          movingVolumeFiles = self._addInputVolumes(tempDir, [[movingVolumeNode, 'movingFull', '-in']])
+          movingVolumePath = movingVolumeFiles['-in']
+        inputParamsTransformix += ['-in', movingVolumePath]
 
-      if outputTransformNode:
+      if runTransformixForTransform:
         inputParamsTransformix += ['-def', 'all']
 
-      transformixProcess = self.startTransformix(inputParamsTransformix)
-      self.logProcessOutput(transformixProcess)
-
-    if outputVolumeNode:
-      self._loadTransformedOutputVolume(outputVolumeNode, resultResampleDir)
+      job.addLog("Generate output...")
+      with timingReport.measure("Transformix") as phase:
+        try:
+          yield self.startTransformix(inputParamsTransformix, job)
+        finally:
+          self._releaseInputVolumes(movingVolumeFiles)
+        phase["bytesRead"] = getFileSize(f'{transformFileNameBase}.txt')
+        if runTransformixForVolume:
+          phase["bytesRead"] += getFileSize(movingVolumePath)
+        phase["bytesWritten"] = getDirectorySize(resultResampleDir)
+        phase["details"].update(job.getLastProcessStatistics())
+
+    if runTransformixForVolume:
+      with timingReport.measure("OutputVolumeLoad") as phase:
+        self._loadTransformedOutputVolume(outputVolumeNode, resultResampleDir)
+        phase["bytesRead"] = getFileSize(os.path.join(resultResampleDir, "result.mhd"))
 
     if outputTransformNode is not None and not elastixTransformFileImported:
       outputTransformPath = os.path.join(resultResampleDir, "deformationField.mhd")
-      try:
-        self.loadTransformFromFile(outputTransformPath, outputTransformNode)
-      except:
-        raise RuntimeError(f"Failed to load output transform from {outputTransformPath}")
+      with timingReport.measure("TransformLoad", source="displacementField") as phase:
+        try:
+          self.loadTransformFromFile(outputTransformPath, outputTransformNode)
+        except:
+          raise RuntimeError(f"Failed to load output transform from {outputTransformPath}")
+        phase["bytesRead"] = getFileSize(outputTransformPath)
 
+    if outputTransformNode is not None and (nativeTransformImported or runTransformixForTransform):
       if slicer.app.majorVersion >= 5 or (slicer.app.majorVersion >= 4 and slicer.app.minorVersion >= 11):
         outputTransformNode.AddNodeReferenceID(
           slicer.vtkMRMLTransformNode.GetMovingNodeReferenceRole(), movingVolumeNode.GetID()
@@ -641,6 +1357,259 @@ class ElastixLogic(ScriptedLoadableModuleLogic, PresetManagerLogic):
           slicer.vtkMRMLTransformNode.GetFixedNodeReferenceRole(), fixedVolumeNode.GetID()
         )
 
+  def _cropInputVolumeToMask(self, volumeNode, maskNode, temporaryNodes, log):
+    """Returns volume and mask cropped to the bounding box of the mask, extended by cropMarginMM.
+    The original nodes are returned if there is no mask or cropping is disabled. Created nodes are added to temporaryNodes.
+    """
+    if not self.cropInputsToMasks or volumeNode is None or maskNode is None:
+      return volumeNode, maskNode
+    from ElastixLib.crop import getMaskBounds, cropVolume
+    maskBounds = getMaskBounds(maskNode, self.cropMarginMM)
+    if maskBounds is None:
+      log(f"Mask {maskNode.GetName()} is empty, {volumeNode.GetName()} is not cropped")
+      return volumeNode, maskNode
+    croppedVolumeNode = cropVolume(volumeNode, maskBounds)
+    croppedMaskNode = cropVolume(maskNode, maskBounds)
+    for croppedNode in [croppedVolumeNode, croppedMaskNode]:
+      if croppedNode:
+        temporaryNodes.append(croppedNode)
+    if croppedVolumeNode:
+      log(f"{volumeNode.GetName()} is cropped to the mask region: {volumeNode.GetImageData().GetDimensions()}"
+          f" -> {croppedVolumeNode.GetImageData().GetDimensions()} voxels")
+    return croppedVolumeNode or volumeNode, croppedMaskNode or maskNode
+
+  def _downsampleInputVolume(self, volumeNode, maskNode, maximumSpacing, temporaryNodes, log):
+    """Returns volume and mask downsampled to maximumSpacing (original nodes are returned if they are not coarser).
+    Created nodes are added to temporaryNodes.
+    """
+    if volumeNode is None or maximumSpacing <= 0:
+      return volumeNode, maskNode
+    from ElastixLib.resample import downsampleVolume
+    downsampledVolumeNode = downsampleVolume(volumeNode, maximumSpacing)
+    downsampledMaskNode = downsampleVolume(maskNode, maximumSpacing, isMask=True) if maskNode else None
+    for downsampledNode in [downsampledVolumeNode, downsampledMaskNode]:
+      if downsampledNode:
+        temporaryNodes.append(downsampledNode)
+    if downsampledVolumeNode:
+      log(f"{volumeNode.GetName()} is downsampled to {maximumSpacing} mm working spacing: "
+          f"{volumeNode.GetImageData().GetDimensions()} -> {downsampledVolumeNode.GetImageData().GetDimensions()} voxels")
+    return downsampledVolumeNode or volumeNode, downsampledMaskNode or maskNode
+
+  def _prepareInputVolume(self, volumeNode, maskNode, maximumWorkingSpacing, temporaryNodes, log):
+    """Returns volume and mask cropped (see _cropInputVolumeToMask) and downsampled (see _downsampleInputVolume)
+    the same way as in a registration job. Created nodes are added to temporaryNodes."""
+    volumeNode, maskNode = self._cropInputVolumeToMask(volumeNode, maskNode, temporaryNodes, log)
+    return self._downsampleInputVolume(volumeNode, maskNode, maximumWorkingSpacing, temporaryNodes, log)
+
+  def _stageSharedInputVolumes(self, stageDir, inputVolumes, pixelTypes, stagedInputFilesByPixelTypes):
+    """Returns input files that are shared by several registration jobs (see stagedInputFiles of _registrationSteps).
+
+    Volumes are exported once for each distinct set of internal pixel types, so that each job gets input files
+    in the pixel type of its own parameter files.
+
+    :param inputVolumes: see _addInputVolumes
+    :param pixelTypes: internal pixel types of the job, see _getInputPixelTypes
+    :param stagedInputFilesByPixelTypes: files that are already exported, new files are added to it.
+      Release the files with _releaseSharedInputVolumes.
+    """
+    paramNames = [paramName for volumeNode, filename, paramName in inputVolumes if volumeNode]
+    pixelTypesKey = tuple(sorted((paramName, pixelType) for paramName, pixelType in pixelTypes.items()
+                                 if paramName in paramNames))
+    if pixelTypesKey not in stagedInputFilesByPixelTypes:
+      if pixelTypesKey:
+        # files of different pixel types have the same name, keep them in separate folders
+        stageDir = createDirectory(os.path.join(stageDir, "_".join(
+          f"{paramName.lstrip('-')}-{pixelType.replace(' ', '')}" for paramName, pixelType in pixelTypesKey)))
+      stagedInputFilesByPixelTypes[pixelTypesKey] = self._addInputVolumes(stageDir, inputVolumes, pixelTypes=pixelTypes)
+    return stagedInputFilesByPixelTypes[pixelTypesKey]
+
+  def _releaseSharedInputVolumes(self, stagedInputFilesByPixelTypes):
+    for stagedInputFiles in stagedInputFilesByPixelTypes.values():
+      self._releaseInputVolumes(stagedInputFiles)
+
+  @staticmethod
+  def _removeTemporaryNodes(temporaryNodes):
+    for node in temporaryNodes:
+      slicer.mrmlScene.RemoveNode(node)
+    del temporaryNodes[:]
+
+  @staticmethod
+  def _setTransformParameters(transformParameterFilePath, parameters):
+    """Replace values in a transform parameter file.
+
+    :param parameters: dict of parameter name -> list of values
+    """
+    from ElastixLib.parameters import setParameterValuesInText
+    with open(transformParameterFilePath, 'r') as file:
+      text = file.read()
+    for key, values in parameters.items():
+      text = setParameterValuesInText(text, key, values)
+    with open(transformParameterFilePath, 'w') as file:
+      file.write(text)
+
+  def _runElastix(self, job, arguments, outputDir, outputTransformNode):
+    """Generator that runs elastix, see _registrationSteps. If loadIntermediateResults is enabled then
+    results of each resolution level are loaded into outputTransformNode while elastix is running."""
+    stopObservingIntermediateResults = None
+    if self.loadIntermediateResults and outputTransformNode is not None:
+      stopObservingIntermediateResults = self._addIntermediateResultObserver(job, outputDir, outputTransformNode)
+    try:
+      yield self.startElastix(arguments + ['-out', outputDir], job)
+    finally:
+      if stopObservingIntermediateResults:
+        stopObservingIntermediateResults()
+
+  def _runElastixStages(self, job, inputVolumeArguments, initialTransformArguments, parameterFilenames, tempDir,
+                        outputTransformNode, registrationKeyArguments):
+    """Generator that runs elastix separately for each stage (parameter file), see _registrationSteps.
+
+    The result of each stage is cached with a key that is computed from the inputs and the parameter files of the stage
+    and all the stages before it. Therefore, after changing a parameter file, only that stage and the stages after it
+    are computed again.
+
+    :param registrationKeyArguments: arguments of RegistrationStageCache.getRegistrationKey, except parameterFilenames
+    """
+    import shutil
+    stageCache = self.getStageCache()
+    resultTransformDir = os.path.join(tempDir, self.OUTPUT_TRANSFORM_DIR_NAME)
+    for stageIndex, parameterFilename in enumerate(parameterFilenames):
+      stageResultPath = os.path.join(resultTransformDir, f"TransformParameters.{stageIndex}.txt")
+      stageKey = stageCache.getRegistrationKey(parameterFilenames=parameterFilenames[:stageIndex + 1],
+                                               **registrationKeyArguments)
+      if not job.bypassResultCache and stageCache.restoreStageResult(stageKey, stageResultPath, tempDir):
+        job.addLog(f"Result of stage {stageIndex + 1} is restored from the stage cache")
+        continue
+      # start from the result of the previous stage, the same way as elastix does when it runs all stages
+      if stageIndex > 0:
+        stageInitialTransformArguments = ['-t0', os.path.join(resultTransformDir, f"TransformParameters.{stageIndex - 1}.txt")]
+      else:
+        stageInitialTransformArguments = initialTransformArguments
+      stageOutputDir = createDirectory(os.path.join(tempDir, f"{self.OUTPUT_TRANSFORM_DIR_NAME}-stage{stageIndex}"))
+      job.outputParser.startStage(stageIndex)
+      yield from self._runElastix(
+        job, inputVolumeArguments + stageInitialTransformArguments + self._addParameterFiles([parameterFilename]),
+        stageOutputDir, outputTransformNode)
+      shutil.copyfile(os.path.join(stageOutputDir, "TransformParameters.0.txt"), stageResultPath)
+      stageCache.storeStageResult(stageKey, stageResultPath, tempDir)
+
+    statistics = stageCache.getStatistics()
+    job.addLog(f"Stage cache: {statistics['hits']} hits, {statistics['misses']} misses "
+               f"(hit rate {statistics['hitRate'] * 100:.0f}%), {statistics['sizeBytes'] / 1024 / 1024:.1f} MB used")
+
+  def _addIntermediateResultObserver(self, job, resultTransformDir, outputTransformNode):
+    """Load transforms that elastix writes after each resolution level (WriteTransformParametersEachResolution)
+    into the output transform node while the registration is running.
+
+    :return: function that stops loading intermediate results
+    """
+    import re
+    intermediateResultPattern = re.compile(r"TransformParameters\.(\d+)\.R(\d+)\.txt$")
+    loadedFilenames = set()
+    observing = [True]
+
+    def loadNewResult(job, event):
+      # elastix writes the result of a resolution level before starting the next one
+      if not observing[0] or event["type"] not in ["resolutionStarted", "stageStarted", "registrationCompleted"]:
+        return
+      try:
+        filenames = os.listdir(resultTransformDir)
+      except OSError:
+        return
+      newResults = []
+      for filename in filenames:
+        match = intermediateResultPattern.match(filename)
+        if match and filename not in loadedFilenames:
+          newResults.append((int(match.group(1)), int(match.group(2)), filename))
+      if not newResults:
+        return
+      loadedFilenames.update(filename for stage, resolution, filename in newResults)
+      stage, resolution, filename = max(newResults)
+      if self._loadNativeResultTransform(os.path.join(resultTransformDir, filename), outputTransformNode, None, False):
+        job.addLog(f"Intermediate result of stage {stage + 1}, resolution {resolution + 1} is loaded")
+
+    def stopObserving():
+      observing[0] = False
+
+    job.addEventCallback(loadNewResult)
+    return stopObserving
+
+  @staticmethod
+  def _getResultPixelTypeParameters(movingVolumeNode):
+    """Returns ResultImagePixelType that preserves the pixel type of the moving volume (empty if elastix does not support it)."""
+    from ElastixLib.parameters import PIXEL_TYPES
+    pixelType = movingVolumeNode.GetImageData().GetScalarTypeAsString()
+    return {"ResultImagePixelType": [pixelType]} if pixelType in PIXEL_TYPES else {}
+
+  def _getInputPixelTypes(self, parameterFilenames):
+    """Returns elastix command-line parameter name (-f, -m) -> internal pixel type of the input volume in elastix,
+    if exportInInternalPixelType is enabled and all parameter files use the same type."""
+    if not self.exportInInternalPixelType:
+      return {}
+    from ElastixLib.parameters import readParameterFile, getParameterValue, PIXEL_TYPES
+    parameters = [readParameterFile(parameterFilename) for parameterFilename in parameterFilenames]
+    pixelTypes = {}
+    for paramName, key in [('-f', 'FixedInternalImagePixelType'), ('-m', 'MovingInternalImagePixelType')]:
+      # elastix uses float if the internal pixel type is not specified
+      stagePixelTypes = set(getParameterValue(stageParameters, key, "float") for stageParameters in parameters)
+      if len(stagePixelTypes) == 1 and next(iter(stagePixelTypes)) in PIXEL_TYPES:
+        pixelTypes[paramName] = stagePixelTypes.pop()
+    return pixelTypes
+
+  def _loadNativeResultTransform(self, transformParameterFilePath, outputTransformNode, fixedVolumeNode,
+                                 forceGridTransform):
+    """Set the registration result in outputTransformNode, created from elastix transform parameter files.
+
+    :param forceGridTransform: if True then the transform is sampled on a grid that covers the fixed volume,
+      at the B-spline control point spacing (or at 10 mm for linear transforms).
+    :return: False if the transform cannot be created (e.g., unsupported transform type)
+    """
+    from ElastixLib.transforms import createTransformFromParameterFile, createGridTransform, getBSplineGridSpacing
+    try:
+      transform = createTransformFromParameterFile(transformParameterFilePath)
+      if forceGridTransform:
+        gridSpacing = getBSplineGridSpacing(transformParameterFilePath) or 10.0
+        transform = createGridTransform(transform, fixedVolumeNode, gridSpacing)
+    except Exception as e:
+      logging.info(f"Result transform cannot be created from {transformParameterFilePath}: {e}")
+      return False
+    outputTransformNode.SetAndObserveTransformFromParent(transform)
+    return True
+
+  def _resampleOutputVolume(self, outputVolumeNode, fixedVolumeNode, movingVolumeNode, resultTransformNode,
+                            transformFileNameBase):
+    """Resample the moving volume into the output volume without running transformix.
+
+    :param resultTransformNode: node that contains the registration result, if None then it is loaded
+      from the composite transform file (or created from the transform parameter file) into a temporary node.
+    :return: False if the result transform cannot be loaded (e.g., it is not linear or B-spline)
+    """
+    from ElastixLib.resample import resampleVolume
+    temporaryTransformNode = None
+    try:
+      if resultTransformNode is None:
+        compositeTransformPath = f"{transformFileNameBase}-Composite.h5"
+        if os.path.isfile(compositeTransformPath):
+          try:
+            temporaryTransformNode = slicer.util.loadTransform(compositeTransformPath)
+          except:
+            temporaryTransformNode = None
+        if temporaryTransformNode is None and self.useNativeResultTransform:
+          temporaryTransformNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLTransformNode")
+          if not self._loadNativeResultTransform(f"{transformFileNameBase}.txt", temporaryTransformNode,
+                                                 fixedVolumeNode, False):
+            slicer.mrmlScene.RemoveNode(temporaryTransformNode)
+            temporaryTransformNode = None
+        if temporaryTransformNode is None:
+          logging.info(f"Result transform cannot be loaded from {transformFileNameBase}, transformix is used for resampling")
+          return False
+        resultTransformNode = temporaryTransformNode
+      self.addLog("Resample output volume...")
+      resampleVolume(movingVolumeNode, fixedVolumeNode, resultTransformNode, outputVolumeNode)
+      return True
+    finally:
+      if temporaryTransformNode is not None:
+        slicer.mrmlScene.RemoveNode(temporaryTransformNode)
+
   def _loadTransformedOutputVolume(self, outputVolumeNode, resultResampleDir):
     outputVolumePath = os.path.join(resultResampleDir, "result.mhd")
     try:
@@ -653,15 +1622,127 @@ class ElastixLogic(ScriptedLoadableModuleLogic, PresetManagerLogic):
     except:
       raise RuntimeError(f"Failed to load output volume from {outputVolumePath}")
 
-  def _addInputVolumes(self, inputDir, inputVolumes):
-    params = []
-    for volumeNode, filename, paramName in inputVolumes:
-      if not volumeNode:
-        continue
-      filePath = os.path.join(inputDir, filename)
-      slicer.util.exportNode(volumeNode, filePath)
-      params += [paramName, filePath]
-    return params
+  def getInputStagingCache(self):
+    if self.inputStagingCache is None:
+      from ElastixLib.cache import InputStagingCache
+      self.inputStagingCache = InputStagingCache()
+      slicer.app.connect("aboutToQuit()", self._onApplicationAboutToQuit)
+    return self.inputStagingCache
+
+  def _onApplicationAboutToQuit(self):
+    if self.inputStagingCache is not None and self.deleteTemporaryFiles:
+      self.inputStagingCache.purge()
+
+  def getStageCache(self):
+    if self.stageCache is None:
+      from ElastixLib.cache import RegistrationStageCache
+      self.stageCache = RegistrationStageCache()
+    return self.stageCache
+
+  def getWorkspaceManager(self):
+    if self.workspaceManager is None:
+      from ElastixLib.workspace import WorkspaceManager
+      self.workspaceManager = WorkspaceManager()
+    return self.workspaceManager
+
+  def _estimateWorkspaceSize(self, fixedVolumeNode, movingVolumeNode, outputVolumeNode, outputTransformNode):
+    """Rough upper limit of the size of files that a registration writes into its working directory."""
+    fixedSize = fixedVolumeNode.GetImageData().GetActualMemorySize() * 1024
+    movingSize = movingVolumeNode.GetImageData().GetActualMemorySize() * 1024
+    numberOfFixedVoxels = fixedVolumeNode.GetImageData().GetNumberOfPoints()
+    # exported inputs (if not staged in the cache) and transformix outputs
+    estimatedSize = fixedSize + movingSize
+    if outputVolumeNode is not None:
+      estimatedSize += numberOfFixedVoxels * 4
+    if outputTransformNode is not None:
+      # displacement field: 3 float components per voxel
+      estimatedSize += numberOfFixedVoxels * 3 * 4
+    return estimatedSize
+
+  def getResultCache(self):
+    if self.resultCache is None:
+      from ElastixLib.cache import RegistrationResultCache
+      self.resultCache = RegistrationResultCache()
+    return self.resultCache
+
+  def _addInputVolumes(self, inputDir, inputVolumes, timingPhase=None, pixelTypes=None):
+    """Export input volumes and return a dict of elastix command-line parameter name -> file path.
+
+    :param inputVolumes: list of [volumeNode, file name without extension, elastix command-line parameter name]
+    :param timingPhase: if specified, the size of exported files is added to its bytesWritten
+    :param pixelTypes: dict of elastix command-line parameter name -> elastix pixel type that the volume is converted to
+
+    Volumes are written in inputVolumeFormat, masks are always written as unsigned char.
+    If the input staging cache is enabled then files that were already exported by a previous
+    registration (and the volume has not changed since) are reused. If temporary files are kept then
+    the cache is not used, so that all inputs of the registration are in inputDir.
+    """
+    extension, useCompression = self.INPUT_VOLUME_FORMATS[self.inputVolumeFormat]
+    stagingCache = self.getInputStagingCache() if self.useInputStagingCache and self.deleteTemporaryFiles else None
+    inputFiles = {}
+    try:
+      for volumeNode, filename, paramName in inputVolumes:
+        if not volumeNode:
+          continue
+        isMask = paramName in ['-fMask', '-mMask']
+        pixelType = "unsigned char" if isMask else pixelTypes.get(paramName) if pixelTypes else None
+        exportFunction = lambda node, filePath: self._exportInputVolume(node, filePath, isMask, useCompression, pixelType)
+        startTime = time.time()
+        if stagingCache:
+          numberOfMisses = stagingCache.misses
+          filePath = stagingCache.stageVolume(volumeNode, filename + extension, exportFunction,
+                                              variant=f"compression={useCompression},pixelType={pixelType}")
+          exported = stagingCache.misses > numberOfMisses
+        else:
+          filePath = os.path.join(inputDir, filename + extension)
+          exportFunction(volumeNode, filePath)
+          exported = True
+        if exported:
+          self.addLog(f"Exported {filename} ({self.inputVolumeFormat}{', ' + pixelType if pixelType else ''}) "
+                      f"in {time.time() - startTime:.2f} s")
+          if timingPhase is not None:
+            from ElastixLib.timing import getFileSize
+            timingPhase["bytesWritten"] += getFileSize(filePath)
+        inputFiles[paramName] = filePath
+    except:
+      self._releaseInputVolumes(inputFiles)
+      raise
+    if stagingCache:
+      statistics = stagingCache.getStatistics()
+      self.addLog(f"Input staging cache: {statistics['hits']} hits, {statistics['misses']} misses, "
+                  f"{statistics['sizeBytes'] / 1024 / 1024:.1f} MB used")
+    return inputFiles
+
+  def _exportInputVolume(self, volumeNode, filePath, isMask, useCompression, pixelType=None):
+    """Write volume to file. If pixelType (elastix pixel type name) is specified then voxels are converted to it."""
+    from ElastixLib.parameters import PIXEL_TYPES
+    properties = {"useCompression": useCompression}
+    if not pixelType or volumeNode.GetImageData().GetScalarTypeAsString() == pixelType:
+      slicer.util.exportNode(volumeNode, filePath, properties)
+      return
+    voxels = slicer.util.arrayFromVolume(volumeNode)
+    if isMask:
+      # elastix only needs to know which voxels are non-zero, write masks with the smallest pixel type
+      convertedVoxels = (voxels != 0).astype(PIXEL_TYPES[pixelType])
+    else:
+      # elastix would convert the volume to its internal pixel type when reading it
+      convertedVoxels = voxels.astype(PIXEL_TYPES[pixelType])
+    convertedNode = slicer.mrmlScene.AddNewNodeByClass(
+      "vtkMRMLLabelMapVolumeNode" if isMask else "vtkMRMLScalarVolumeNode", "ElastixTempConverted")
+    try:
+      slicer.util.updateVolumeFromArray(convertedNode, convertedVoxels)
+      ijkToRas = vtk.vtkMatrix4x4()
+      volumeNode.GetIJKToRASMatrix(ijkToRas)
+      convertedNode.SetIJKToRASMatrix(ijkToRas)
+      slicer.util.exportNode(convertedNode, filePath, properties)
+    finally:
+      slicer.mrmlScene.RemoveNode(convertedNode)
+
+  def _releaseInputVolumes(self, inputFiles):
+    if self.inputStagingCache is None:
+      return
+    for filePath in inputFiles.values():
+      self.inputStagingCache.release(filePath)
 
   def _addParameterFiles(self, parameterFilenames):
     params = []
@@ -720,9 +1801,30 @@ class ElastixTest(ScriptedLoadableModuleTest):
     self.setUp()
     self.test_ElastixPresets()
     self.test_CopyAndDeleteElastixPreset()
+    self.test_UserPresetDatabaseIndex()
+    self.test_PresetLookupIndex()
     self.test_Elastix_Default_Registration_Preset()
     self.test_Elastix_Explicit_Arguments()
     self.test_Elastix_ParameterNode()
+    self.test_InputStagingCache()
+    self.test_SharedParameterFiles()
+    self.test_Elastix_InputVolumeFormats()
+    self.test_NumberOfThreadsPerProcess()
+    self.test_Elastix_CancelRegistrationJob()
+    self.test_Elastix_ProcessMemoryLimit()
+    self.test_WorkspaceManager()
+    self.test_Elastix_BatchRegistration()
+    self.test_RegistrationResultCache()
+    self.test_Elastix_NativeResultTransform()
+    self.test_RegistrationStageCache()
+    self.test_Elastix_CropInputsToMasks()
+    self.test_Elastix_MaximumWorkingSpacing()
+    self.test_Elastix_PixelTypes()
+    self.test_Elastix_ParameterOverrides()
+    self.test_Elastix_Preview()
+    self.test_Elastix_IntermediateResults()
+    self.test_Elastix_PresetSweep()
+    self.test_Elastix_SyntheticPhantomBenchmark()
 
   def test_Elastix_Default_Registration_Preset(self):
     self.delayDisplay(f"Running test: test_Elastix_Default_Registration_Preset", msec=500)
@@ -753,15 +1855,28 @@ class ElastixTest(ScriptedLoadableModuleTest):
 
     logic.registerVolumesUsingParameterNode(parameterNode)
 
+    # timing of the registration phases is available in the logic and in the parameter node
+    timingReport = logic.getTimingReport()
+    self.assertIn("Elastix", timingReport.getPhaseDurations())
+    self.assertIsNotNone(parameterNode.GetAttribute(f"{logic.TIMING_ATTRIBUTE_PREFIX}Total"))
+
     self.delayDisplay('Test passed!')
 
   def test_ElastixPresets(self):
     self.delayDisplay(f"Running test: test_ElastixPresets", msec=500)
 
-    from ElastixLib.preset import Preset, InScenePreset, createPreset
+    from ElastixLib.preset import Preset, InScenePreset, createPreset, CONTENT_KEY
 
     createPreset("test123", "CT", "foo", "bar", "None")
 
+    # parameter file content of database presets is read on first access
+    logic = ElastixLogic()
+    builtinPreset = logic.getPresetByID(logic.DEFAULT_PRESET_ID)
+    section = builtinPreset.getParameterSectionByIdx(0)
+    with open(section.filePath, 'r') as file:
+      self.assertEqual(section[CONTENT_KEY], file.read())
+    self.assertTrue(section.isLoaded())
+
     # create in scene preset from scratch and delete to make sure that nodes were removed
     preset = InScenePreset()
     node = preset.getPresetNode()
@@ -786,3 +1901,747 @@ class ElastixTest(ScriptedLoadableModuleTest):
     preset.delete()
 
     self.delayDisplay('Test passed!')
+
+  def test_UserPresetDatabaseIndex(self):
+    self.delayDisplay(f"Running test: test_UserPresetDatabaseIndex", msec=500)
+
+    import json
+    from ElastixLib.manager import PresetManagerLogic
+    from ElastixLib.preset import copyPreset
+    manager = PresetManagerLogic()
+    userDatabase = manager.userDatabase
+    inScenePreset = copyPreset(manager.getPresetByID("default-rigid"))
+    presetId = manager.savePreset(inScenePreset)
+    inScenePreset.delete()
+    savedPreset = None
+    try:
+      savedPreset = [preset for preset in userDatabase.getRegistrationPresets(force_refresh=True) if preset.getID() == presetId][0]
+      self.assertEqual(len(savedPreset.getParameterSectionNames()), 1)
+      with open(userDatabase.getIndexFilePath(), 'r') as file:
+        indexedPresetIds = [preset["id"] for entry in json.load(file)["files"].values() for preset in entry["presets"]]
+      self.assertIn(presetId, indexedPresetIds)
+      # the index is not written into the watched database folder
+      self.assertFalse(userDatabase.getIndexFilePath().startswith(userDatabase.getPresetsDir() + os.sep))
+
+      # unchanged presets are not reloaded
+      userDatabase.invalidate()
+      self.assertIn(savedPreset, userDatabase.getRegistrationPresets(force_refresh=True))
+
+      # presets are loaded from the index by a new database instance
+      from ElastixLib.database import UserElastixDataBase
+      self.assertIn(presetId, [preset.getID() for preset in UserElastixDataBase().getRegistrationPresets()])
+
+      # edited parameter files are detected, also by a new database instance that uses the index
+      parameterFilePath = os.path.join(userDatabase.getPresetsDir(), presetId, savedPreset.getParameterSectionNames()[0])
+      with open(parameterFilePath, 'a') as file:
+        file.write("\n// edited\n")
+      editTime = os.path.getmtime(parameterFilePath) + 10
+      os.utime(parameterFilePath, (editTime, editTime))
+      # file system notifications are not processed here, force_refresh must detect the change by itself
+      savedPreset = [preset for preset in userDatabase.getRegistrationPresets(force_refresh=True) if preset.getID() == presetId][0]
+      self.assertIn("// edited", savedPreset.getParameterSectionContentByIdx(0))
+      newDatabasePresets = [preset for preset in UserElastixDataBase().getRegistrationPresets() if preset.getID() == presetId]
+      self.assertIn("// edited", newDatabasePresets[0].getParameterSectionContentByIdx(0))
+    finally:
+      if savedPreset:
+        manager.deletePreset(savedPreset)
+    self.assertNotIn(presetId, [preset.getID() for preset in userDatabase.getRegistrationPresets(force_refresh=True)])
+
+    self.delayDisplay('Test passed!')
+
+  def test_PresetLookupIndex(self):
+    self.delayDisplay(f"Running test: test_PresetLookupIndex", msec=500)
+
+    from ElastixLib.manager import PresetManagerLogic
+    from ElastixLib.preset import copyPreset, InScenePreset
+    manager = PresetManagerLogic()
+    messages = []
+    manager.logCallback = messages.append
+    presetIndex = manager.getIdxByPresetId("default0")
+    self.assertEqual(manager.getRegistrationPresets()[presetIndex].getID(), "default0")
+
+    # the first preset is used if the same ID is used in multiple databases
+    inScenePreset = copyPreset(manager.getPresetByID("default0"))
+    try:
+      inScenePreset.setID("default0")
+      manager.getRegistrationPresets(force_refresh=True)
+      self.assertNotIsInstance(manager.getPresetByID("default0"), InScenePreset)
+      self.assertTrue(any("default0" in message for message in messages))
+
+      # edited IDs are found without refreshing the preset list
+      inScenePreset.setID("test-preset-lookup")
+      self.assertIs(manager.getPresetByID("test-preset-lookup"), inScenePreset)
+      self.assertEqual(manager.getRegistrationPresets()[manager.getIdxByPresetId("test-preset-lookup")], inScenePreset)
+    finally:
+      inScenePreset.delete()
+    manager.getRegistrationPresets(force_refresh=True)
+    self.assertIsNone(manager.getPresetByID("test-preset-lookup"))
+
+    # built-in presets are only recreated if the database or a parameter file changes
+    import shutil
+    from ElastixLib.database import BuiltinElastixDatabase
+    testDir = createTempDirectory()
+    try:
+      builtinDir = os.path.join(testDir, "RegistrationParameters")
+      shutil.copytree(manager.getBuiltinPresetsDir(), builtinDir)
+
+      class TestBuiltinDatabase(BuiltinElastixDatabase):
+        DATABASE_FILE = os.path.join(builtinDir, os.path.basename(BuiltinElastixDatabase.DATABASE_FILE))
+
+      database = TestBuiltinDatabase()
+      defaultPreset = [preset for preset in database.getRegistrationPresets() if preset.getID() == "default0"][0]
+      generation = database.generation
+      defaultPreset.getParameterSectionContentByIdx(0)
+      self.assertIn(defaultPreset, database.getRegistrationPresets(force_refresh=True))
+      self.assertEqual(database.generation, generation)
+
+      parameterFilePath = os.path.join(builtinDir, defaultPreset.getParameterSectionNames()[0])
+      with open(parameterFilePath, 'a') as file:
+        file.write("\n// edited\n")
+      editTime = os.path.getmtime(parameterFilePath) + 10
+      os.utime(parameterFilePath, (editTime, editTime))
+      editedPreset = [preset for preset in database.getRegistrationPresets(force_refresh=True) if preset.getID() == "default0"][0]
+      self.assertIsNot(editedPreset, defaultPreset)
+      self.assertGreater(database.generation, generation)
+      self.assertIn("// edited", editedPreset.getParameterSectionContentByIdx(0))
+    finally:
+      shutil.rmtree(testDir, ignore_errors=True)
+
+    self.delayDisplay('Test passed!')
+
+  def test_Elastix_ProcessMemoryLimit(self):
+    self.delayDisplay(f"Running test: test_Elastix_ProcessMemoryLimit", msec=500)
+
+    from ElastixLib.monitor import ProcessResourceMonitor
+    monitor = ProcessResourceMonitor(os.getpid())
+    if not monitor.available:
+      self.delayDisplay('Process resource usage cannot be monitored on this platform, test skipped')
+      return
+    self.assertTrue(monitor.sample())
+    self.assertGreater(monitor.getStatistics()["peakResidentMemoryBytes"], 0)
+
+    # peak memory usage of elastix is reported
+    logic = ElastixLogic()
+    job = logic.registerVolumesAsync(fixedVolumeNode=self.tumor1, movingVolumeNode=self.tumor2,
+                                     outputVolumeNode=self.outputVolume)
+    job.wait()
+    elastixStatistics = [statistics for statistics in job.processStatistics if statistics["process"].startswith("elastix")]
+    self.assertGreater(elastixStatistics[0]["peakResidentMemoryBytes"], 0)
+
+    # elastix uses much more than 1 MB memory, so it is stopped
+    logic.processMemoryLimitMB = 1
+    job = logic.registerVolumesAsync(fixedVolumeNode=self.tumor1, movingVolumeNode=self.tumor2,
+                                     outputVolumeNode=self.outputVolume, bypassResultCache=True)
+    with self.assertRaises(MemoryError):
+      job.wait()
+    self.assertEqual(job.state, job.FAILED)
+    self.assertIn("more than the limit of 1 MB", str(job.error))
+    self.assertGreater(job.getLastProcessStatistics()["peakResidentMemoryBytes"], 1024 * 1024)
+
+    self.delayDisplay('Test passed!')
+
+  def test_WorkspaceManager(self):
+    self.delayDisplay(f"Running test: test_WorkspaceManager", msec=500)
+
+    import shutil
+    from ElastixLib.workspace import WorkspaceManager
+    from ElastixLib.utils import OWNER_FILE_NAME
+
+    # use separate folders so that no other working directories are touched
+    testDir = createTempDirectory()
+    workspaceManager = WorkspaceManager(ramBudgetBytes=10 * 1024 * 1024, quotaBytes=0)
+    workspaceManager.RAM_DISK_PATH = createDirectory(os.path.join(testDir, "ram"))
+    workspaceManager.diskWorkspaceBase = createDirectory(os.path.join(testDir, "disk"))
+    try:
+      # small workspaces are placed in RAM, large ones and ones that must be kept are placed on disk
+      ramWorkspace = workspaceManager.createWorkspace(1024 * 1024)
+      self.assertTrue(workspaceManager.isInRam(ramWorkspace))
+      self.assertTrue(ramWorkspace.startswith(workspaceManager.getRamWorkspaceBase()))
+      largeWorkspace = workspaceManager.createWorkspace(20 * 1024 * 1024)
+      self.assertFalse(workspaceManager.isInRam(largeWorkspace))
+      self.assertTrue(largeWorkspace.startswith(workspaceManager.diskWorkspaceBase))
+      diskWorkspace = workspaceManager.createWorkspace(1024 * 1024, allowRam=False)
+      self.assertFalse(workspaceManager.isInRam(diskWorkspace))
+
+      # kept files are moved out of RAM
+      workspaceManager.releaseWorkspace(ramWorkspace, delete=False)
+      movedWorkspace = os.path.join(workspaceManager.diskWorkspaceBase, os.path.basename(ramWorkspace))
+      self.assertFalse(os.path.exists(ramWorkspace))
+      self.assertTrue(os.path.isdir(movedWorkspace))
+      workspaceManager.releaseWorkspace(largeWorkspace, delete=False)
+
+      # directories of other running processes and recently modified directories are not deleted
+      liveOwnerWorkspace = createTempDirectory(workspaceManager.diskWorkspaceBase)
+      with open(os.path.join(liveOwnerWorkspace, OWNER_FILE_NAME), 'w') as file:
+        file.write(str(os.getppid()))
+      deadOwnerWorkspace = createTempDirectory(workspaceManager.diskWorkspaceBase)
+      with open(os.path.join(deadOwnerWorkspace, OWNER_FILE_NAME), 'w') as file:
+        file.write("999999999")
+      oldTime = time.time() - workspaceManager.MINIMUM_GARBAGE_AGE_SEC - 10
+      for workspace in [movedWorkspace, largeWorkspace, diskWorkspace, liveOwnerWorkspace, deadOwnerWorkspace]:
+        os.utime(workspace, (oldTime, oldTime))
+      recentWorkspace = createTempDirectory(workspaceManager.diskWorkspaceBase)
+
+      # quota is 0, so all other directories are deleted
+      workspaceManager.collectGarbage(force=True)
+      self.assertFalse(os.path.exists(movedWorkspace))
+      self.assertFalse(os.path.exists(largeWorkspace))
+      self.assertFalse(os.path.exists(deadOwnerWorkspace))
+      self.assertTrue(os.path.isdir(diskWorkspace))
+      self.assertTrue(os.path.isdir(liveOwnerWorkspace))
+      self.assertTrue(os.path.isdir(recentWorkspace))
+      workspaceManager.releaseWorkspace(diskWorkspace)
+      self.assertFalse(os.path.exists(diskWorkspace))
+    finally:
+      shutil.rmtree(testDir, ignore_errors=True)
+
+    self.delayDisplay('Test passed!')
+
+  def test_Elastix_CancelRegistrationJob(self):
+    self.delayDisplay(f"Running test: test_Elastix_CancelRegistrationJob", msec=500)
+
+    logic = ElastixLogic()
+    job = logic.registerVolumesAsync(fixedVolumeNode=self.tumor1, movingVolumeNode=self.tumor2,
+                                     outputVolumeNode=self.outputVolume)
+    self.assertTrue(logic.isRunning)
+    job.cancel()
+    job.wait()
+    self.assertEqual(job.state, job.CANCELLED)
+    self.assertFalse(logic.isRunning)
+    self.assertFalse(os.path.exists(job.tempDir))
+
+    # waiting for a job that is never started fails instead of blocking forever
+    queuedJob = logic._createRegistrationJob(self.tumor1, self.tumor2, outputVolumeNode=self.outputVolume)
+    with self.assertRaises(RuntimeError):
+      queuedJob.wait()
+    queuedJob.cancel()
+    self.assertEqual(queuedJob.state, queuedJob.CANCELLED)
+
+    self.delayDisplay('Test passed!')
+
+  def test_Elastix_BatchRegistration(self):
+    self.delayDisplay(f"Running test: test_Elastix_BatchRegistration", msec=500)
+
+    from ElastixLib.preset import releaseParameterFiles
+    logic = ElastixLogic()
+    defaultParameterFilenames = logic.getPresetByID(logic.DEFAULT_PRESET_ID).createParameterFiles()
+    rigidParameterFilenames = logic.getPresetByID("default-rigid").createParameterFiles()
+
+    # moving volumes and parameter nodes (that specify their own preset) can be mixed
+    parameterNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScriptedModuleNode")
+    parameterNode.SetNodeReferenceID(logic.MOVING_VOLUME_REF, self.tumor2.GetID())
+    parameterNode.SetNodeReferenceID(logic.OUTPUT_VOLUME_REF, self.outputVolume.GetID())
+    parameterNode.SetParameter(logic.REGISTRATION_PRESET_ID_PARAM, "default-rigid")
+    batch = logic.registerVolumesBatch(self.tumor1, [self.tumor2, parameterNode, self.tumor2], maximumNumberOfWorkers=2)
+    try:
+      self.assertEqual(len(batch.jobs), 3)
+      self.assertEqual(batch.jobs[0].parameterFilenames, defaultParameterFilenames)
+      self.assertEqual(batch.jobs[1].parameterFilenames, rigidParameterFilenames)
+      self.assertEqual(batch.jobs[2].parameterFilenames, defaultParameterFilenames)
+      batch.wait()
+      self.assertEqual(len(batch.getCompletedJobs()), 3)
+      self.assertIs(batch.jobs[1].outputVolumeNode, self.outputVolume)
+    finally:
+      batch.cancel()
+      releaseParameterFiles(defaultParameterFilenames)
+      releaseParameterFiles(rigidParameterFilenames)
+    for job in batch.jobs:
+      if job.outputVolumeNode is not self.outputVolume:
+        slicer.mrmlScene.RemoveNode(job.outputVolumeNode)
+    slicer.mrmlScene.RemoveNode(parameterNode)
+
+    # shared fixed volume is exported in the internal pixel type of each job
+    import shutil
+    from ElastixLib.utils import createTempDirectory
+    logic.exportInInternalPixelType = True
+    stageDir = createTempDirectory()
+    stagedInputFilesByPixelTypes = {}
+    sharedInputVolumes = [[self.tumor1, 'fixed', '-f']]
+    try:
+      floatInputFiles = logic._stageSharedInputVolumes(stageDir, sharedInputVolumes, {'-f': 'float', '-m': 'float'},
+                                                       stagedInputFilesByPixelTypes)
+      shortInputFiles = logic._stageSharedInputVolumes(stageDir, sharedInputVolumes, {'-f': 'short', '-m': 'float'},
+                                                       stagedInputFilesByPixelTypes)
+      self.assertIs(logic._stageSharedInputVolumes(stageDir, sharedInputVolumes, {'-f': 'float'},
+                                                   stagedInputFilesByPixelTypes), floatInputFiles)
+      self.assertEqual(len(stagedInputFilesByPixelTypes), 2)
+      for inputFiles, pixelType in [(floatInputFiles, 'float'), (shortInputFiles, 'short')]:
+        loadedNode = slicer.util.loadVolume(inputFiles['-f'])
+        self.assertEqual(loadedNode.GetImageData().GetScalarTypeAsString(), pixelType)
+        slicer.mrmlScene.RemoveNode(loadedNode)
+    finally:
+      logic._releaseSharedInputVolumes(stagedInputFilesByPixelTypes)
+      shutil.rmtree(stageDir, ignore_errors=True)
+
+    self.delayDisplay('Test passed!')
+
+  def test_Elastix_InputVolumeFormats(self):
+    self.delayDisplay(f"Running test: test_Elastix_InputVolumeFormats", msec=500)
+
+    import shutil
+    logic = ElastixLogic()
+    logic.useInputStagingCache = False
+    logic.deleteTemporaryFiles = False
+    parameterFilenames = logic.getPresetByID("default-rigid").createParameterFiles()
+    try:
+      for inputVolumeFormat, (extension, useCompression) in logic.INPUT_VOLUME_FORMATS.items():
+        logic.inputVolumeFormat = inputVolumeFormat
+        job = logic.registerVolumesAsync(fixedVolumeNode=self.tumor1, movingVolumeNode=self.tumor2,
+                                         outputVolumeNode=self.outputVolume, parameterFilenames=parameterFilenames)
+        job.wait()
+        try:
+          self.assertEqual(job.state, job.COMPLETED)
+          self.assertEqual(self.outputVolume.GetImageData().GetDimensions(), self.tumor1.GetImageData().GetDimensions())
+          fixedFilePath = os.path.join(job.tempDir, logic.INPUT_DIR_NAME, "fixed" + extension)
+          self.assertTrue(os.path.isfile(fixedFilePath))
+          if extension == ".mhd":
+            self.assertTrue(os.path.isfile(os.path.join(job.tempDir, logic.INPUT_DIR_NAME, "fixed.raw")))
+          else:
+            with open(fixedFilePath, 'rb') as file:
+              header = file.read(1024)
+            self.assertEqual(b"CompressedData = True" in header, useCompression)
+        finally:
+          shutil.rmtree(job.tempDir, ignore_errors=True)
+    finally:
+      from ElastixLib.preset import releaseParameterFiles
+      releaseParameterFiles(parameterFilenames)
+
+    self.delayDisplay('Test passed!')
+
+  def test_NumberOfThreadsPerProcess(self):
+    self.delayDisplay(f"Running test: test_NumberOfThreadsPerProcess", msec=500)
+
+    from ElastixLib.job import RegistrationJob
+    logic = ElastixLogic()
+    # background jobs use the cores of the CPU affinity, which makes the number of cores known
+    logic.backgroundCpuAffinity = list(range(8))
+    job = RegistrationJob(lambda job: iter([]))
+    job.background = True
+
+    # available cores are split between the jobs that are expected to run at the same time
+    for expectedConcurrency, numberOfThreads in [(1, 8), (2, 4), (3, 2), (16, 1)]:
+      job.expectedConcurrency = expectedConcurrency
+      self.assertEqual(logic.getNumberOfThreadsPerProcess(job), numberOfThreads)
+
+    # explicitly set number of threads is used as is, the job setting overrides the logic setting
+    logic.numberOfThreads = 5
+    self.assertEqual(logic.getNumberOfThreadsPerProcess(job), 5)
+    job.numberOfThreads = 3
+    self.assertEqual(logic.getNumberOfThreadsPerProcess(job), 3)
+    logic.numberOfThreads = 0
+    self.assertEqual(logic.getNumberOfThreadsPerProcess(job), 3)
+
+    self.assertGreaterEqual(logic.getNumberOfThreadsPerProcess(), 1)
+
+    self.delayDisplay('Test passed!')
+
+  def test_SharedParameterFiles(self):
+    self.delayDisplay(f"Running test: test_SharedParameterFiles", msec=500)
+
+    from ElastixLib import preset
+    from ElastixLib.utils import OWNER_FILE_NAME
+
+    # files with the same content are shared and deleted when the last user releases them
+    filePath = preset.writeParameterFile("test", "(Transform \"EulerTransform\")")
+    self.assertEqual(preset.writeParameterFile("test", "(Transform \"EulerTransform\")"), filePath)
+    self.assertTrue(filePath.startswith(preset.getParameterFilesDirectory()))
+    preset.releaseParameterFiles([filePath])
+    self.assertTrue(os.path.isfile(filePath))
+    preset.releaseParameterFiles([filePath])
+    self.assertFalse(os.path.exists(filePath))
+
+    # files returned by getParameterFiles do not have to be released, they are kept until the application exits
+    logic = ElastixLogic()
+    builtinPreset = logic.getPresetByID("default-rigid")
+    persistentFilePaths = builtinPreset.getParameterFiles()
+    createdFilePaths = builtinPreset.createParameterFiles()
+    self.assertEqual(createdFilePaths, persistentFilePaths)
+    preset.releaseParameterFiles(createdFilePaths)
+    self.assertTrue(all(os.path.isfile(path) for path in persistentFilePaths))
+
+    # folder of a process that is not running anymore is removed when a new folder is created
+    staleDirectory = os.path.join(os.path.dirname(preset.getParameterFilesDirectory()), "stale")
+    os.makedirs(staleDirectory, exist_ok=True)
+    with open(os.path.join(staleDirectory, OWNER_FILE_NAME), 'w') as file:
+      file.write("999999999")
+    staleTime = time.time() - preset.STALE_PARAMETER_FILES_DIRECTORY_AGE_SEC - 10
+    os.utime(staleDirectory, (staleTime, staleTime))
+    currentDirectory = preset.getParameterFilesDirectory()
+    preset._parameterFilesDirectory = None
+    newDirectory = preset.getParameterFilesDirectory()
+    self.assertFalse(os.path.exists(staleDirectory))
+    self.assertTrue(os.path.isdir(currentDirectory))
+    self.assertNotEqual(newDirectory, currentDirectory)
+
+    self.delayDisplay('Test passed!')
+
+  def test_InputStagingCache(self):
+    self.delayDisplay(f"Running test: test_InputStagingCache", msec=500)
+
+    from ElastixLib.cache import InputStagingCache
+    from ElastixLib.utils import createTempDirectory
+    cache = InputStagingCache(directory=createTempDirectory())
+
+    filePath = cache.stageVolume(self.tumor1, 'fixed.mha')
+    self.assertTrue(os.path.isfile(filePath))
+    self.assertEqual(cache.stageVolume(self.tumor1, 'fixed.mha'), filePath)
+    self.assertEqual(cache.hits, 1)
+    self.assertEqual(cache.misses, 1)
+
+    # modified voxels must not be served from the cache
+    self.tumor1.GetImageData().Modified()
+    self.assertNotEqual(cache.stageVolume(self.tumor1, 'fixed.mha'), filePath)
+    self.assertEqual(cache.misses, 2)
+
+    # pinned entries survive eviction, released ones do not
+    cache.maximumSizeBytes = 0
+    cache.evict()
+    self.assertTrue(os.path.isfile(filePath))
+    cache.release(filePath)
+    cache.release(filePath)
+    cache.evict()
+    self.assertFalse(os.path.isfile(filePath))
+
+    # session directories of processes that are not running are removed, the ones of running processes are kept
+    from ElastixLib.utils import OWNER_FILE_NAME
+    filePath = cache.stageVolume(self.tumor1, 'fixed.mha')
+    cache.release(filePath)
+    staleSessionDirectory = createTempDirectory(cache.baseDirectory)
+    with open(os.path.join(staleSessionDirectory, OWNER_FILE_NAME), 'w') as file:
+      file.write("0")
+    oldTime = time.time() - 2 * InputStagingCache.MINIMUM_STALE_SESSION_AGE_SEC
+    for directory in [staleSessionDirectory, cache.directory]:
+      os.utime(directory, (oldTime, oldTime))
+    otherCache = InputStagingCache(directory=cache.baseDirectory)
+    self.assertFalse(os.path.isdir(staleSessionDirectory))
+    self.assertTrue(os.path.isfile(filePath))
+    otherCache.maximumSizeBytes = 0
+    otherCache.evict()
+    self.assertTrue(os.path.isfile(filePath))
+    cache.purge()
+    self.assertFalse(os.path.isfile(filePath))
+
+    # the cache is opt-in and it is not used if temporary files are kept
+    logic = ElastixLogic()
+    self.assertFalse(logic.useInputStagingCache)
+    logic.useInputStagingCache = True
+    logic.deleteTemporaryFiles = False
+    inputDir = createTempDirectory()
+    inputFiles = logic._addInputVolumes(inputDir, [[self.tumor1, 'fixed', '-f']])
+    self.assertEqual(os.path.dirname(inputFiles['-f']), inputDir)
+    self.assertIsNone(logic.inputStagingCache)
+
+    self.delayDisplay('Test passed!')
+
+  def test_Elastix_NativeResultTransform(self):
+    self.delayDisplay(f"Running test: test_Elastix_NativeResultTransform", msec=500)
+
+    import itertools
+    import shutil
+    from ElastixLib.transforms import createTransformFromParameterFile
+    from ElastixLib.preset import releaseParameterFiles
+    logic = ElastixLogic()
+    logic.deleteTemporaryFiles = False
+
+    # initial transform is composed with the rigid result, rigid result is the initial transform of the B-spline
+    initialTransform = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLinearTransformNode")
+    initialMatrix = vtk.vtkMatrix4x4()
+    initialMatrix.SetElement(0, 3, 5.0)
+    initialMatrix.SetElement(1, 3, -3.0)
+    initialTransform.SetMatrixTransformToParent(initialMatrix)
+
+    # points in the central region of the fixed volume, where the displacement field is defined
+    bounds = [0.0] * 6
+    self.tumor1.GetRASBounds(bounds)
+    points = [[bounds[axis * 2] + (bounds[axis * 2 + 1] - bounds[axis * 2]) * fraction
+               for axis, fraction in enumerate(fractions)]
+              for fractions in itertools.product([0.3, 0.5, 0.7], repeat=3)]
+
+    for presetId, initialTransformNode in [("default-rigid", initialTransform), ("default0", None)]:
+      parameterFilenames = logic.getPresetByID(presetId).createParameterFiles()
+      job = logic.registerVolumesAsync(fixedVolumeNode=self.tumor1, movingVolumeNode=self.tumor2,
+                                       outputVolumeNode=self.outputVolume, parameterFilenames=parameterFilenames,
+                                       initialTransformNode=initialTransformNode)
+      try:
+        job.wait()
+        transformParameterFilePath = os.path.join(job.tempDir, logic.OUTPUT_TRANSFORM_DIR_NAME,
+                                                  f"TransformParameters.{len(parameterFilenames) - 1}.txt")
+        nativeTransform = createTransformFromParameterFile(transformParameterFilePath)
+
+        # reference: displacement field computed by transformix
+        displacementFieldDir = os.path.join(job.tempDir, "test-displacement-field")
+        os.makedirs(displacementFieldDir)
+        process = logic.startTransformix(['-tp', transformParameterFilePath, '-out', displacementFieldDir, '-def', 'all'])
+        process.communicate()
+        self.assertEqual(process.returncode, 0)
+        referenceTransformNodes = [slicer.util.loadTransform(os.path.join(displacementFieldDir, "deformationField.mhd"))]
+        compositeTransformPath = transformParameterFilePath.replace(".txt", "-Composite.h5")
+        if os.path.isfile(compositeTransformPath):
+          referenceTransformNodes.append(slicer.util.loadTransform(compositeTransformPath))
+
+        for referenceTransformNode in referenceTransformNodes:
+          referenceTransform = referenceTransformNode.GetTransformFromParent()
+          for point in points:
+            nativePoint = nativeTransform.TransformPoint(point)
+            referencePoint = referenceTransform.TransformPoint(point)
+            for axis in range(3):
+              self.assertAlmostEqual(nativePoint[axis], referencePoint[axis], delta=0.5,
+                                     msg=f"{presetId}: point {point} is transformed differently")
+          slicer.mrmlScene.RemoveNode(referenceTransformNode)
+      finally:
+        releaseParameterFiles(parameterFilenames)
+        shutil.rmtree(job.tempDir, ignore_errors=True)
+    slicer.mrmlScene.RemoveNode(initialTransform)
+
+    self.delayDisplay('Test passed!')
+
+  def test_RegistrationResultCache(self):
+    self.delayDisplay(f"Running test: test_RegistrationResultCache", msec=500)
+
+    from ElastixLib.cache import RegistrationResultCache
+    from ElastixLib.utils import createTempDirectory
+    logic = ElastixLogic()
+    logic.useResultCache = True
+    logic.resultCache = RegistrationResultCache(directory=createTempDirectory())
+    outputTransform = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLTransformNode")
+
+    logic.registerVolumes(fixedVolumeNode=self.tumor1, movingVolumeNode=self.tumor2,
+                          outputVolumeNode=self.outputVolume, outputTransformNode=outputTransform)
+    self.assertEqual(logic.resultCache.misses, 1)
+
+    # identical registration is restored from the cache
+    logic.registerVolumes(fixedVolumeNode=self.tumor1, movingVolumeNode=self.tumor2,
+                          outputVolumeNode=self.outputVolume, outputTransformNode=outputTransform)
+    self.assertEqual(logic.resultCache.hits, 1)
+
+    # bypassing the cache does not look up the result
+    logic.registerVolumes(fixedVolumeNode=self.tumor1, movingVolumeNode=self.tumor2,
+                          outputVolumeNode=self.outputVolume, bypassResultCache=True)
+    self.assertEqual(logic.resultCache.hits + logic.resultCache.misses, 2)
+
+    self.delayDisplay('Test passed!')
+
+  def test_Elastix_CropInputsToMasks(self):
+    self.delayDisplay(f"Running test: test_Elastix_CropInputsToMasks", msec=500)
+
+    # mask is the central part of the fixed volume
+    fixedMask = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLabelMapVolumeNode", "fixed mask")
+    maskArray = (slicer.util.arrayFromVolume(self.tumor1) * 0).astype("uint8")
+    dims = maskArray.shape
+    maskArray[dims[0] // 4:dims[0] * 3 // 4, dims[1] // 4:dims[1] * 3 // 4, dims[2] // 4:dims[2] * 3 // 4] = 1
+    slicer.util.updateVolumeFromArray(fixedMask, maskArray)
+    ijkToRas = vtk.vtkMatrix4x4()
+    self.tumor1.GetIJKToRASMatrix(ijkToRas)
+    fixedMask.SetIJKToRASMatrix(ijkToRas)
+
+    from ElastixLib.crop import getMaskBounds, cropVolume
+    croppedVolume = cropVolume(self.tumor1, getMaskBounds(fixedMask, 5.0))
+    self.assertIsNotNone(croppedVolume)
+    self.assertLess(croppedVolume.GetImageData().GetNumberOfPoints(), self.tumor1.GetImageData().GetNumberOfPoints())
+    slicer.mrmlScene.RemoveNode(croppedVolume)
+
+    # resampled output covers the whole fixed volume
+    logic = ElastixLogic()
+    logic.cropInputsToMasks = True
+    logic.cropMarginMM = 5.0
+    logic.resampleOutputVolumeInProcess = False
+    logic.registerVolumes(fixedVolumeNode=self.tumor1, movingVolumeNode=self.tumor2, outputVolumeNode=self.outputVolume,
+                          fixedVolumeMaskNode=fixedMask)
+    self.assertEqual(self.outputVolume.GetImageData().GetDimensions(), self.tumor1.GetImageData().GetDimensions())
+
+    self.delayDisplay('Test passed!')
+
+  def test_Elastix_MaximumWorkingSpacing(self):
+    self.delayDisplay(f"Running test: test_Elastix_MaximumWorkingSpacing", msec=500)
+
+    from ElastixLib.resample import downsampleVolume
+    downsampledVolume = downsampleVolume(self.tumor1, 4.0)
+    self.assertIsNotNone(downsampledVolume)
+    self.assertTrue(all(spacing <= 4.0 + 1e-3 for spacing in downsampledVolume.GetSpacing()))
+    # downsampled volume covers the same region
+    originalBounds = [0.0] * 6
+    downsampledBounds = [0.0] * 6
+    self.tumor1.GetRASBounds(originalBounds)
+    downsampledVolume.GetRASBounds(downsampledBounds)
+    for originalBound, downsampledBound in zip(originalBounds, downsampledBounds):
+      self.assertAlmostEqual(originalBound, downsampledBound, places=3)
+    slicer.mrmlScene.RemoveNode(downsampledVolume)
+
+    # output volume is resampled from the full resolution moving volume
+    logic = ElastixLogic()
+    logic.resampleOutputVolumeInProcess = False
+    logic.registerVolumes(fixedVolumeNode=self.tumor1, movingVolumeNode=self.tumor2, outputVolumeNode=self.outputVolume,
+                          parameterFilenames=logic.getPresetByID("default-rigid").getParameterFiles(),
+                          maximumWorkingSpacing=4.0)
+    self.assertEqual(self.outputVolume.GetImageData().GetDimensions(), self.tumor1.GetImageData().GetDimensions())
+
+    self.delayDisplay('Test passed!')
+
+  def test_Elastix_PixelTypes(self):
+    self.delayDisplay(f"Running test: test_Elastix_PixelTypes", msec=500)
+
+    logic = ElastixLogic()
+    parameterFilenames = logic.getPresetByID("default-rigid").getParameterFiles()
+    self.assertEqual(logic._getInputPixelTypes(parameterFilenames), {})
+    logic.exportInInternalPixelType = True
+    self.assertEqual(logic._getInputPixelTypes(parameterFilenames), {'-f': 'float', '-m': 'float'})
+
+    # transformix writes the output volume with the pixel type of the moving volume
+    logic.resampleOutputVolumeInProcess = False
+    logic.registerVolumes(fixedVolumeNode=self.tumor1, movingVolumeNode=self.tumor2, outputVolumeNode=self.outputVolume,
+                          parameterFilenames=parameterFilenames)
+    self.assertEqual(self.outputVolume.GetImageData().GetScalarType(), self.tumor2.GetImageData().GetScalarType())
+
+    self.delayDisplay('Test passed!')
+
+  def test_Elastix_ParameterOverrides(self):
+    self.delayDisplay(f"Running test: test_Elastix_ParameterOverrides", msec=500)
+
+    from ElastixLib.parameters import ParameterMap
+    logic = ElastixLogic()
+    preset = logic.getPresetByID("default0")
+    parameterMaps = preset.getParameterMaps()
+    self.assertEqual(parameterMaps[0].getValue("Transform"), "EulerTransform")
+    parameterMap = parameterMaps[0].copy()
+    parameterMap.setValues("MaximumNumberOfIterations", 10)
+    self.assertEqual(ParameterMap.fromText(parameterMap.toText()).getValue("MaximumNumberOfIterations"), 10)
+
+    # commented-out entries are not active, the override is appended instead
+    from ElastixLib.parameters import setParameterValuesInText
+    text = setParameterValuesInText('(Transform "BSplineTransform")\n//(MaximumNumberOfIterations 50)\n',
+                                    "MaximumNumberOfIterations", [200])
+    self.assertIn("//(MaximumNumberOfIterations 50)", text)
+    self.assertEqual(ParameterMap.fromText(text).getValue("MaximumNumberOfIterations"), 200)
+    text = setParameterValuesInText('(MaximumNumberOfIterations 50) // default\n', "MaximumNumberOfIterations", [200])
+    self.assertEqual(text, '(MaximumNumberOfIterations 200) // default\n')
+
+    # overrides are applied to the parameter files of the job only, the preset is not changed
+    presetContent = preset.getParameterSectionContentByIdx(0)
+    job = logic.registerVolumesAsync(fixedVolumeNode=self.tumor1, movingVolumeNode=self.tumor2,
+                                     outputVolumeNode=self.outputVolume,
+                                     parameterOverrides=[{"MaximumNumberOfIterations": 10}, {"NumberOfResolutions": 1}])
+    self.assertEqual(job.outputParser.stageSettings[1][0], 1)
+    job.wait()
+    self.assertEqual(preset.getParameterSectionContentByIdx(0), presetContent)
+
+    self.delayDisplay('Test passed!')
+
+  def test_Elastix_Preview(self):
+    self.delayDisplay(f"Running test: test_Elastix_Preview", msec=500)
+
+    logic = ElastixLogic()
+    preset = logic.getPresetByID("default0")
+    previewOverrides = logic.getPreviewParameterOverrides(preset)
+    self.assertEqual(len(previewOverrides), 2)
+    self.assertLess(previewOverrides[1]["MaximumNumberOfIterations"][0],
+                    preset.getParameterMaps()[1].getValue("MaximumNumberOfIterations"))
+
+    parameterNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScriptedModuleNode")
+    parameterNode.SetNodeReferenceID(logic.FIXED_VOLUME_REF, self.tumor1.GetID())
+    parameterNode.SetNodeReferenceID(logic.MOVING_VOLUME_REF, self.tumor2.GetID())
+    parameterNode.SetNodeReferenceID(logic.OUTPUT_VOLUME_REF, self.outputVolume.GetID())
+    parameterNode.SetParameter(logic.REGISTRATION_PRESET_ID_PARAM, "default0")
+
+    fullJobs = []
+    previewJob = logic.registerVolumesWithPreviewUsingParameterNodeAsync(parameterNode, fullJobs.append)
+    previewJob.wait()
+    self.assertEqual(len(fullJobs), 1)
+    fullJobs[0].wait()
+    self.assertEqual(fullJobs[0].state, fullJobs[0].COMPLETED)
+    # temporary preview transform is removed
+    self.assertIsNone(slicer.mrmlScene.GetFirstNodeByName("ElastixPreviewTransform"))
+
+    self.delayDisplay('Test passed!')
+
+  def test_Elastix_IntermediateResults(self):
+    self.delayDisplay(f"Running test: test_Elastix_IntermediateResults", msec=500)
+
+    logic = ElastixLogic()
+    logic.loadIntermediateResults = True
+    logMessages = []
+    logic.logCallback = logMessages.append
+    outputTransform = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLTransformNode")
+    logic.registerVolumes(fixedVolumeNode=self.tumor1, movingVolumeNode=self.tumor2,
+                          parameterFilenames=logic.getPresetByID("default-rigid").getParameterFiles(),
+                          outputTransformNode=outputTransform)
+    self.assertTrue(any(message.startswith("Intermediate result") for message in logMessages))
+
+    self.delayDisplay('Test passed!')
+
+  def test_Elastix_PresetSweep(self):
+    self.delayDisplay(f"Running test: test_Elastix_PresetSweep", msec=500)
+
+    from ElastixLib.similarity import computeSimilarity
+    import numpy as np
+    voxels = np.random.rand(10, 10, 10)
+    self.assertGreater(computeSimilarity(voxels, voxels), computeSimilarity(voxels, np.random.rand(10, 10, 10)))
+    self.assertAlmostEqual(computeSimilarity(voxels, voxels * 2 + 1, metric="normalizedCrossCorrelation"), 1.0)
+
+    logic = ElastixLogic()
+    outputTransform = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLTransformNode")
+    results = logic.sweepPresets(self.tumor1, self.tumor2, ["default-rigid", "default0"],
+                                 outputVolumeNode=self.outputVolume, outputTransformNode=outputTransform)
+    self.assertEqual(len(results), 2)
+    self.assertEqual([result["rank"] for result in results], [1, 2])
+    self.assertGreaterEqual(results[0]["similarity"], results[1]["similarity"])
+    self.assertEqual(self.outputVolume.GetImageData().GetDimensions(), self.tumor1.GetImageData().GetDimensions())
+
+    # presets must be specified explicitly
+    with self.assertRaises(ValueError):
+      logic.sweepPresets(self.tumor1, self.tumor2, [])
+
+    # inputs are downsampled the same way as for a single registration
+    logMessages = []
+    logic.logCallback = logMessages.append
+    numberOfNodes = slicer.mrmlScene.GetNumberOfNodes()
+    results = logic.sweepPresets(self.tumor1, self.tumor2, ["default-rigid"], outputTransformNode=outputTransform,
+                                 maximumWorkingSpacing=5.0)
+    self.assertEqual(results[0]["rank"], 1)
+    for volumeNode in [self.tumor1, self.tumor2]:
+      self.assertTrue(any(message.startswith(f"{volumeNode.GetName()} is downsampled") for message in logMessages))
+    self.assertEqual(slicer.mrmlScene.GetNumberOfNodes(), numberOfNodes)
+    slicer.mrmlScene.RemoveNode(outputTransform)
+
+    self.delayDisplay('Test passed!')
+
+  def test_RegistrationStageCache(self):
+    self.delayDisplay(f"Running test: test_RegistrationStageCache", msec=500)
+
+    from ElastixLib.cache import RegistrationStageCache
+    from ElastixLib.utils import createTempDirectory
+    logic = ElastixLogic()
+    logic.useStageCache = True
+    logic.stageCache = RegistrationStageCache(directory=createTempDirectory())
+
+    logic.registerVolumes(fixedVolumeNode=self.tumor1, movingVolumeNode=self.tumor2, outputVolumeNode=self.outputVolume)
+    self.assertEqual(logic.stageCache.misses, 2)
+
+    # only the changed (second) stage is computed again
+    logic.registerVolumes(fixedVolumeNode=self.tumor1, movingVolumeNode=self.tumor2, outputVolumeNode=self.outputVolume,
+                          parameterOverrides=[None, {"MaximumNumberOfIterations": 50}])
+    self.assertEqual(logic.stageCache.hits, 1)
+    self.assertEqual(logic.stageCache.misses, 3)
+
+    self.delayDisplay('Test passed!')
+
+  def test_Elastix_SyntheticPhantomBenchmark(self):
+    self.delayDisplay(f"Running test: test_Elastix_SyntheticPhantomBenchmark", msec=500)
+
+    from ElastixLib import benchmark
+    logic = ElastixLogic()
+    logic.useResultCache = True
+    results = benchmark.runBenchmark(presetIds=["default0"], sizes=[32], logic=logic)
+    self.assertEqual(len(results), 1)
+    self.assertEqual(results[0]["status"], "completed")
+    self.assertEqual(benchmark.compareWithBaseline(results, results), [])
+    # settings of the logic are not changed
+    self.assertTrue(logic.useResultCache)
+
+    # values that could not be measured are reported as n/a
+    import csv
+    csvFilePath = os.path.join(createTempDirectory(), "results.csv")
+    benchmark.writeResultsCsv([dict(results[0], childPeakRssMB=None)], csvFilePath)
+    with open(csvFilePath, 'r', newline='') as file:
+      self.assertEqual(next(csv.DictReader(file))["childPeakRssMB"], "n/a")
+
+    self.delayDisplay('Test passed!')
@@ -0,0 +1,248 @@
+import csv
+import json
+import logging
+import math
+import platform
+import time
+
+import numpy as np
+import slicer
+import vtk
+
+# physical size of the phantoms (in mm), the same for all volume sizes so that errors are comparable
+PHANTOM_EXTENT_MM = 200.0
+DEFAULT_SIZES = [64, 128, 256, 512]
+DEFAULT_PRESET_IDS = ["default0"]
+
+RESULT_FIELDS = ["presetId", "size", "status", "wallTime", "elastixTime", "childPeakRssMB", "bytesRead", "bytesWritten",
+                 "landmarkErrorMean", "landmarkErrorMax", "fieldErrorRms"]
+
+
+def createPhantomVolume(size, name="Phantom"):
+  """Create a volume of size^3 voxels that contains ellipsoids of different intensities on a smooth background."""
+  spacing = PHANTOM_EXTENT_MM / size
+  k, j, i = np.ogrid[0:size, 0:size, 0:size]
+  # normalized coordinates in the range of -1 to 1
+  x = (i + 0.5) / size * 2.0 - 1.0
+  y = (j + 0.5) / size * 2.0 - 1.0
+  z = (k + 0.5) / size * 2.0 - 1.0
+  voxels = np.zeros([size, size, size], dtype=np.int16)
+  voxels += (100 * (x + y + z + 3)).astype(np.int16)
+  ellipsoids = [
+    # center, radii, intensity
+    ([0.0, 0.0, 0.0], [0.75, 0.6, 0.7], 500),
+    ([-0.3, 0.1, 0.1], [0.2, 0.3, 0.25], 900),
+    ([0.35, -0.1, 0.0], [0.15, 0.2, 0.3], 1200),
+    ([0.0, 0.35, -0.3], [0.25, 0.1, 0.15], 200),
+    ([0.1, -0.35, 0.35], [0.1, 0.1, 0.1], 1500)]
+  for center, radii, intensity in ellipsoids:
+    inside = (((x - center[0]) / radii[0]) ** 2 + ((y - center[1]) / radii[1]) ** 2
+              + ((z - center[2]) / radii[2]) ** 2) <= 1.0
+    voxels[inside] += intensity
+  volumeNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode", name)
+  slicer.util.updateVolumeFromArray(volumeNode, voxels)
+  volumeNode.SetSpacing(spacing, spacing, spacing)
+  volumeNode.SetOrigin(-PHANTOM_EXTENT_MM / 2, -PHANTOM_EXTENT_MM / 2, -PHANTOM_EXTENT_MM / 2)
+  return volumeNode
+
+
+def createKnownDeformation(deformationMagnitude=4.0, rotationDeg=5.0, translation=(3.0, -2.0, 1.5), seed=0):
+  """Create a smooth, invertible ground truth transform (rotation, translation, and a coarse B-spline deformation).
+
+  The transform maps points from the fixed volume to the moving volume (the same direction as the
+  "transform from parent" of registration results).
+  """
+  linearTransform = vtk.vtkTransform()
+  linearTransform.Translate(translation)
+  linearTransform.RotateZ(rotationDeg)
+
+  gridSize = 6
+  gridSpacing = PHANTOM_EXTENT_MM / (gridSize - 3)
+  randomState = np.random.RandomState(seed)
+  coefficients = randomState.uniform(-deformationMagnitude, deformationMagnitude, [gridSize ** 3, 3])
+  coefficientData = vtk.vtkImageData()
+  coefficientData.SetDimensions(gridSize, gridSize, gridSize)
+  coefficientData.SetSpacing(gridSpacing, gridSpacing, gridSpacing)
+  gridOrigin = -PHANTOM_EXTENT_MM / 2 - gridSpacing
+  coefficientData.SetOrigin(gridOrigin, gridOrigin, gridOrigin)
+  from vtk.util import numpy_support
+  coefficientData.GetPointData().SetScalars(numpy_support.numpy_to_vtk(coefficients, deep=True, array_type=vtk.VTK_DOUBLE))
+  bsplineTransform = slicer.vtkOrientedBSplineTransform()
+  bsplineTransform.SetBorderModeToZero()
+  bsplineTransform.SetCoefficientData(coefficientData)
+
+  transform = vtk.vtkGeneralTransform()
+  transform.PostMultiply()
+  transform.Concatenate(bsplineTransform)
+  transform.Concatenate(linearTransform)
+  return transform
+
+
+def createPhantomPair(size, deformationMagnitude=4.0, seed=0):
+  """Returns fixed volume node, moving volume node, and the ground truth (fixed to moving) transform."""
+  from ElastixLib.resample import resampleVolume
+  fixedVolumeNode = createPhantomVolume(size, f"BenchmarkFixed{size}")
+  groundTruthTransform = createKnownDeformation(deformationMagnitude, seed=seed)
+  # moving(groundTruth(x)) = fixed(x), therefore moving is resampled from fixed by the inverse transform
+  inverseTransformNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLTransformNode", "BenchmarkInverseTransform")
+  inverseTransformNode.SetAndObserveTransformToParent(groundTruthTransform)
+  movingVolumeNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode", f"BenchmarkMoving{size}")
+  try:
+    resampleVolume(fixedVolumeNode, fixedVolumeNode, inverseTransformNode, movingVolumeNode, interpolationOrder=1)
+  finally:
+    slicer.mrmlScene.RemoveNode(inverseTransformNode)
+  return fixedVolumeNode, movingVolumeNode, groundTruthTransform
+
+
+def computeTransformErrors(resultTransform, groundTruthTransform, numberOfLandmarks=100, gridSize=10, seed=1):
+  """Compare a registration result with the ground truth, in mm.
+
+  Landmarks are random points inside the phantom body, field error is computed on a regular grid
+  that covers the central 80% of the volume.
+  """
+  randomState = np.random.RandomState(seed)
+  landmarks = randomState.uniform(-0.5, 0.5, [numberOfLandmarks, 3]) * PHANTOM_EXTENT_MM * 0.6
+  landmarkErrors = [np.linalg.norm(np.array(resultTransform.TransformPoint(point))
+                                   - np.array(groundTruthTransform.TransformPoint(point))) for point in landmarks]
+  gridCoordinates = np.linspace(-0.4, 0.4, gridSize) * PHANTOM_EXTENT_MM
+  fieldErrors = []
+  for x in gridCoordinates:
+    for y in gridCoordinates:
+      for z in gridCoordinates:
+        point = [x, y, z]
+        fieldErrors.append(np.linalg.norm(np.array(resultTransform.TransformPoint(point))
+                                          - np.array(groundTruthTransform.TransformPoint(point))))
+  return {
+    "landmarkErrorMean": float(np.mean(landmarkErrors)),
+    "landmarkErrorMax": float(np.max(landmarkErrors)),
+    "fieldErrorRms": float(math.sqrt(np.mean(np.square(fieldErrors))))
+  }
+
+
+def runBenchmark(presetIds=None, sizes=None, logic=None, deformationMagnitude=4.0, numberOfLandmarks=100,
+                 resultCallback=None):
+  """Register synthetic phantom pairs of each size with each preset and measure time, memory, I/O and accuracy.
+
+  :param resultCallback: function(result) that is called after each registration
+  :return: list of result dicts (see RESULT_FIELDS)
+  """
+  if presetIds is None:
+    presetIds = DEFAULT_PRESET_IDS
+  if sizes is None:
+    sizes = DEFAULT_SIZES
+  if logic is None:
+    from Elastix import ElastixLogic
+    logic = ElastixLogic()
+  # each run must do the complete registration
+  useResultCache = logic.useResultCache
+  logic.useResultCache = False
+  try:
+    return _runBenchmark(logic, presetIds, sizes, deformationMagnitude, numberOfLandmarks, resultCallback)
+  finally:
+    logic.useResultCache = useResultCache
+
+
+def _runBenchmark(logic, presetIds, sizes, deformationMagnitude, numberOfLandmarks, resultCallback):
+  results = []
+  for size in sizes:
+    fixedVolumeNode, movingVolumeNode, groundTruthTransform = createPhantomPair(size, deformationMagnitude)
+    try:
+      for presetId in presetIds:
+        result = {"presetId": presetId, "size": size}
+        preset = logic.getPresetByID(presetId)
+        outputTransformNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLTransformNode", "BenchmarkResult")
+        parameterFilenames = []
+        try:
+          if preset is None:
+            raise ValueError(f"Preset {presetId} not found")
+          parameterFilenames = preset.createParameterFiles()
+          startTime = time.time()
+          logic.registerVolumes(fixedVolumeNode, movingVolumeNode, parameterFilenames,
+                                outputTransformNode=outputTransformNode, forceDisplacementFieldOutputTransform=False)
+          result["wallTime"] = time.time() - startTime
+          timingReport = logic.getTimingReport()
+          result["elastixTime"] = timingReport.getPhaseDurations().get("Elastix")
+          result["bytesRead"] = sum(phase["bytesRead"] for phase in timingReport.phases)
+          result["bytesWritten"] = sum(phase["bytesWritten"] for phase in timingReport.phases)
+          # peak memory of the elastix process is measured by the job, None if it is not available on this platform
+          elastixPhases = [phase for phase in timingReport.phases if phase["name"] == "Elastix"]
+          elastixPeakMemory = elastixPhases[0]["details"].get("peakResidentMemoryBytes") if elastixPhases else None
+          result["childPeakRssMB"] = elastixPeakMemory / 1024 / 1024 if elastixPeakMemory else None
+          result.update(computeTransformErrors(outputTransformNode.GetTransformFromParent(), groundTruthTransform,
+                                               numberOfLandmarks))
+          result["status"] = "completed"
+        except Exception as e:
+          logging.error(f"Benchmark of preset {presetId} at size {size} failed: {e}")
+          result["status"] = f"failed: {e}"
+        finally:
+          from ElastixLib.preset import releaseParameterFiles
+          releaseParameterFiles(parameterFilenames)
+          slicer.mrmlScene.RemoveNode(outputTransformNode)
+        results.append(result)
+        if resultCallback:
+          resultCallback(result)
+    finally:
+      slicer.mrmlScene.RemoveNode(fixedVolumeNode)
+      slicer.mrmlScene.RemoveNode(movingVolumeNode)
+  return results
+
+
+def getEnvironmentInformation(logic):
+  """Information that is needed for comparing results between machines and elastix versions."""
+  from ElastixLib.utils import getNumberOfAvailableCores
+  return {
+    "platform": platform.platform(),
+    "processor": platform.processor(),
+    "numberOfCores": getNumberOfAvailableCores(),
+    "slicerVersion": slicer.app.applicationVersion,
+    "elastixVersion": logic.getElastixVersion(),
+    "time": time.strftime("%Y-%m-%dT%H:%M:%S")
+  }
+
+
+def writeResultsJson(results, filePath, environment=None):
+  with open(filePath, 'w') as file:
+    json.dump({"environment": environment or {}, "results": results}, file, indent=2)
+
+
+def readResultsJson(filePath):
+  with open(filePath, 'r') as file:
+    return json.load(file)["results"]
+
+
+def writeResultsCsv(results, filePath):
+  with open(filePath, 'w', newline='') as file:
+    writer = csv.DictWriter(file, fieldnames=RESULT_FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    # values that could not be measured
+    writer.writerows([{key: "n/a" if value is None else value for key, value in result.items()} for result in results])
+
+
+def compareWithBaseline(results, baselineResults, timeTolerance=0.25, errorToleranceMM=0.5, memoryTolerance=0.25):
+  """Find regressions compared to a baseline.
+
+  :param timeTolerance: allowed relative increase of wall time
+  :param errorToleranceMM: allowed increase of mean landmark error
+  :param memoryTolerance: allowed relative increase of child peak memory usage
+  :return: list of (presetId, size, description) of regressions
+  """
+  baseline = {(result["presetId"], result["size"]): result for result in baselineResults}
+  regressions = []
+  for result in results:
+    key = (result["presetId"], result["size"])
+    baselineResult = baseline.get(key)
+    if baselineResult is None or baselineResult.get("status") != "completed":
+      continue
+    if result.get("status") != "completed":
+      regressions.append((*key, f"registration {result.get('status')}"))
+      continue
+    if result["wallTime"] > baselineResult["wallTime"] * (1.0 + timeTolerance):
+      regressions.append((*key, f"wall time {result['wallTime']:.1f} s (baseline {baselineResult['wallTime']:.1f} s)"))
+    if result["landmarkErrorMean"] > baselineResult["landmarkErrorMean"] + errorToleranceMM:
+      regressions.append((*key, f"landmark error {result['landmarkErrorMean']:.2f} mm "
+                                f"(baseline {baselineResult['landmarkErrorMean']:.2f} mm)"))
+    if result.get("childPeakRssMB") and baselineResult.get("childPeakRssMB") \
+        and result["childPeakRssMB"] > baselineResult["childPeakRssMB"] * (1.0 + memoryTolerance):
+      regressions.append((*key, f"peak memory {result['childPeakRssMB']:.0f} MB "
+                                f"(baseline {baselineResult['childPeakRssMB']:.0f} MB)"))
+  return regressions
@@ -0,0 +1,358 @@
+import collections
+import hashlib
+import logging
+import os
+import shutil
+import time
+import uuid
+
+import numpy
+import slicer
+import vtk
+
+from ElastixLib.utils import createDirectory, createTempDirectory, getTempDirectoryBase, markDirectoryOwner, \
+  isDirectoryOwnerRunning
+
+
+def getDirectorySize(path):
+  size = 0
+  for root, dirnames, filenames in os.walk(path):
+    for filename in filenames:
+      try:
+        size += os.path.getsize(os.path.join(root, filename))
+      except OSError:
+        pass
+  return size
+
+
+def updateHashWithVolume(keyHash, volumeNode):
+  """Add geometry and voxel content of a volume to a hashlib hash object."""
+  ijkToRas = vtk.vtkMatrix4x4()
+  volumeNode.GetIJKToRASMatrix(ijkToRas)
+  geometry = [ijkToRas.GetElement(row, col) for row in range(3) for col in range(4)]
+  imageData = volumeNode.GetImageData()
+  keyHash.update(f"{volumeNode.GetClassName()}|{geometry}|{imageData.GetDimensions()}|"
+                 f"{imageData.GetScalarTypeAsString()}".encode())
+  keyHash.update(numpy.ascontiguousarray(slicer.util.arrayFromVolume(volumeNode)))
+
+
+def updateHashWithFile(keyHash, filePath):
+  with open(filePath, 'rb') as file:
+    for chunk in iter(lambda: file.read(1024 * 1024), b''):
+      keyHash.update(chunk)
+
+
+class DiskCache:
+  """Directory-per-entry cache on disk with least-recently-used eviction under a size quota.
+
+  Entries that are pinned (in use by a running registration) are never evicted.
+  """
+
+  PARTIAL_SUFFIX = ".partial"
+
+  def __init__(self, directory, maximumSizeBytes):
+    self.directory = createDirectory(directory)
+    self.maximumSizeBytes = maximumSizeBytes
+    self.hits = 0
+    self.misses = 0
+    # key -> size in bytes, least recently used first
+    self._entries = collections.OrderedDict()
+    self._pinCounts = collections.Counter()
+    self._scanDirectory()
+
+  def _scanDirectory(self):
+    entries = []
+    for entry in os.scandir(self.directory):
+      if not entry.is_dir():
+        continue
+      if self.PARTIAL_SUFFIX in entry.name:
+        # left behind by an interrupted store
+        shutil.rmtree(entry.path, ignore_errors=True)
+        continue
+      entries.append((entry.stat().st_mtime, entry.name, getDirectorySize(entry.path)))
+    for mtime, key, size in sorted(entries):
+      self._entries[key] = size
+
+  def getEntryPath(self, key):
+    return os.path.join(self.directory, key)
+
+  def lookup(self, key):
+    """Returns the entry directory if key is cached (and marks it as most recently used), None otherwise."""
+    entryPath = self.getEntryPath(key)
+    if key in self._entries and os.path.isdir(entryPath):
+      self.hits += 1
+      self._entries.move_to_end(key)
+      os.utime(entryPath)
+      return entryPath
+    self._entries.pop(key, None)
+    self.misses += 1
+    return None
+
+  def store(self, key, fillFunction):
+    """Creates a new entry. fillFunction is called with a directory path that it must populate."""
+    entryPath = self.getEntryPath(key)
+    partialPath = createDirectory(f"{entryPath}{self.PARTIAL_SUFFIX}-{uuid.uuid4().hex}")
+    try:
+      fillFunction(partialPath)
+      if os.path.isdir(entryPath):
+        shutil.rmtree(entryPath)
+      os.rename(partialPath, entryPath)
+    finally:
+      if os.path.isdir(partialPath):
+        shutil.rmtree(partialPath, ignore_errors=True)
+    self._entries[key] = getDirectorySize(entryPath)
+    self._entries.move_to_end(key)
+    self.evict()
+    return entryPath
+
+  def pin(self, key):
+    self._pinCounts[key] += 1
+
+  def unpin(self, key):
+    self._pinCounts[key] -= 1
+    if self._pinCounts[key] <= 0:
+      del self._pinCounts[key]
+
+  def getSize(self):
+    return sum(self._entries.values())
+
+  def evict(self):
+    totalSize = self.getSize()
+    for key in list(self._entries.keys()):
+      if totalSize <= self.maximumSizeBytes:
+        break
+      if self._pinCounts[key] > 0:
+        continue
+      totalSize -= self._entries.pop(key)
+      shutil.rmtree(self.getEntryPath(key), ignore_errors=True)
+      logging.debug(f"Evicted {key} from {self.directory}")
+
+  def clear(self):
+    for key in list(self._entries.keys()):
+      if self._pinCounts[key] > 0:
+        continue
+      del self._entries[key]
+      shutil.rmtree(self.getEntryPath(key), ignore_errors=True)
+
+  def getHitRate(self):
+    lookups = self.hits + self.misses
+    return self.hits / lookups if lookups else 0.0
+
+  def getStatistics(self):
+    return {
+      "hits": self.hits,
+      "misses": self.misses,
+      "hitRate": self.getHitRate(),
+      "entries": len(self._entries),
+      "sizeBytes": self.getSize(),
+      "maximumSizeBytes": self.maximumSizeBytes
+    }
+
+
+class InputStagingCache(DiskCache):
+  """Keeps exported input volumes (fixed, moving, masks) so that repeated registrations can skip the export.
+
+  By default an entry is identified by the node ID, the modification time of the image data and the volume geometry,
+  which is cheap to compute. If useContentHash is enabled then the voxel content is hashed instead, which is slower
+  but allows reusing files between nodes that contain identical data.
+
+  Entries are only valid within the current session, therefore each process stores them in its own session
+  directory (marked with the process ID). Session directories of processes that are no longer running are
+  removed when a new cache is created, session directories of running processes are never touched.
+  """
+
+  DIRECTORY_NAME = "InputCache"
+  MAXIMUM_SIZE_SETTINGS_KEY = "Elastix/InputStagingCacheSizeMB"
+  DEFAULT_MAXIMUM_SIZE_MB = 4096
+  # recently modified session directories are not removed, as their owner may not have marked them yet
+  MINIMUM_STALE_SESSION_AGE_SEC = 60
+
+  def __init__(self, directory=None, maximumSizeBytes=None):
+    """
+    :param directory: folder of the session directories, default is InputCache in the Slicer temporary folder
+    """
+    if directory is None:
+      directory = os.path.join(getTempDirectoryBase(), self.DIRECTORY_NAME)
+    if maximumSizeBytes is None:
+      maximumSizeBytes = int(slicer.util.settingsValue(self.MAXIMUM_SIZE_SETTINGS_KEY, self.DEFAULT_MAXIMUM_SIZE_MB,
+                                                       converter=int)) * 1024 * 1024
+    self.baseDirectory = createDirectory(directory)
+    self.removeStaleSessions()
+    sessionDirectory = createTempDirectory(self.baseDirectory)
+    markDirectoryOwner(sessionDirectory)
+    super().__init__(sessionDirectory, maximumSizeBytes)
+    self.useContentHash = False
+
+  def removeStaleSessions(self):
+    """Remove session directories (and files of earlier versions) that are not used by a running process."""
+    now = time.time()
+    for entry in os.scandir(self.baseDirectory):
+      if not entry.is_dir() or now - entry.stat().st_mtime < self.MINIMUM_STALE_SESSION_AGE_SEC \
+          or isDirectoryOwnerRunning(entry.path):
+        continue
+      shutil.rmtree(entry.path, ignore_errors=True)
+      logging.debug(f"Removed input staging cache directory {entry.path} of an earlier session")
+
+  def purge(self):
+    """Remove all entries of this session that are not in use."""
+    self.clear()
+
+  def getVolumeKey(self, volumeNode, filename, variant=""):
+    keyHash = hashlib.blake2b(digest_size=20)
+    keyHash.update(f"{filename}|{variant}".encode())
+    if self.useContentHash:
+      updateHashWithVolume(keyHash, volumeNode)
+    else:
+      ijkToRas = vtk.vtkMatrix4x4()
+      volumeNode.GetIJKToRASMatrix(ijkToRas)
+      geometry = [ijkToRas.GetElement(row, col) for row in range(3) for col in range(4)]
+      keyHash.update(f"{volumeNode.GetClassName()}|{geometry}|{volumeNode.GetID()}|"
+                     f"{volumeNode.GetImageData().GetMTime()}".encode())
+    return keyHash.hexdigest()
+
+  def stageVolume(self, volumeNode, filename, exportFunction=None, variant=""):
+    """Returns path of the exported volume, exporting it only if there is no up-to-date copy in the cache.
+
+    The entry is pinned until release() is called with the returned path.
+
+    :param exportFunction: function(volumeNode, filePath) that writes the volume, default is slicer.util.exportNode
+    :param variant: string that describes how exportFunction writes the file (e.g., compression, pixel type),
+      files written with different variants are cached separately
+    """
+    if exportFunction is None:
+      exportFunction = slicer.util.exportNode
+    key = self.getVolumeKey(volumeNode, filename, variant)
+    # pin before storing so that the new entry is not evicted right away if the quota is small
+    self.pin(key)
+    try:
+      entryPath = self.lookup(key)
+      if entryPath is None:
+        entryPath = self.store(key, lambda path: exportFunction(volumeNode, os.path.join(path, filename)))
+    except:
+      self.unpin(key)
+      raise
+    return os.path.join(entryPath, filename)
+
+  def release(self, filePath):
+    entryPath = os.path.dirname(os.path.abspath(filePath))
+    if os.path.dirname(entryPath) != os.path.abspath(self.directory):
+      # not staged by this cache
+      return
+    self.unpin(os.path.basename(entryPath))
+
+
+class RegistrationResultCache(DiskCache):
+  """Keeps registration results (transform parameter files written by elastix) across sessions so that
+  running the same registration again does not need to launch elastix.
+
+  An entry is identified by the content of all inputs (volumes, masks, initial transform), the exact text
+  of the parameter files, and the elastix version.
+  """
+
+  DIRECTORY_NAME = "ResultCache"
+  MAXIMUM_SIZE_SETTINGS_KEY = "Elastix/ResultCacheSizeMB"
+  DEFAULT_MAXIMUM_SIZE_MB = 1024
+  # absolute paths of the working directory in transform parameter files are replaced by this placeholder
+  WORKING_DIRECTORY_PLACEHOLDER = "$(ElastixWorkingDirectory)"
+
+  def __init__(self, directory=None, maximumSizeBytes=None):
+    if directory is None:
+      directory = os.path.join(slicer.app.cachePath, "Elastix", self.DIRECTORY_NAME)
+    if maximumSizeBytes is None:
+      maximumSizeBytes = int(slicer.util.settingsValue(self.MAXIMUM_SIZE_SETTINGS_KEY, self.DEFAULT_MAXIMUM_SIZE_MB,
+                                                       converter=int)) * 1024 * 1024
+    super().__init__(directory, maximumSizeBytes)
+
+  def getRegistrationKey(self, inputVolumes, parameterFilenames, initialTransformFilePath=None, elastixVersion="",
+                         variant=""):
+    """
+    :param inputVolumes: dict of elastix command-line parameter name (-f, -m, -fMask, -mMask) -> volume node
+    :param variant: describes processing options that change the result (such as cropping of the inputs)
+    """
+    keyHash = hashlib.blake2b(digest_size=20)
+    keyHash.update(f"elastix {elastixVersion}".encode())
+    keyHash.update(f"variant {variant}".encode())
+    for paramName in sorted(inputVolumes.keys()):
+      keyHash.update(paramName.encode())
+      updateHashWithVolume(keyHash, inputVolumes[paramName])
+    for parameterFilename in parameterFilenames:
+      keyHash.update(b"-p")
+      updateHashWithFile(keyHash, parameterFilename)
+    if initialTransformFilePath:
+      keyHash.update(b"-t0")
+      updateHashWithFile(keyHash, initialTransformFilePath)
+    return keyHash.hexdigest()
+
+  def storeResult(self, key, resultTransformDir, workingDir):
+    """Store transform parameter files of resultTransformDir, paths that point into workingDir are made relocatable."""
+
+    def copyResult(entryPath):
+      for filename in os.listdir(resultTransformDir):
+        if not filename.startswith("TransformParameters."):
+          continue
+        sourcePath = os.path.join(resultTransformDir, filename)
+        if filename.endswith(".txt"):
+          self._copyRelocatable(sourcePath, os.path.join(entryPath, filename), workingDir)
+        else:
+          shutil.copy2(sourcePath, entryPath)
+
+    return self.store(key, copyResult)
+
+  def restoreResult(self, key, resultTransformDir, workingDir):
+    """Copy a cached result into resultTransformDir. Returns False if key is not in the cache."""
+    entryPath = self.lookup(key)
+    if entryPath is None:
+      return False
+    for filename in os.listdir(entryPath):
+      sourcePath = os.path.join(entryPath, filename)
+      if filename.endswith(".txt"):
+        self._copyRelocated(sourcePath, os.path.join(resultTransformDir, filename), workingDir)
+      else:
+        shutil.copy2(sourcePath, resultTransformDir)
+    return True
+
+  def _copyRelocatable(self, sourcePath, targetPath, workingDir):
+    """Copy a transform parameter file, replacing paths that point into workingDir by a placeholder."""
+    with open(sourcePath, 'r') as file:
+      text = file.read()
+    for path in self._getPathVariants(workingDir):
+      text = text.replace(path, self.WORKING_DIRECTORY_PLACEHOLDER)
+    with open(targetPath, 'w') as file:
+      file.write(text)
+
+  def _copyRelocated(self, sourcePath, targetPath, workingDir):
+    """Copy a transform parameter file written by _copyRelocatable, replacing the placeholder by workingDir."""
+    with open(sourcePath, 'r') as file:
+      text = file.read()
+    with open(targetPath, 'w') as file:
+      file.write(text.replace(self.WORKING_DIRECTORY_PLACEHOLDER, workingDir))
+
+  @staticmethod
+  def _getPathVariants(path):
+    path = os.path.abspath(path)
+    return sorted({path, path.replace("\\", "/")}, key=len, reverse=True)
+
+
+class RegistrationStageCache(RegistrationResultCache):
+  """Keeps results of single registration stages (the transform parameter file written by elastix for one
+  parameter file), so that a registration can be resumed at the first stage that has changed.
+
+  Keys are computed by getRegistrationKey, with the parameter files of the stage and all the stages before it.
+  """
+
+  DIRECTORY_NAME = "StageCache"
+  MAXIMUM_SIZE_SETTINGS_KEY = "Elastix/StageCacheSizeMB"
+  DEFAULT_MAXIMUM_SIZE_MB = 1024
+  STAGE_RESULT_FILENAME = "TransformParameters.txt"
+
+  def storeStageResult(self, key, transformParameterFilePath, workingDir):
+    return self.store(key, lambda entryPath: self._copyRelocatable(
+      transformParameterFilePath, os.path.join(entryPath, self.STAGE_RESULT_FILENAME), workingDir))
+
+  def restoreStageResult(self, key, transformParameterFilePath, workingDir):
+    """Write the cached stage result to transformParameterFilePath. Returns False if key is not in the cache."""
+    entryPath = self.lookup(key)
+    if entryPath is None:
+      return False
+    self._copyRelocated(os.path.join(entryPath, self.STAGE_RESULT_FILENAME), transformParameterFilePath, workingDir)
+    return True
@@ -0,0 +1,96 @@
+import itertools
+import math
+
+import numpy as np
+import slicer
+import vtk
+
+
+def getMaskBounds(maskNode, marginMM=0.0):
+  """Returns RAS bounding box [xmin, xmax, ymin, ymax, zmin, zmax] of the non-zero voxels of a mask, extended
+  by marginMM in each direction, None if the mask is empty."""
+  maskArray = slicer.util.arrayFromVolume(maskNode)
+  nonZeroKji = np.nonzero(maskArray)
+  if len(nonZeroKji[0]) == 0:
+    return None
+  # voxel corners of the bounding box, in IJK
+  ijkMin = [nonZeroKji[axis].min() - 0.5 for axis in [2, 1, 0]]
+  ijkMax = [nonZeroKji[axis].max() + 0.5 for axis in [2, 1, 0]]
+  ijkToRas = vtk.vtkMatrix4x4()
+  maskNode.GetIJKToRASMatrix(ijkToRas)
+  corners = [ijkToRas.MultiplyPoint([i, j, k, 1])[:3] for i, j, k in itertools.product(*zip(ijkMin, ijkMax))]
+  rasMin = np.min(corners, axis=0) - marginMM
+  rasMax = np.max(corners, axis=0) + marginMM
+  return [rasMin[0], rasMax[0], rasMin[1], rasMax[1], rasMin[2], rasMax[2]]
+
+
+def getCroppedExtent(volumeNode, rasBounds):
+  """Returns the voxel extent of volumeNode that covers rasBounds (clamped to the volume extent)."""
+  rasToIjk = vtk.vtkMatrix4x4()
+  volumeNode.GetRASToIJKMatrix(rasToIjk)
+  corners = [rasToIjk.MultiplyPoint([x, y, z, 1])[:3]
+             for x, y, z in itertools.product(rasBounds[0:2], rasBounds[2:4], rasBounds[4:6])]
+  ijkMin = np.min(corners, axis=0)
+  ijkMax = np.max(corners, axis=0)
+  volumeExtent = volumeNode.GetImageData().GetExtent()
+  croppedExtent = []
+  for axis in range(3):
+    croppedExtent.append(max(volumeExtent[axis * 2], int(math.floor(ijkMin[axis]))))
+    croppedExtent.append(min(volumeExtent[axis * 2 + 1], int(math.ceil(ijkMax[axis]))))
+  return croppedExtent
+
+
+def cropVolume(volumeNode, rasBounds, name=None):
+  """Create a new volume node that contains the voxels of volumeNode within rasBounds.
+
+  Voxels keep their physical position (the IJK to RAS matrix is shifted), therefore transforms computed
+  from the cropped volume are valid for the original volume, too.
+
+  :return: the cropped volume node, or None if cropping would not make the volume smaller
+    or the region is outside of the volume
+  """
+  volumeExtent = volumeNode.GetImageData().GetExtent()
+  croppedExtent = getCroppedExtent(volumeNode, rasBounds)
+  if any(croppedExtent[axis * 2] > croppedExtent[axis * 2 + 1] for axis in range(3)):
+    return None
+  if list(croppedExtent) == list(volumeExtent):
+    return None
+
+  # array is indexed as [k, j, i] and starts at the first voxel of the extent
+  iMin, iMax, jMin, jMax, kMin, kMax = [croppedExtent[index] - volumeExtent[(index // 2) * 2] for index in range(6)]
+  croppedArray = slicer.util.arrayFromVolume(volumeNode)[kMin:kMax + 1, jMin:jMax + 1, iMin:iMax + 1]
+
+  croppedVolumeNode = slicer.mrmlScene.AddNewNodeByClass(volumeNode.GetClassName(),
+                                                         name if name else f"{volumeNode.GetName()} cropped")
+  croppedVolumeNode.SetHideFromEditors(True)
+  slicer.util.updateVolumeFromArray(croppedVolumeNode, np.ascontiguousarray(croppedArray))
+  ijkToRas = vtk.vtkMatrix4x4()
+  volumeNode.GetIJKToRASMatrix(ijkToRas)
+  origin = ijkToRas.MultiplyPoint([croppedExtent[0], croppedExtent[2], croppedExtent[4], 1])
+  for row in range(3):
+    ijkToRas.SetElement(row, 3, origin[row])
+  croppedVolumeNode.SetIJKToRASMatrix(ijkToRas)
+  return croppedVolumeNode
+
+
+def getVolumeGeometryParameters(volumeNode):
+  """Returns elastix parameters (Size, Index, Spacing, Origin, Direction) that describe the voxel grid of a volume."""
+  ijkToRas = vtk.vtkMatrix4x4()
+  volumeNode.GetIJKToRASMatrix(ijkToRas)
+  spacing = volumeNode.GetSpacing()
+  dimensions = volumeNode.GetImageData().GetDimensions()
+  extent = volumeNode.GetImageData().GetExtent()
+  origin = ijkToRas.MultiplyPoint([extent[0], extent[2], extent[4], 1])
+  lpsToRas = [-1.0, -1.0, 1.0]
+  # elastix uses LPS coordinate system and writes the direction matrix column by column
+  direction = []
+  for column in range(3):
+    for row in range(3):
+      direction.append(lpsToRas[row] * ijkToRas.GetElement(row, column) / spacing[column])
+  return {
+    "Size": list(dimensions),
+    "Index": [0, 0, 0],
+    "Spacing": [float(value) for value in spacing],
+    "Origin": [lpsToRas[axis] * origin[axis] for axis in range(3)],
+    "Direction": direction
+  }
@@ -5,7 +5,9 @@ import qt
 import vtk
 
 import abc
+import json
 import os
+import uuid
 
 from typing import Callable
 
@@ -14,8 +16,22 @@ from pathlib import Path
 from ElastixLib.preset import Preset, UserPreset, createPreset
 
 
+def getModificationTimes(filePaths):
+  """Returns dict of file path -> modification time (None if the file does not exist)."""
+  modificationTimes = {}
+  for filePath in filePaths:
+    try:
+      modificationTimes[filePath] = os.path.getmtime(filePath)
+    except OSError:
+      modificationTimes[filePath] = None
+  return modificationTimes
+
+
 class ElastixDatabase(abc.ABC):
 
+  # used in messages to identify the database
+  NAME = ""
+
   @property
   def logCallback(self):
     return self._logCallback
@@ -24,13 +40,16 @@ class ElastixDatabase(abc.ABC):
   def logCallback(self, cb: Callable = None):
     self._logCallback = cb
 
-  def getRegistrationPresetsFromXML(self, elastixParameterSetDatabasePath, presetClass):
+  @staticmethod
+  def readPresetAttributesFromXML(elastixParameterSetDatabasePath):
+    """Returns createPreset arguments (id, modality, content, description, publications, parameterFiles,
+    maximumWorkingSpacing) of each preset of the XML file."""
     if not os.path.isfile(elastixParameterSetDatabasePath):
       raise ValueError("Failed to open parameter set database: " + elastixParameterSetDatabasePath)
     elastixParameterSetDatabaseXml = vtk.vtkXMLUtilities.ReadElementFromFile(elastixParameterSetDatabasePath)
 
     # Create python list from XML for convenience
-    registrationPresets = []
+    presetsAttributes = []
     if elastixParameterSetDatabaseXml is not None:
       for parameterSetIndex in range(elastixParameterSetDatabaseXml.GetNumberOfNestedElements()):
         parameterSetXml = elastixParameterSetDatabaseXml.GetNestedElement(parameterSetIndex)
@@ -41,29 +60,44 @@ class ElastixDatabase(abc.ABC):
             str(Path(elastixParameterSetDatabasePath).parent),
             parameterFilesXml.GetNestedElement(parameterFileIndex).GetAttribute('Name'))
           )
-        parameterSetAttributes = \
-          [parameterSetXml.GetAttribute(attr) if parameterSetXml.GetAttribute(attr) is not None else "" for attr in ['id', 'modality', 'content', 'description', 'publications']]
-        try:
-          registrationPresets.append(
-            createPreset(*parameterSetAttributes, parameterFiles=parameterFiles, presetClass=presetClass)
-          )
-        except FileNotFoundError as exc:
-          msg = f"Cannot load preset. Loading failed with error: {exc}"
-          logging.error(msg)
-          if self.logCallback:
-            self.logCallback(msg)
-          continue
+        attributes = {attr: parameterSetXml.GetAttribute(attr) if parameterSetXml.GetAttribute(attr) is not None else ""
+                      for attr in ['id', 'modality', 'content', 'description', 'publications']}
+        attributes["maximumWorkingSpacing"] = float(parameterSetXml.GetAttribute('maximumWorkingSpacing') or 0.0)
+        attributes["parameterFiles"] = parameterFiles
+        presetsAttributes.append(attributes)
+    return presetsAttributes
+
+  def createPresets(self, presetsAttributes, presetClass):
+    registrationPresets = []
+    for attributes in presetsAttributes:
+      try:
+        registrationPresets.append(createPreset(**attributes, presetClass=presetClass))
+      except FileNotFoundError as exc:
+        msg = f"Cannot load preset. Loading failed with error: {exc}"
+        logging.error(msg)
+        if self.logCallback:
+          self.logCallback(msg)
+        continue
     return registrationPresets
 
+  def getRegistrationPresetsFromXML(self, elastixParameterSetDatabasePath, presetClass):
+    return self.createPresets(self.readPresetAttributesFromXML(elastixParameterSetDatabasePath), presetClass)
+
   def __init__(self):
     self._logCallback = None
     self.registrationPresets = None
+    # incremented when the preset list changes, so that users of the list know when to update
+    self.generation = 0
 
   def getRegistrationPresets(self, force_refresh=False):
-    if self.registrationPresets and not force_refresh:
+    if self.registrationPresets is not None and not force_refresh:
       return self.registrationPresets
 
-    self.registrationPresets = self._getRegistrationPresets()
+    registrationPresets = self._getRegistrationPresets()
+    if self.registrationPresets is None or len(registrationPresets) != len(self.registrationPresets) \
+      or any(preset is not previousPreset for preset, previousPreset in zip(registrationPresets, self.registrationPresets)):
+      self.generation += 1
+    self.registrationPresets = registrationPresets
 
     return self.registrationPresets
 
@@ -79,17 +113,42 @@ class BuiltinElastixDatabase(ElastixDatabase):
     os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Resources', 'RegistrationParameters',
                  'ElastixParameterSetDatabase.xml'))
 
+  NAME = "built-in"
+
+  def __init__(self):
+    super().__init__()
+    # modification time of the database file and of the parameter files when the presets were created
+    self._modificationTimes = {}
+
   def getPresetsDir(self):
     return str(Path(self.DATABASE_FILE).parent)
 
+  def getRegistrationPresets(self, force_refresh=False):
+    # presets (and their cached parameter file content) are only recreated if any of the files has changed
+    if self.registrationPresets is not None \
+      and (not force_refresh or getModificationTimes(self._modificationTimes.keys()) == self._modificationTimes):
+      return self.registrationPresets
+    return super().getRegistrationPresets(force_refresh=True)
+
   def _getRegistrationPresets(self):
-    return self.getRegistrationPresetsFromXML(self.DATABASE_FILE, presetClass=Preset)
+    presetsAttributes = self.readPresetAttributesFromXML(self.DATABASE_FILE)
+    parameterFiles = [filePath for attributes in presetsAttributes for filePath in attributes["parameterFiles"]]
+    self._modificationTimes = getModificationTimes([self.DATABASE_FILE] + parameterFiles)
+    return self.createPresets(presetsAttributes, presetClass=Preset)
 
 
 class UserElastixDataBase(ElastixDatabase):
 
   DATABASE_LOCATION = Path(slicer.app.slicerUserSettingsFilePath).parent / "Elastix"
 
+  # preset metadata and modification time of each XML file and its parameter files, to avoid parsing unchanged XML files.
+  # The index is stored in the cache folder, as writing it into the watched database folder would trigger a rescan.
+  INDEX_LOCATION = Path(slicer.app.cachePath) / "Elastix"
+  INDEX_FILE_NAME = "UserPresetIndex.json"
+  INDEX_VERSION = 2
+
+  NAME = "user"
+
   @staticmethod
   def getAllXMLFiles(directory):
     import fnmatch
@@ -101,31 +160,158 @@ class UserElastixDataBase(ElastixDatabase):
 
   def __init__(self):
     self.DATABASE_LOCATION.mkdir(exist_ok=True)
+    # earlier versions stored the index in the database folder
+    (self.DATABASE_LOCATION / "index.json").unlink(missing_ok=True)
     self._presetLocations = {}
+    # XML file path -> (modification times of the XML file and its parameter files, presets),
+    # presets are only recreated if any of these files changes
+    self._presetsByFile = {}
+    self._index = None
+    self._modified = True
+    # changes of the database folder, preset folders, XML files, and parameter files invalidate the preset list
+    self._fileSystemWatcher = qt.QFileSystemWatcher()
+    self._fileSystemWatcher.connect('directoryChanged(QString)', self._onFileSystemChanged)
+    self._fileSystemWatcher.connect('fileChanged(QString)', self._onFileSystemChanged)
     super().__init__()
 
   def getPresetsDir(self):
     return str(self.DATABASE_LOCATION)
 
+  def getIndexFilePath(self):
+    return str(self.INDEX_LOCATION / self.INDEX_FILE_NAME)
+
+  def invalidate(self):
+    """Rescan the database folder at the next refresh. Changes are detected automatically, calling this is only
+    needed if the presets are requested (without force_refresh) right after a change, before file system
+    notifications are processed."""
+    self._modified = True
+
+  def _onFileSystemChanged(self, path):
+    self._modified = True
+
+  def getRegistrationPresets(self, force_refresh=False):
+    # folders and files are watched, there is no need to rescan them if nothing has changed.
+    # Notifications are only delivered by the event loop, therefore force_refresh always rescans the folders
+    # (unchanged presets are kept, based on the modification times of their files).
+    if self.registrationPresets is not None and not self._modified and not force_refresh:
+      return self.registrationPresets
+    return super().getRegistrationPresets(force_refresh=True)
+
   def _getRegistrationPresets(self):
-    xml_files = self.getAllXMLFiles(self.DATABASE_LOCATION)
+    self._modified = False
+    if self._index is None:
+      self._index = self._readIndex()
+    indexModified = False
+    presetsByFile = {}
+    for xml_file in self.getAllXMLFiles(self.DATABASE_LOCATION):
+      if xml_file in self._presetsByFile:
+        modificationTimes, presets = self._presetsByFile[xml_file]
+        if getModificationTimes(modificationTimes.keys()) == modificationTimes:
+          presetsByFile[xml_file] = self._presetsByFile[xml_file]
+          continue
+      presetsAttributes = self._getIndexedPresetsAttributes(xml_file)
+      if presetsAttributes is None:
+        presetsAttributes = self.readPresetAttributesFromXML(xml_file)
+        if len(presetsAttributes) > 1:
+          raise RuntimeError("The User presets are intended to have one preset per .xml file only.")
+        self._setIndexedPresetsAttributes(xml_file, presetsAttributes)
+        indexModified = True
+      modificationTimes = getModificationTimes([xml_file] + self._getParameterFiles(presetsAttributes))
+      presetsByFile[xml_file] = (modificationTimes, self.createPresets(presetsAttributes, presetClass=UserPreset))
+
+    # remove deleted presets from the index
+    for indexedFile in list(self._index.keys()):
+      if os.path.join(self.DATABASE_LOCATION, indexedFile) not in presetsByFile:
+        del self._index[indexedFile]
+        indexModified = True
+    if indexModified:
+      self._writeIndex()
+
+    self._presetsByFile = presetsByFile
+    self._presetLocations = {}
     registrationPresets = []
-    for xml_file in xml_files:
-      presets = self.getRegistrationPresetsFromXML(xml_file, presetClass=UserPreset)
-      if len(presets) > 1:
-        raise RuntimeError("The User presets are intended to have one preset per .xml file only.")
+    for xml_file, (modificationTimes, presets) in presetsByFile.items():
       for preset in presets:
         self._presetLocations[preset] = str(Path(xml_file).parent)
       registrationPresets.extend(presets)
+    self._updateWatchedPaths()
     return registrationPresets
 
+  @staticmethod
+  def _getParameterFiles(presetsAttributes):
+    return [filePath for attributes in presetsAttributes for filePath in attributes["parameterFiles"]]
+
+  def _getIndexedPresetsAttributes(self, xmlFilePath):
+    """Returns createPreset arguments of presets of the XML file from the index, None if the file is not indexed
+    or the XML file or any of its parameter files has changed since."""
+    entry = self._index.get(os.path.relpath(xmlFilePath, self.DATABASE_LOCATION))
+    if entry is None or entry["mtime"] != os.path.getmtime(xmlFilePath):
+      return None
+    presetFolder = str(Path(xmlFilePath).parent)
+    parameterFileModificationTimes = {os.path.join(presetFolder, name): modificationTime
+                                      for name, modificationTime in entry["parameterFileMtimes"].items()}
+    if getModificationTimes(parameterFileModificationTimes.keys()) != parameterFileModificationTimes:
+      return None
+    return [dict(attributes, parameterFiles=[os.path.join(presetFolder, name) for name in attributes["parameterFiles"]])
+            for attributes in entry["presets"]]
+
+  def _setIndexedPresetsAttributes(self, xmlFilePath, presetsAttributes):
+    # parameter files are stored relative to the preset folder so that the database folder can be moved
+    parameterFileModificationTimes = getModificationTimes(self._getParameterFiles(presetsAttributes))
+    self._index[os.path.relpath(xmlFilePath, self.DATABASE_LOCATION)] = {
+      "mtime": os.path.getmtime(xmlFilePath),
+      "parameterFileMtimes": {os.path.basename(path): modificationTime
+                              for path, modificationTime in parameterFileModificationTimes.items()},
+      "presets": [dict(attributes, parameterFiles=[os.path.basename(path) for path in attributes["parameterFiles"]])
+                  for attributes in presetsAttributes]
+    }
+
+  def _readIndex(self):
+    try:
+      with open(self.getIndexFilePath(), 'r') as file:
+        index = json.load(file)
+      if index.get("version") == self.INDEX_VERSION:
+        return index["files"]
+    except (OSError, ValueError, KeyError, AttributeError):
+      # index is missing or invalid, it is recreated from the XML files
+      pass
+    return {}
+
+  def _writeIndex(self):
+    indexFilePath = self.getIndexFilePath()
+    # write to a temporary file and rename it so that other users of a shared database never see a partial file
+    partialFilePath = f"{indexFilePath}.{uuid.uuid4().hex}.partial"
+    try:
+      self.INDEX_LOCATION.mkdir(parents=True, exist_ok=True)
+      with open(partialFilePath, 'w') as file:
+        json.dump({"version": self.INDEX_VERSION, "files": self._index}, file, indent=2)
+      os.replace(partialFilePath, indexFilePath)
+    except OSError as exc:
+      # the index only speeds up loading, the database is usable without it
+      logging.warning(f"Failed to write user preset database index {indexFilePath}: {exc}")
+
+  def _updateWatchedPaths(self):
+    paths = {str(self.DATABASE_LOCATION)}
+    for xml_file, (modificationTimes, presets) in self._presetsByFile.items():
+      paths.add(str(Path(xml_file).parent))
+      # directory watches do not report changes of the content of files
+      paths.update(filePath for filePath, modificationTime in modificationTimes.items() if modificationTime is not None)
+    watchedPaths = set(self._fileSystemWatcher.directories()) | set(self._fileSystemWatcher.files())
+    for path in watchedPaths - paths:
+      self._fileSystemWatcher.removePath(path)
+    for path in paths - watchedPaths:
+      self._fileSystemWatcher.addPath(path)
+
   def deletePreset(self, preset: UserPreset):
     path = self._presetLocations.pop(preset)
     shutil.rmtree(path)
+    self.invalidate()
 
 
 class InSceneElastixDatabase(ElastixDatabase):
 
+  NAME = "in-scene"
+
   def _getRegistrationPresets(self):
     registrationPresets = []
 
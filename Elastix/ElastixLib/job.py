@@ -0,0 +1,436 @@
+import logging
+import os
+import platform
+import queue
+import signal
+import subprocess
+import threading
+import time
+
+import qt
+import slicer
+
+from ElastixLib.monitor import ProcessResourceMonitor
+
+
+def killProcessTree(process):
+  """Kill a process started by ElastixLogic and all of its child processes."""
+  if process.poll() is not None:
+    return
+  if platform.system() == 'Windows':
+    info = subprocess.STARTUPINFO()
+    info.dwFlags = 1
+    info.wShowWindow = 0
+    subprocess.run(['taskkill', '/F', '/T', '/PID', str(process.pid)], startupinfo=info,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+  else:
+    # processes are started in their own session, so the process group ID is the same as the PID
+    try:
+      os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+      pass
+
+
+class ProcessOutputReader(threading.Thread):
+  """Reads the output of a process on a background thread so that the main thread is never blocked by it."""
+
+  def __init__(self, process):
+    super().__init__(daemon=True)
+    self.process = process
+    self.lines = queue.Queue()
+
+  def run(self):
+    while True:
+      try:
+        line = self.process.stdout.readline()
+      except UnicodeDecodeError:
+        # Probably system locale is set to non-English, we cannot easily capture process output.
+        # Code page conversion happens because `universal_newlines=True` sets process output to text mode.
+        continue
+      except ValueError:
+        # stream was closed
+        break
+      if not line:
+        break
+      self.lines.put(line.rstrip())
+    self.process.stdout.close()
+
+  def getLines(self):
+    lines = []
+    while True:
+      try:
+        lines.append(self.lines.get_nowait())
+      except queue.Empty:
+        return lines
+
+
+class RegistrationJob:
+  """Handle of a registration that runs without blocking the application.
+
+  The registration itself is a generator (see ElastixLogic._registrationSteps) that yields each
+  elastix/transformix process that it starts. Process output is read on a background thread and the
+  generator is resumed on the main thread when the process has finished, therefore the steps can access
+  the MRML scene safely.
+  """
+
+  QUEUED = "queued"
+  RUNNING = "running"
+  COMPLETED = "completed"
+  FAILED = "failed"
+  CANCELLED = "cancelled"
+
+  POLL_INTERVAL_MSEC = 100
+
+  def __init__(self, createSteps, name="", logCallback=None):
+    """
+    :param createSteps: function that takes the job as argument and returns the generator of registration steps
+    """
+    self.name = name
+    self.state = self.QUEUED
+    self.error = None
+    self.tempDir = None
+    self.cancelRequested = False
+    self.logStandardOutput = False
+    # number of threads used by each elastix/transformix process, 0 = determined automatically from the number of
+    # concurrently running jobs
+    self.numberOfThreads = 0
+    # background jobs run with lower priority and may be restricted to a subset of CPU cores
+    self.background = False
+    # number of jobs that are expected to run at the same time as this job (used for splitting the available cores)
+    self.expectedConcurrency = 1
+    # run elastix even if the result is found in the result cache
+    self.bypassResultCache = False
+    # converts process output to progress events (see ElastixLib.progress.ElastixOutputParser)
+    self.outputParser = None
+    # processes that use more resident memory than this are killed and the job fails, 0 = no limit
+    self.memoryLimitBytes = 0
+    # resource usage of each completed process (see ProcessResourceMonitor.getStatistics), most recent last
+    self.processStatistics = []
+    # BatchRegistration that starts this job, None if the job is started by calling start()
+    self.batch = None
+    self.startTime = None
+    self.endTime = None
+    self._logCallback = logCallback
+    self._createSteps = createSteps
+    self._steps = None
+    self._process = None
+    self._reader = None
+    self._processOutput = []
+    self._monitor = None
+    self._abortError = None
+    self._timer = None
+    self._polling = False
+    self._completionCallbacks = []
+    self._progressCallbacks = []
+    self._eventCallbacks = []
+
+  def addCompletionCallback(self, callback):
+    """callback(job) is called when the job is completed, failed, or cancelled."""
+    self._completionCallbacks.append(callback)
+    if self.isDone():
+      callback(self)
+
+  def addProgressCallback(self, callback):
+    """callback(job, message) is called for each log message and each line of process output."""
+    self._progressCallbacks.append(callback)
+
+  def addEventCallback(self, callback):
+    """callback(job, event) is called with structured progress events parsed from the process output.
+
+    To keep the overhead low, of consecutive iteration events only the most recent one is reported
+    in each polling interval.
+    """
+    self._eventCallbacks.append(callback)
+
+  def getProgress(self):
+    if self.state == self.COMPLETED:
+      return 1.0
+    return self.outputParser.getProgress() if self.outputParser else 0.0
+
+  def getRemainingTime(self):
+    """Estimated remaining time of the registration in seconds, None if it is not known."""
+    if self.outputParser is None or not self.isRunning():
+      return None
+    return self.outputParser.getRemainingTime(self.getElapsedTime())
+
+  def isRunning(self):
+    return self.state == self.RUNNING
+
+  def isDone(self):
+    return self.state in [self.COMPLETED, self.FAILED, self.CANCELLED]
+
+  def getElapsedTime(self):
+    if self.startTime is None:
+      return 0.0
+    return (self.endTime if self.endTime is not None else time.time()) - self.startTime
+
+  def addLog(self, text):
+    if self._logCallback:
+      self._logCallback(text)
+    self._notifyProgress(text)
+
+  def _notifyProgress(self, message):
+    for callback in self._progressCallbacks:
+      callback(self, message)
+
+  def start(self):
+    if self.state != self.QUEUED:
+      raise RuntimeError(f"Registration job '{self.name}' has already been started")
+    self.state = self.RUNNING
+    self.startTime = time.time()
+    self._steps = self._createSteps(self)
+    self._timer = qt.QTimer()
+    self._timer.setInterval(self.POLL_INTERVAL_MSEC)
+    self._timer.timeout.connect(self._poll)
+    self._timer.start()
+    self._resume(lambda: next(self._steps))
+
+  def cancel(self):
+    if self.isDone():
+      return
+    self.cancelRequested = True
+    if self._process is not None:
+      killProcessTree(self._process)
+    elif self.state == self.QUEUED:
+      self._finish(self.CANCELLED)
+    # otherwise the registration steps are being executed right now, the next process is killed as soon as it starts
+
+  def wait(self):
+    """Block until the job is done (while keeping the application responsive) and re-raise any error."""
+    if self.state == self.QUEUED and (self.batch is None or self.batch.startTime is None):
+      # nothing would ever start the job
+      raise RuntimeError(f"Registration job '{self.name}' has not been started")
+    while not self.isDone():
+      self._poll()
+      if not self.isDone():
+        slicer.app.processEvents()
+        time.sleep(0.01)
+    if self.state == self.FAILED:
+      raise self.error
+
+  def _poll(self):
+    if self._polling or self._reader is None:
+      return
+    self._polling = True
+    try:
+      self._processOutputLines(self._reader.getLines())
+      if self._monitor.sample():
+        self._checkMemoryLimit()
+      if self._reader.is_alive() or self._process.poll() is None:
+        return
+      self._processOutputLines(self._reader.getLines())
+      process = self._process
+      self._process = None
+      self._reader = None
+      returnCode = process.wait()
+      self._addProcessStatistics(process)
+      if self._abortError is not None:
+        self._finish(self.FAILED, self._abortError)
+      elif self.cancelRequested:
+        self._finish(self.CANCELLED)
+      elif returnCode:
+        if self._processOutput:
+          self.addLog('\n'.join(self._processOutput))
+        error = subprocess.CalledProcessError(returnCode, os.path.basename(process.args[0]))
+        self._resume(lambda: self._steps.throw(error))
+      else:
+        self._resume(lambda: next(self._steps))
+    finally:
+      self._polling = False
+
+  def _checkMemoryLimit(self):
+    if not self.memoryLimitBytes or self._abortError is not None:
+      return
+    if self._monitor.residentMemoryBytes <= self.memoryLimitBytes:
+      return
+    processName = os.path.basename(self._process.args[0])
+    self._abortError = MemoryError(
+      f"{processName} used {self._monitor.residentMemoryBytes / 1024 / 1024:.0f} MB memory, "
+      f"more than the limit of {self.memoryLimitBytes / 1024 / 1024:.0f} MB")
+    self.addLog(f"Registration job '{self.name}' is stopped: {self._abortError}")
+    killProcessTree(self._process)
+
+  def _addProcessStatistics(self, process):
+    statistics = self._monitor.getStatistics()
+    self._monitor = None
+    if not statistics:
+      return
+    statistics["process"] = os.path.basename(process.args[0])
+    self.processStatistics.append(statistics)
+    self.addLog(f"{statistics['process']} resource usage: {ProcessResourceMonitor.getSummaryOfStatistics(statistics)}")
+
+  def getLastProcessStatistics(self):
+    return self.processStatistics[-1] if self.processStatistics else {}
+
+  def _processOutputLines(self, lines):
+    pendingIterationEvent = None
+    for line in lines:
+      if self.logStandardOutput:
+        self.addLog(line)
+      else:
+        self._processOutput.append(line)
+        self._notifyProgress(line)
+      if self.outputParser is None:
+        continue
+      event = self.outputParser.parseLine(line)
+      if event is None:
+        continue
+      if event["type"] == "iteration":
+        pendingIterationEvent = event
+        continue
+      if pendingIterationEvent is not None:
+        self._notifyEvent(pendingIterationEvent)
+        pendingIterationEvent = None
+      self._notifyEvent(event)
+    if pendingIterationEvent is not None:
+      self._notifyEvent(pendingIterationEvent)
+
+  def _notifyEvent(self, event):
+    for callback in self._eventCallbacks:
+      callback(self, event)
+
+  def _resume(self, step):
+    try:
+      process = step()
+    except StopIteration:
+      self._finish(self.COMPLETED)
+      return
+    except Exception as e:
+      self._finish(self.FAILED, e)
+      return
+    self._process = process
+    self._processOutput = []
+    self._monitor = ProcessResourceMonitor(process.pid)
+    self._reader = ProcessOutputReader(process)
+    self._reader.start()
+    if self.cancelRequested:
+      killProcessTree(process)
+
+  def _finish(self, state, error=None):
+    if self._timer is not None:
+      self._timer.stop()
+      self._timer = None
+    if self._steps is not None:
+      # run clean-up code (finally blocks) of the registration steps
+      try:
+        self._steps.close()
+      except Exception as e:
+        logging.error(f"Failed to clean up after registration job '{self.name}': {e}")
+      self._steps = None
+    self.state = state
+    self.error = error
+    self.endTime = time.time()
+    if state == self.CANCELLED:
+      self.addLog("User requested cancel.")
+    elif state == self.FAILED:
+      logging.error(f"Registration job '{self.name}' failed: {error}")
+    for callback in self._completionCallbacks:
+      callback(self)
+
+
+class BatchRegistration:
+  """Runs a list of registration jobs, with at most maximumNumberOfWorkers of them running at the same time.
+
+  Failure of a job does not stop the batch, check the state of each job in jobs.
+  """
+
+  def __init__(self, jobs, maximumNumberOfWorkers, logCallback=None, cleanup=None):
+    self.jobs = jobs
+    self.maximumNumberOfWorkers = max(1, maximumNumberOfWorkers)
+    self.startTime = None
+    self.endTime = None
+    self._logCallback = logCallback
+    self._cleanup = cleanup
+    self._queuedJobs = list(jobs)
+    for job in jobs:
+      job.expectedConcurrency = min(self.maximumNumberOfWorkers, len(jobs))
+      job.batch = self
+    self._completionCallbacks = []
+    self._jobCompletionCallbacks = []
+    for job in jobs:
+      job.addCompletionCallback(self._onJobFinished)
+
+  def addCompletionCallback(self, callback):
+    """callback(batch) is called when all jobs are done."""
+    self._completionCallbacks.append(callback)
+
+  def addJobCompletionCallback(self, callback):
+    """callback(batch, job) is called each time a job is done, results of the job are already in the scene."""
+    self._jobCompletionCallbacks.append(callback)
+
+  def addLog(self, text):
+    if self._logCallback:
+      self._logCallback(text)
+
+  def isDone(self):
+    return self.endTime is not None
+
+  def getRunningJobs(self):
+    return [job for job in self.jobs if job.isRunning()]
+
+  def getCompletedJobs(self):
+    return [job for job in self.jobs if job.state == job.COMPLETED]
+
+  def getElapsedTime(self):
+    if self.startTime is None:
+      return 0.0
+    return (self.endTime if self.endTime is not None else time.time()) - self.startTime
+
+  def getThroughput(self):
+    """Number of successfully registered pairs per hour"""
+    elapsedTime = self.getElapsedTime()
+    return len(self.getCompletedJobs()) * 3600.0 / elapsedTime if elapsedTime > 0 else 0.0
+
+  def start(self):
+    self.startTime = time.time()
+    self.addLog(f"Batch registration of {len(self.jobs)} volumes is started using {self.maximumNumberOfWorkers} workers")
+    self._startQueuedJobs()
+    if not self.jobs:
+      self._finish()
+
+  def cancel(self):
+    for job in list(self.jobs):
+      job.cancel()
+
+  def wait(self):
+    """Block until all jobs are done (while keeping the application responsive)."""
+    while not self.isDone():
+      for job in self.getRunningJobs():
+        job._poll()
+      if not self.isDone():
+        slicer.app.processEvents()
+        time.sleep(0.01)
+
+  def _startQueuedJobs(self):
+    while self._queuedJobs and len(self.getRunningJobs()) < self.maximumNumberOfWorkers:
+      job = self._queuedJobs.pop(0)
+      if job.state == job.QUEUED:
+        job.start()
+
+  def _onJobFinished(self, job):
+    if job in self._queuedJobs:
+      # cancelled before it was started
+      self._queuedJobs.remove(job)
+    for callback in self._jobCompletionCallbacks:
+      callback(self, job)
+    if self.startTime is None or self.isDone():
+      return
+    self._startQueuedJobs()
+    if all(job.isDone() for job in self.jobs):
+      self._finish()
+
+  def _finish(self):
+    if self.isDone():
+      return
+    self.endTime = time.time()
+    if self._cleanup:
+      try:
+        self._cleanup()
+      except Exception as e:
+        logging.error(f"Failed to clean up after batch registration: {e}")
+    failedJobs = [job for job in self.jobs if job.state == job.FAILED]
+    self.addLog(f"Batch registration is completed: {len(self.getCompletedJobs())} of {len(self.jobs)} volumes registered"
+                f" ({len(failedJobs)} failed) in {self.getElapsedTime():.1f} s, "
+                f"throughput: {self.getThroughput():.1f} pairs/hour")
+    for callback in self._completionCallbacks:
+      callback(self)
@@ -45,6 +45,14 @@ class PresetManagerLogic:
 
     self._databases = [self.builtinDatabase, self.userDatabase, self.inSceneDatabase]
 
+    # database -> generation of the database that the lookup index was created from
+    self._indexedDatabaseGenerations = {}
+    # database -> {preset ID: index of the first preset with that ID in the preset list of the database}
+    self._presetIndicesByDatabase = {}
+    # database -> index of the first preset of the database in registrationPresets
+    self._databaseOffsets = {}
+    self._reportedPresetIdCollisions = set()
+
   def getBuiltinPresetsDir(self):
     return self.builtinDatabase.getPresetsDir()
 
@@ -52,25 +60,77 @@ class PresetManagerLogic:
     return self.userDatabase.getPresetsDir()
 
   def getRegistrationPresets(self, force_refresh=False):
-    if self.registrationPresets and not force_refresh:
+    if self.registrationPresets is not None and not force_refresh:
+      return self.registrationPresets
+
+    changedDatabases = []
+    for database in self._databases:
+      database.getRegistrationPresets(force_refresh)
+      if self._indexedDatabaseGenerations.get(database) != database.generation:
+        changedDatabases.append(database)
+    if self.registrationPresets is not None and not changedDatabases:
       return self.registrationPresets
 
+    # only the lookup index of changed databases is recreated
+    for database in changedDatabases:
+      self._indexPresetsOfDatabase(database)
     self.registrationPresets = []
     for database in self._databases:
-      self.registrationPresets.extend(database.getRegistrationPresets(force_refresh))
+      self._databaseOffsets[database] = len(self.registrationPresets)
+      self.registrationPresets.extend(database.registrationPresets)
+    self._reportPresetIdCollisions()
 
     return self.registrationPresets
 
-  def getPresetByID(self, presetId) -> Preset:
-    for preset in self.getRegistrationPresets():
+  def _indexPresetsOfDatabase(self, database):
+    presetIndices = {}
+    for presetIndex, preset in enumerate(database.registrationPresets):
+      presetIndices.setdefault(preset.getID(), presetIndex)
+    self._presetIndicesByDatabase[database] = presetIndices
+    self._indexedDatabaseGenerations[database] = database.generation
+
+  def _reportPresetIdCollisions(self):
+    presetIdDatabaseNames = {}
+    for database in self._databases:
+      for preset in database.registrationPresets:
+        presetIdDatabaseNames.setdefault(preset.getID(), []).append(database.NAME)
+    for presetId, databaseNames in presetIdDatabaseNames.items():
+      if len(databaseNames) < 2 or (presetId, tuple(databaseNames)) in self._reportedPresetIdCollisions:
+        continue
+      self._reportedPresetIdCollisions.add((presetId, tuple(databaseNames)))
+      message = (f"Registration preset id '{presetId}' is used by {len(databaseNames)} presets "
+                 f"({', '.join(databaseNames)} database), only the first one ({databaseNames[0]}) can be selected.")
+      logging.warning(message)
+      if self.logCallback:
+        self.logCallback(message)
+
+  def _findPreset(self, presetId):
+    """Returns (index, preset) of the first preset with presetId in the preset list, (None, None) if not found."""
+    registrationPresets = self.getRegistrationPresets()
+    for database in self._databases:
+      presetIndex = self._presetIndicesByDatabase[database].get(presetId)
+      if presetIndex is None:
+        continue
+      presetIndex += self._databaseOffsets[database]
+      if registrationPresets[presetIndex].getID() == presetId:
+        return presetIndex, registrationPresets[presetIndex]
+      break
+    # IDs of in-scene presets can be edited, recreate the index if it is outdated
+    for presetIndex, preset in enumerate(registrationPresets):
       if preset.getID() == presetId:
-        return preset
-    return None
+        for database in self._databases:
+          self._indexPresetsOfDatabase(database)
+        return presetIndex, preset
+    return None, None
+
+  def getPresetByID(self, presetId) -> Preset:
+    presetIndex, preset = self._findPreset(presetId)
+    return preset
 
   def getIdxByPresetId(self, presetId):
-    for presetIndex, preset in enumerate(self.getRegistrationPresets()):
-      if preset.getID() == presetId:
-        return presetIndex
+    presetIndex, preset = self._findPreset(presetId)
+    if presetIndex is not None:
+      return presetIndex
     message = f"Registration preset with id '{presetId}' could not be found.  Falling back to default preset."
     logging.warning(message)
     return 0
@@ -89,7 +149,7 @@ class PresetManagerLogic:
     if not isWritable(preset):
       raise TypeError(f"Only presets of type {InScenePreset.__class__.__name__} can be persisted to the UserDatabase")
 
-    files = preset.getParameterFiles()
+    files = preset.createParameterFiles()
     tempPreset = copyPreset(preset)
     if len(files) > 0:
       try:
@@ -112,6 +172,8 @@ class PresetManagerLogic:
         attributes = tempPreset.getMetaInformation(
           [ID_KEY, MODALITY_KEY, CONTENT_KEY, PUBLICATIONS_KEY, DESCRIPTION_KEY]
         )
+        if tempPreset.getMaximumWorkingSpacing():
+          attributes["maximumWorkingSpacing"] = str(tempPreset.getMaximumWorkingSpacing())
         presetElement = ET.SubElement(root, "ParameterSet", attributes)
         parFilesElement = ET.SubElement(presetElement, "ParameterFiles")
 
@@ -120,15 +182,16 @@ class PresetManagerLogic:
           filename = os.path.basename(file)
           newFilePath = os.path.join(outputFolder, filename)
 
-          from shutil import move
-          move(file, newFilePath)
+          copyfile(file, newFilePath)
           ET.SubElement(parFilesElement, "File", {"Name": filename})
 
         xml.write(presetXml)
+        self.userDatabase.invalidate()
 
         return presetID
       finally:
         tempPreset.delete()
+        releaseParameterFiles(files)
 
   def deletePreset(self, preset):
     if not canDelete(preset):
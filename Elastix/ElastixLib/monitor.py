@@ -0,0 +1,97 @@
+import os
+
+
+class ProcessResourceMonitor:
+  """Samples resource usage of a running process from /proc/<pid> (Linux).
+
+  Memory and thread count are sampled, therefore short peaks between samples may be missed, except
+  the peak resident memory, which is maintained by the kernel (VmHWM). CPU times and I/O byte counts
+  are cumulative. The last successfully read values are kept after the process has exited.
+  On platforms without /proc the monitor does not report anything.
+  """
+
+  def __init__(self, pid):
+    self.pid = pid
+    self.procDir = f"/proc/{pid}"
+    self.available = os.path.isdir(self.procDir)
+    self.numberOfSamples = 0
+    self.residentMemoryBytes = 0
+    self.peakResidentMemoryBytes = 0
+    self.maximumNumberOfThreads = 0
+    self.userCpuTime = 0.0
+    self.systemCpuTime = 0.0
+    self.readBytes = 0
+    self.writeBytes = 0
+    self._clockTicksPerSecond = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+  def sample(self):
+    """Update statistics from the current state of the process. Returns False if the process cannot be sampled."""
+    if not self.available:
+      return False
+    try:
+      self._readStatus()
+      self._readStat()
+    except (OSError, ValueError, IndexError):
+      # process has exited
+      return False
+    try:
+      self._readIo()
+    except (OSError, ValueError):
+      # I/O statistics are not accessible on all systems
+      pass
+    self.numberOfSamples += 1
+    return True
+
+  def _readStatus(self):
+    with open(os.path.join(self.procDir, "status"), "r") as file:
+      for line in file:
+        if line.startswith("VmRSS:"):
+          self.residentMemoryBytes = int(line.split()[1]) * 1024
+          self.peakResidentMemoryBytes = max(self.peakResidentMemoryBytes, self.residentMemoryBytes)
+        elif line.startswith("VmHWM:"):
+          self.peakResidentMemoryBytes = max(self.peakResidentMemoryBytes, int(line.split()[1]) * 1024)
+        elif line.startswith("Threads:"):
+          self.maximumNumberOfThreads = max(self.maximumNumberOfThreads, int(line.split()[1]))
+
+  def _readStat(self):
+    with open(os.path.join(self.procDir, "stat"), "r") as file:
+      stat = file.read()
+    # process name may contain spaces, fields are counted from the closing parenthesis after the name
+    fields = stat[stat.rindex(")") + 2:].split()
+    # utime and stime are the 14th and 15th fields of the stat file
+    self.userCpuTime = int(fields[11]) / self._clockTicksPerSecond
+    self.systemCpuTime = int(fields[12]) / self._clockTicksPerSecond
+
+  def _readIo(self):
+    with open(os.path.join(self.procDir, "io"), "r") as file:
+      for line in file:
+        name, value = line.split(":")
+        if name == "read_bytes":
+          self.readBytes = int(value)
+        elif name == "write_bytes":
+          self.writeBytes = int(value)
+
+  def getStatistics(self):
+    """Returns dict of the collected statistics, empty if the process could not be sampled."""
+    if not self.numberOfSamples:
+      return {}
+    return {
+      "peakResidentMemoryBytes": self.peakResidentMemoryBytes,
+      "userCpuTime": self.userCpuTime,
+      "systemCpuTime": self.systemCpuTime,
+      "maximumNumberOfThreads": self.maximumNumberOfThreads,
+      "readBytes": self.readBytes,
+      "writeBytes": self.writeBytes
+    }
+
+  def getSummary(self):
+    return self.getSummaryOfStatistics(self.getStatistics())
+
+  @staticmethod
+  def getSummaryOfStatistics(statistics):
+    if not statistics:
+      return ""
+    return (f"peak memory {statistics['peakResidentMemoryBytes'] / 1024 / 1024:.0f} MB, "
+            f"CPU time {statistics['userCpuTime']:.1f} s user + {statistics['systemCpuTime']:.1f} s system, "
+            f"{statistics['maximumNumberOfThreads']} threads, "
+            f"read {statistics['readBytes'] / 1024 / 1024:.1f} MB, written {statistics['writeBytes'] / 1024 / 1024:.1f} MB")
@@ -0,0 +1,177 @@
+import collections
+import functools
+import re
+
+# one "(Key value1 value2 ...)" entry, values may be quoted strings that contain spaces or parentheses
+_ENTRY_PATTERN = re.compile(r'\(\s*(\w+)((?:\s+(?:"[^"]*"|[^\s()"]+))*)\s*\)')
+_VALUE_PATTERN = re.compile(r'"([^"]*)"|([^\s"]+)')
+_COMMENT_PATTERN = re.compile(r'("[^"]*")|//[^\n]*')
+
+# elastix pixel type name -> numpy dtype (names are the same as VTK scalar type names)
+PIXEL_TYPES = {
+  "char": "int8",
+  "unsigned char": "uint8",
+  "short": "int16",
+  "unsigned short": "uint16",
+  "int": "int32",
+  "unsigned int": "uint32",
+  "float": "float32",
+  "double": "float64"
+}
+
+
+def _stripComments(text):
+  # keep "//" that is inside quoted values (e.g., in paths)
+  return _COMMENT_PATTERN.sub(lambda match: match.group(1) or "", text)
+
+
+def _convertValue(token):
+  try:
+    return int(token)
+  except ValueError:
+    pass
+  try:
+    return float(token)
+  except ValueError:
+    return token
+
+
+def parseParameterText(text):
+  """Parse elastix/transformix parameter file content.
+
+  :return: ordered dict of key -> list of values. Quoted values are returned as strings,
+    unquoted values as int or float if they can be converted.
+  """
+  parameters = collections.OrderedDict()
+  for match in _ENTRY_PATTERN.finditer(_stripComments(text)):
+    values = []
+    for quoted, unquoted in _VALUE_PATTERN.findall(match.group(2)):
+      values.append(quoted if unquoted == "" else _convertValue(unquoted))
+    parameters[match.group(1)] = values
+  return parameters
+
+
+def readParameterFile(path):
+  with open(path, 'r') as file:
+    return parseParameterText(file.read())
+
+
+def getParameterValue(parameters, key, default=None, index=0):
+  values = parameters.get(key)
+  if not values or len(values) <= index:
+    return default
+  return values[index]
+
+
+def formatParameterValue(value):
+  if isinstance(value, bool):
+    # elastix expects booleans as quoted strings
+    return '"true"' if value else '"false"'
+  if isinstance(value, str):
+    return f'"{value}"'
+  if isinstance(value, float):
+    return repr(value)
+  return str(value)
+
+
+def setParameterValuesInText(text, key, values):
+  """Returns parameter file text with the values of key replaced (the entry is appended if it is not found).
+
+  Only active entries are replaced, commented-out entries (e.g., "//(Key value)") are left unchanged.
+  """
+  entry = f"({key} {' '.join(formatParameterValue(value) for value in values)})"
+  # anchored to the start of the line so that entries after "//" are not matched
+  pattern = re.compile(r'^([ \t]*)\(\s*' + re.escape(key) + r'((?:\s+(?:"[^"]*"|[^\s()"]+))*)\s*\)', re.MULTILINE)
+  text, numberOfReplacements = pattern.subn(lambda match: match.group(1) + entry, text)
+  if numberOfReplacements == 0:
+    text = text.rstrip("\n") + "\n" + entry + "\n"
+  return text
+
+
+def applyParameterOverrides(text, overrides):
+  """Returns parameter file text with values replaced (or added) by overrides.
+
+  :param overrides: dict of key -> value or list of values
+  """
+  for key, values in overrides.items():
+    text = setParameterValuesInText(text, key, values if isinstance(values, (list, tuple)) else [values])
+  return text
+
+
+def getStageOverrides(parameterOverrides, stageIndex):
+  """Returns overrides of a registration stage.
+
+  :param parameterOverrides: None, a dict that is applied to all stages, or a list with a dict (or None) for each stage
+  """
+  if not parameterOverrides:
+    return {}
+  if isinstance(parameterOverrides, dict):
+    return parameterOverrides
+  if stageIndex >= len(parameterOverrides):
+    return {}
+  return parameterOverrides[stageIndex] or {}
+
+
+@functools.lru_cache(maxsize=256)
+def _parseParameterTextCached(text):
+  # values are stored in tuples so that the cached result cannot be modified
+  return tuple((key, tuple(values)) for key, values in parseParameterText(text).items())
+
+
+class ParameterMap:
+  """Typed parameters of an elastix parameter file (one registration stage): key -> list of values.
+
+  Parsing is cached by text content, therefore creating maps of the same preset section repeatedly is cheap.
+  """
+
+  def __init__(self, parameters=None):
+    self._parameters = collections.OrderedDict()
+    if parameters:
+      for key, values in parameters.items():
+        self.setValues(key, values)
+
+  @classmethod
+  def fromText(cls, text):
+    parameterMap = cls()
+    for key, values in _parseParameterTextCached(text):
+      parameterMap._parameters[key] = list(values)
+    return parameterMap
+
+  @classmethod
+  def fromFile(cls, path):
+    with open(path, 'r') as file:
+      return cls.fromText(file.read())
+
+  def keys(self):
+    return self._parameters.keys()
+
+  def __contains__(self, key):
+    return key in self._parameters
+
+  def __len__(self):
+    return len(self._parameters)
+
+  def getValues(self, key, default=None):
+    values = self._parameters.get(key)
+    return list(values) if values is not None else default
+
+  def getValue(self, key, default=None, index=0):
+    return getParameterValue(self._parameters, key, default, index)
+
+  def setValues(self, key, values):
+    """Set values of a parameter, a single value may be specified instead of a list."""
+    self._parameters[key] = list(values) if isinstance(values, (list, tuple)) else [values]
+
+  def removeValues(self, key):
+    self._parameters.pop(key, None)
+
+  def update(self, overrides):
+    for key, values in overrides.items():
+      self.setValues(key, values)
+
+  def copy(self):
+    return ParameterMap(self._parameters)
+
+  def toText(self):
+    return "".join(f"({key} {' '.join(formatParameterValue(value) for value in values)})\n"
+                   for key, values in self._parameters.items())
@@ -1,8 +1,12 @@
 import os
 import json
+import collections
+import hashlib
+import uuid
 from pathlib import Path
 
-from ElastixLib.utils import createTempDirectory
+from ElastixLib.utils import createDirectory, createTempDirectory, getTempDirectoryBase, markDirectoryOwner, \
+  isDirectoryOwnerRunning
 
 import slicer
 from typing import List, Union, Dict
@@ -17,6 +21,136 @@ CONTENT_KEY = "content"
 PUBLICATIONS_KEY = "publications"
 PARAMETER_FILES_KEY = "parameter_files"
 NAME_KEY = "name"
+MAXIMUM_WORKING_SPACING_KEY = "maximum_working_spacing"
+
+PARAMETER_FILES_DIRECTORY_NAME = "ParameterFiles"
+# folders of processes that have exited are only removed after this time, as the owner of a
+# new folder is marked right after the folder is created
+STALE_PARAMETER_FILES_DIRECTORY_AGE_SEC = 60
+
+# parameter file path -> number of users (presets callers and registration jobs)
+_parameterFileReferenceCounts = collections.Counter()
+_parameterFilesDirectory = None
+# files that are not deleted when they are released, as they were returned by Preset.getParameterFiles
+_persistentParameterFiles = set()
+
+
+def getParameterFilesDirectory():
+  """Returns the folder of parameter files written by this process.
+
+  Reference counts are only known within a process, therefore each process uses its own folder. This ensures that
+  releasing a file never deletes a file that is used by elastix started from another Slicer instance.
+  Folders of processes that are not running anymore are removed.
+  """
+  global _parameterFilesDirectory
+  if _parameterFilesDirectory is not None and os.path.isdir(_parameterFilesDirectory):
+    return _parameterFilesDirectory
+  import shutil
+  import time
+  parameterFilesBase = createDirectory(os.path.join(getTempDirectoryBase(), PARAMETER_FILES_DIRECTORY_NAME))
+  for entry in os.scandir(parameterFilesBase):
+    if not entry.is_dir() or isDirectoryOwnerRunning(entry.path):
+      continue
+    if time.time() - entry.stat().st_mtime < STALE_PARAMETER_FILES_DIRECTORY_AGE_SEC:
+      continue
+    shutil.rmtree(entry.path, ignore_errors=True)
+  _parameterFilesDirectory = createTempDirectory(parameterFilesBase)
+  markDirectoryOwner(_parameterFilesDirectory)
+  return _parameterFilesDirectory
+
+
+def writeParameterFile(name, content) -> str:
+  """Returns path of a parameter file with the given name and content, and adds a reference to it.
+
+  Files are content-addressed: the same content is written only once and it is shared by all callers
+  in this process (see getParameterFilesDirectory).
+  Call releaseParameterFiles when the file is not needed anymore.
+  """
+  if not name.endswith('.txt'):
+    name += '.txt'
+  digest = hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+  directory = createDirectory(os.path.join(getParameterFilesDirectory(), digest))
+  filePath = os.path.join(directory, name)
+  if not os.path.isfile(filePath):
+    # write to a temporary file and rename it so that other users never see a partially written file
+    partialFilePath = f"{filePath}.{uuid.uuid4().hex}.partial"
+    with open(partialFilePath, 'w') as file:
+      file.write(content)
+    os.replace(partialFilePath, filePath)
+  _parameterFileReferenceCounts[filePath] += 1
+  return filePath
+
+
+def acquireParameterFiles(filePaths):
+  """Add a reference to parameter files that were created by writeParameterFile (other files are ignored)."""
+  for filePath in filePaths:
+    if filePath in _parameterFileReferenceCounts:
+      _parameterFileReferenceCounts[filePath] += 1
+
+
+def createParameterFilesWithOverrides(filePaths, parameterOverrides):
+  """Returns paths of parameter files that are the same as filePaths but with parameter values overridden.
+
+  The original files are not changed. Created files are shared like the ones of writeParameterFile,
+  call releaseParameterFiles when they are not needed anymore.
+
+  :param parameterOverrides: dict of parameter name -> value(s) that is applied to all stages,
+    or list of such dicts (or None) for each stage
+  """
+  from ElastixLib.parameters import applyParameterOverrides, getStageOverrides
+  overriddenFilePaths = []
+  for stageIndex, filePath in enumerate(filePaths):
+    with open(filePath, 'r') as file:
+      content = applyParameterOverrides(file.read(), getStageOverrides(parameterOverrides, stageIndex))
+    overriddenFilePaths.append(writeParameterFile(os.path.basename(filePath), content))
+  return overriddenFilePaths
+
+
+def releaseParameterFiles(filePaths):
+  """Remove a reference to parameter files, files without references are deleted (other files are ignored)."""
+  for filePath in filePaths:
+    if filePath not in _parameterFileReferenceCounts:
+      continue
+    _parameterFileReferenceCounts[filePath] -= 1
+    if _parameterFileReferenceCounts[filePath] > 0:
+      continue
+    del _parameterFileReferenceCounts[filePath]
+    if filePath in _persistentParameterFiles:
+      continue
+    try:
+      os.remove(filePath)
+      os.rmdir(os.path.dirname(filePath))
+    except OSError:
+      # directory is still used by files with the same content but different name
+      pass
+
+
+class LazyParameterSection(dict):
+  """Parameter section (dict of name and content) that reads its content from file on first access.
+
+  Presets of databases contain many parameter files, therefore only their names are read when
+  the presets are loaded. The content is cached after it is read.
+  """
+
+  def __init__(self, filePath):
+    super().__init__({NAME_KEY: Path(filePath).name})
+    self.filePath = filePath
+
+  def isLoaded(self):
+    return dict.__contains__(self, CONTENT_KEY)
+
+  def __missing__(self, key):
+    if key != CONTENT_KEY:
+      raise KeyError(key)
+    with open(self.filePath, 'r') as file:
+      self[CONTENT_KEY] = file.read()
+    return self[CONTENT_KEY]
+
+  def __contains__(self, key):
+    return key == CONTENT_KEY or super().__contains__(key)
+
+  def get(self, key, default=None):
+    return self[key] if key in self else default
 
 
 class Preset:
@@ -57,25 +191,43 @@ class Preset:
   def setPublications(self, value: str):
     self._data[PUBLICATIONS_KEY] = value
 
+  def getMaximumWorkingSpacing(self) -> float:
+    """Input volumes are downsampled to this voxel size (mm) before registration, 0 = use full resolution"""
+    return float(self._getDictAttribute(MAXIMUM_WORKING_SPACING_KEY, 0.0))
+
+  def setMaximumWorkingSpacing(self, value: float):
+    self._data[MAXIMUM_WORKING_SPACING_KEY] = value
+
   def setParameters(self, values: List[Dict[str, str]]):
     self._data[PARAMETER_FILES_KEY] = values
 
   def getParameterFiles(self):
-    tempDir = createTempDirectory()
-    filenames = []
-    for param in self.getParameters():
-      name = param[NAME_KEY]
-      if not name.endswith('.txt'):
-        name += '.txt'
-      filename = os.path.join(tempDir, name)
-      with open(filename, 'w') as file:
-        file.write(param[CONTENT_KEY])
-      filenames.append(filename)
-    return filenames
+    """Returns paths of parameter files that contain the parameter sections.
+
+    The files are kept until the application exits, they do not have to be released.
+    Use createParameterFiles to get files that are deleted when they are not used anymore.
+    """
+    filePaths = self.createParameterFiles()
+    _persistentParameterFiles.update(filePaths)
+    releaseParameterFiles(filePaths)
+    return filePaths
+
+  def createParameterFiles(self):
+    """Returns paths of parameter files that contain the parameter sections.
+
+    Files are shared between all presets and registrations that use the same content,
+    call releaseParameterFiles(filenames) when they are not needed anymore.
+    """
+    return [writeParameterFile(param[NAME_KEY], param[CONTENT_KEY]) for param in self.getParameters()]
 
   def getParameters(self):
     return self._getDictAttribute(PARAMETER_FILES_KEY, [])
 
+  def getParameterMaps(self):
+    """Returns typed parameters (ParameterMap) of each parameter section. Parsing is cached by section content."""
+    from ElastixLib.parameters import ParameterMap
+    return [ParameterMap.fromText(param[CONTENT_KEY]) for param in self.getParameters()]
+
   def getParameterSectionNames(self) -> List:
     return [pf[NAME_KEY] for pf in self._data[PARAMETER_FILES_KEY]]
 
@@ -131,6 +283,9 @@ class Preset:
       return self._data[key]
 
   def toJSON(self):
+    # content of lazy parameter sections is only stored in the dict after it is read
+    for param in self.getParameters():
+      param[CONTENT_KEY]
     return json.dumps(self._data, indent=2)
 
 
@@ -208,6 +363,10 @@ class InScenePreset(Preset):
     super().setPublications(value)
     self._updateTextNode()
 
+  def setMaximumWorkingSpacing(self, value: float):
+    super().setMaximumWorkingSpacing(value)
+    self._updateTextNode()
+
   def setParameters(self, values: List[Dict[str, str]]):
     super().setParameters(values)
     self._updateTextNode()
@@ -244,7 +403,8 @@ def getInScenePreset(presetNode: slicer.vtkMRMLTextNode):
   return preset
 
 
-def createPreset(id:str, modality:str, content:str, description:str, publications:str, parameterFiles: List[str] = None, presetClass=Preset):
+def createPreset(id:str, modality:str, content:str, description:str, publications:str, parameterFiles: List[str] = None, presetClass=Preset,
+                 maximumWorkingSpacing: float = 0.0):
   if parameterFiles is None:
     parameterFiles = []
 
@@ -254,14 +414,14 @@ def createPreset(id:str, modality:str, content:str, description:str, publication
   preset.setContent(content)
   preset.setDescription(description)
   preset.setPublications(publications)
+  if maximumWorkingSpacing:
+    preset.setMaximumWorkingSpacing(maximumWorkingSpacing)
 
+  # parameter file content is read when it is first needed, only check that the files exist
   for f in parameterFiles:
-    with open(f, 'r') as file:
-      file_content = file.read()
-      preset.addParameterSection(
-        Path(f).name,
-        file_content
-      )
+    if not os.path.isfile(f):
+      raise FileNotFoundError(f"Parameter file not found: {f}")
+  preset.setParameters([LazyParameterSection(f) for f in parameterFiles])
 
   return preset
 
@@ -278,9 +438,11 @@ def copyPreset(preset: Preset) -> InScenePreset:
   presetCopy.setContent(preset.getContent())
   presetCopy.setDescription(preset.getDescription())
   presetCopy.setPublications(preset.getPublications())
+  if preset.getMaximumWorkingSpacing():
+    presetCopy.setMaximumWorkingSpacing(preset.getMaximumWorkingSpacing())
 
-  import copy
-  presetCopy.setParameters(copy.deepcopy(preset.getParameters()))
+  presetCopy.setParameters([{NAME_KEY: param[NAME_KEY], CONTENT_KEY: param[CONTENT_KEY]}
+                            for param in preset.getParameters()])
   return presetCopy
 
 
@@ -0,0 +1,164 @@
+import re
+
+from ElastixLib.parameters import readParameterFile, getParameterValue
+
+# event types
+STAGE_STARTED = "stageStarted"
+RESOLUTION_STARTED = "resolutionStarted"
+ITERATION = "iteration"
+RESOLUTION_COMPLETED = "resolutionCompleted"
+STOPPING_CONDITION = "stoppingCondition"
+REGISTRATION_COMPLETED = "registrationCompleted"
+OUTPUT_GENERATION = "outputGeneration"
+
+_STAGE_PATTERN = re.compile(r'^Running elastix with parameter file (\d+): "(.*)"')
+_RESOLUTION_PATTERN = re.compile(r'^Resolution:\s*(\d+)')
+_RESOLUTION_TIME_PATTERN = re.compile(r'^Time spent in resolution (\d+)[^:]*:\s*([\d.eE+-]+)')
+_STOPPING_CONDITION_PATTERN = re.compile(r'^Stopping condition:\s*(.*)')
+_TOTAL_TIME_PATTERN = re.compile(r'^Total time elapsed:\s*([\d.eE+-]+)')
+_OUTPUT_GENERATION_PATTERN = re.compile(r'^(Resampling image and writing to disk|Computing and writing the deformation field)')
+
+
+class ElastixOutputParser:
+  """Turns elastix and transformix output lines into structured progress events.
+
+  Each event is a dict that contains its "type" (see event types above) and a snapshot of the current state:
+  stage (index of the parameter file), numberOfStages, resolution, numberOfResolutions, iteration,
+  maximumNumberOfIterations, metric, stepSize, resolutionTimes (elapsed time of each completed resolution
+  in the current stage, in seconds), and progress (0.0 - 1.0).
+
+  Iteration lines are the most frequent, they are recognized with a single character check
+  before any other parsing is attempted.
+  """
+
+  def __init__(self, parameterFilenames=None):
+    # number of resolutions and maximum number of iterations in each resolution, for each stage
+    self.stageSettings = []
+    for parameterFilename in parameterFilenames or []:
+      try:
+        parameters = readParameterFile(parameterFilename)
+      except OSError:
+        parameters = {}
+      numberOfResolutions = max(1, getParameterValue(parameters, "NumberOfResolutions", 1))
+      maximumNumberOfIterations = parameters.get("MaximumNumberOfIterations") or [0]
+      self.stageSettings.append((numberOfResolutions, maximumNumberOfIterations))
+    self.stage = 0
+    self.resolution = 0
+    self.iteration = 0
+    self.metric = None
+    self.stepSize = None
+    self.resolutionTimes = []
+    self.stoppingCondition = ""
+    self.registrationCompleted = False
+    self.stageIndexOffset = 0 # index of the first stage of the parsed elastix process
+    self._columns = {}
+
+  def startStage(self, stageIndex):
+    """Prepare for parsing the output of an elastix process that only runs the stage with the given index."""
+    self.stageIndexOffset = stageIndex
+    self.stage = stageIndex
+    self.resolution = 0
+    self.iteration = 0
+    self.resolutionTimes = []
+    self.registrationCompleted = False
+
+  def getNumberOfStages(self):
+    return max(1, len(self.stageSettings))
+
+  def getNumberOfResolutions(self):
+    if self.stage < len(self.stageSettings):
+      return self.stageSettings[self.stage][0]
+    return 1
+
+  def getMaximumNumberOfIterations(self):
+    if self.stage >= len(self.stageSettings):
+      return 0
+    maximumNumberOfIterations = self.stageSettings[self.stage][1]
+    # one value for all resolutions or one value for each resolution
+    return int(maximumNumberOfIterations[min(self.resolution, len(maximumNumberOfIterations) - 1)])
+
+  def getProgress(self):
+    """Fraction of the registration that is completed, assuming that all stages and resolutions take equal time."""
+    if self.registrationCompleted:
+      return 1.0
+    maximumNumberOfIterations = self.getMaximumNumberOfIterations()
+    resolutionProgress = min(1.0, self.iteration / maximumNumberOfIterations) if maximumNumberOfIterations else 0.0
+    stageProgress = min(1.0, (self.resolution + resolutionProgress) / self.getNumberOfResolutions())
+    return min(1.0, (self.stage + stageProgress) / self.getNumberOfStages())
+
+  def getRemainingTime(self, elapsedTime):
+    """Estimated remaining time in seconds, None if it cannot be estimated yet."""
+    progress = self.getProgress()
+    if progress <= 0.01:
+      return None
+    return elapsedTime * (1.0 - progress) / progress
+
+  def parseLine(self, line):
+    """Returns an event if the line contains progress information, None otherwise."""
+    if not line:
+      return None
+    if line[0].isdigit():
+      if line.startswith("1:ItNr"):
+        # column headers, such as "1:ItNr 2:Metric 3a:Time 3b:StepSize 4:||Gradient|| Time[ms]"
+        self._columns = {name.split(":")[-1].strip(): index for index, name in enumerate(line.split("\t"))}
+        return None
+      return self._parseIterationLine(line)
+
+    match = _STAGE_PATTERN.match(line)
+    if match:
+      self.stage = self.stageIndexOffset + int(match.group(1))
+      self.resolution = 0
+      self.iteration = 0
+      self.resolutionTimes = []
+      return self._createEvent(STAGE_STARTED, parameterFilename=match.group(2))
+    match = _RESOLUTION_PATTERN.match(line)
+    if match:
+      self.resolution = int(match.group(1))
+      self.iteration = 0
+      return self._createEvent(RESOLUTION_STARTED)
+    match = _RESOLUTION_TIME_PATTERN.match(line)
+    if match:
+      self.resolutionTimes.append(float(match.group(2)))
+      self.iteration = self.getMaximumNumberOfIterations()
+      return self._createEvent(RESOLUTION_COMPLETED, resolutionTime=self.resolutionTimes[-1])
+    match = _STOPPING_CONDITION_PATTERN.match(line)
+    if match:
+      self.stoppingCondition = match.group(1)
+      return self._createEvent(STOPPING_CONDITION, stoppingCondition=self.stoppingCondition)
+    match = _TOTAL_TIME_PATTERN.match(line)
+    if match:
+      self.registrationCompleted = True
+      return self._createEvent(REGISTRATION_COMPLETED, totalTime=float(match.group(1)))
+    match = _OUTPUT_GENERATION_PATTERN.match(line)
+    if match:
+      return self._createEvent(OUTPUT_GENERATION, description=match.group(1))
+    return None
+
+  def _parseIterationLine(self, line):
+    values = line.split("\t")
+    try:
+      self.iteration = int(values[0])
+      metricIndex = self._columns.get("Metric", 1)
+      self.metric = float(values[metricIndex]) if metricIndex < len(values) else None
+      stepSizeIndex = self._columns.get("StepSize")
+      self.stepSize = float(values[stepSizeIndex]) if stepSizeIndex is not None and stepSizeIndex < len(values) else None
+    except ValueError:
+      return None
+    return self._createEvent(ITERATION)
+
+  def _createEvent(self, eventType, **details):
+    event = {
+      "type": eventType,
+      "stage": self.stage,
+      "numberOfStages": self.getNumberOfStages(),
+      "resolution": self.resolution,
+      "numberOfResolutions": self.getNumberOfResolutions(),
+      "iteration": self.iteration,
+      "maximumNumberOfIterations": self.getMaximumNumberOfIterations(),
+      "metric": self.metric,
+      "stepSize": self.stepSize,
+      "resolutionTimes": list(self.resolutionTimes),
+      "progress": self.getProgress()
+    }
+    event.update(details)
+    return event
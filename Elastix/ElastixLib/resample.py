@@ -0,0 +1,114 @@
+import slicer
+import vtk
+
+
+def resampleVolume(inputVolumeNode, referenceVolumeNode, transformNode, outputVolumeNode, interpolationOrder=3,
+                   backgroundValue=0):
+  """Resample inputVolumeNode into the voxel grid of referenceVolumeNode, warped by transformNode.
+
+  This is the in-process equivalent of transformix: transformNode is the registration result (that transforms the
+  moving volume to the fixed volume), which stores the resampling transform (fixed to moving) as its transform
+  from parent, so no inversion is needed. Parent transforms of the volumes are ignored, as they are for exported inputs.
+  vtkImageReslice uses all available cores.
+
+  :param interpolationOrder: 0 = nearest neighbor, 1 = linear, 3 (or higher) = cubic
+  """
+  referenceIjkToRas = vtk.vtkMatrix4x4()
+  referenceVolumeNode.GetIJKToRASMatrix(referenceIjkToRas)
+  inputRasToIjk = vtk.vtkMatrix4x4()
+  inputVolumeNode.GetRASToIJKMatrix(inputRasToIjk)
+
+  # reference voxel coordinates -> reference RAS -> input RAS -> input voxel coordinates
+  resliceTransform = vtk.vtkGeneralTransform()
+  resliceTransform.PostMultiply()
+  resliceTransform.Concatenate(referenceIjkToRas)
+  if transformNode is not None:
+    resliceTransform.Concatenate(transformNode.GetTransformFromParent())
+  resliceTransform.Concatenate(inputRasToIjk)
+
+  reslice = vtk.vtkImageReslice()
+  reslice.SetInputData(inputVolumeNode.GetImageData())
+  reslice.SetResliceTransform(resliceTransform)
+  if interpolationOrder <= 0:
+    reslice.SetInterpolationModeToNearestNeighbor()
+  elif interpolationOrder == 1:
+    reslice.SetInterpolationModeToLinear()
+  else:
+    reslice.SetInterpolationModeToCubic()
+  reslice.SetBackgroundLevel(backgroundValue)
+  reslice.AutoCropOutputOff()
+  reslice.SetOutputOrigin(0, 0, 0)
+  reslice.SetOutputSpacing(1, 1, 1)
+  reslice.SetOutputExtent(referenceVolumeNode.GetImageData().GetExtent())
+  reslice.Update()
+
+  outputImageData = vtk.vtkImageData()
+  outputImageData.DeepCopy(reslice.GetOutput())
+  outputVolumeNode.SetAndObserveImageData(outputImageData)
+  outputVolumeNode.SetIJKToRASMatrix(referenceIjkToRas)
+  return outputVolumeNode
+
+
+def downsampleVolume(volumeNode, maximumSpacing, isMask=False, name=None):
+  """Create a new volume node that covers the same region as volumeNode, with voxel size of at most maximumSpacing.
+
+  Intensity volumes are smoothed before resampling to avoid aliasing, masks are resampled by nearest neighbor
+  interpolation. Axes that already have a spacing of at most maximumSpacing are not resampled.
+
+  :return: the downsampled volume node, None if the volume does not need to be downsampled
+  """
+  spacing = volumeNode.GetSpacing()
+  imageData = volumeNode.GetImageData()
+  extent = imageData.GetExtent()
+  dimensions = imageData.GetDimensions()
+  outputDimensions = [max(1, int(round(dimensions[axis] * spacing[axis] / max(spacing[axis], maximumSpacing))))
+                      for axis in range(3)]
+  if list(outputDimensions) == list(dimensions):
+    return None
+  # size of output voxels in input voxel units, chosen so that the output covers exactly the input region
+  outputVoxelSize = [dimensions[axis] / outputDimensions[axis] for axis in range(3)]
+
+  inputImageData = imageData
+  if not isMask:
+    smoothing = vtk.vtkImageGaussianSmooth()
+    smoothing.SetInputData(imageData)
+    smoothing.SetDimensionality(3)
+    smoothing.SetStandardDeviations(*[(voxelSize - 1.0) / 2.0 for voxelSize in outputVoxelSize])
+    smoothing.SetRadiusFactors(3.0, 3.0, 3.0)
+    smoothing.Update()
+    inputImageData = smoothing.GetOutput()
+
+  # image data of volume nodes has unit spacing and zero origin, therefore reslice coordinates are IJK coordinates
+  outputOrigin = [extent[axis * 2] - 0.5 + outputVoxelSize[axis] / 2.0 for axis in range(3)]
+  reslice = vtk.vtkImageReslice()
+  reslice.SetInputData(inputImageData)
+  if isMask:
+    reslice.SetInterpolationModeToNearestNeighbor()
+  else:
+    reslice.SetInterpolationModeToLinear()
+  reslice.SetOutputOrigin(outputOrigin)
+  reslice.SetOutputSpacing(outputVoxelSize)
+  reslice.SetOutputExtent(0, outputDimensions[0] - 1, 0, outputDimensions[1] - 1, 0, outputDimensions[2] - 1)
+  reslice.Update()
+
+  outputImageData = vtk.vtkImageData()
+  outputImageData.DeepCopy(reslice.GetOutput())
+  outputImageData.SetOrigin(0, 0, 0)
+  outputImageData.SetSpacing(1, 1, 1)
+
+  # output IJK -> input IJK -> RAS
+  outputIjkToInputIjk = vtk.vtkMatrix4x4()
+  for axis in range(3):
+    outputIjkToInputIjk.SetElement(axis, axis, outputVoxelSize[axis])
+    outputIjkToInputIjk.SetElement(axis, 3, outputOrigin[axis])
+  inputIjkToRas = vtk.vtkMatrix4x4()
+  volumeNode.GetIJKToRASMatrix(inputIjkToRas)
+  outputIjkToRas = vtk.vtkMatrix4x4()
+  vtk.vtkMatrix4x4.Multiply4x4(inputIjkToRas, outputIjkToInputIjk, outputIjkToRas)
+
+  outputVolumeNode = slicer.mrmlScene.AddNewNodeByClass(volumeNode.GetClassName(),
+                                                        name if name else f"{volumeNode.GetName()} downsampled")
+  outputVolumeNode.SetHideFromEditors(True)
+  outputVolumeNode.SetAndObserveImageData(outputImageData)
+  outputVolumeNode.SetIJKToRASMatrix(outputIjkToRas)
+  return outputVolumeNode
@@ -0,0 +1,51 @@
+import numpy as np
+
+
+def normalizedCrossCorrelation(fixedVoxels, movingVoxels):
+  """Normalized cross-correlation of two voxel arrays (-1.0 - 1.0), suitable for images of the same modality."""
+  fixedVoxels = fixedVoxels.astype(np.float64) - fixedVoxels.mean()
+  movingVoxels = movingVoxels.astype(np.float64) - movingVoxels.mean()
+  denominator = np.sqrt(np.sum(fixedVoxels * fixedVoxels) * np.sum(movingVoxels * movingVoxels))
+  if denominator == 0:
+    return 0.0
+  return float(np.sum(fixedVoxels * movingVoxels) / denominator)
+
+
+def normalizedMutualInformation(fixedVoxels, movingVoxels, numberOfBins=32):
+  """Normalized mutual information (H(fixed) + H(moving)) / H(fixed, moving) of two voxel arrays (1.0 - 2.0),
+  suitable for images of different modalities."""
+  jointHistogram, _, _ = np.histogram2d(fixedVoxels.ravel(), movingVoxels.ravel(), bins=numberOfBins)
+  jointProbability = jointHistogram / max(1.0, jointHistogram.sum())
+
+  def entropy(probability):
+    probability = probability[probability > 0]
+    return -float(np.sum(probability * np.log(probability)))
+
+  jointEntropy = entropy(jointProbability)
+  if jointEntropy == 0:
+    return 1.0
+  return (entropy(jointProbability.sum(axis=1)) + entropy(jointProbability.sum(axis=0))) / jointEntropy
+
+
+METRICS = {
+  "normalizedCrossCorrelation": normalizedCrossCorrelation,
+  "normalizedMutualInformation": normalizedMutualInformation
+}
+
+
+def computeSimilarity(fixedVoxels, movingVoxels, maskVoxels=None, metric="normalizedMutualInformation"):
+  """Similarity of a fixed volume and a moving volume that is resampled into the fixed volume's voxel grid.
+  Higher values mean more similar images.
+
+  :param maskVoxels: if specified then only voxels where the mask is non-zero are compared
+  :param metric: name of the metric, see METRICS
+  """
+  if metric not in METRICS:
+    raise ValueError(f"Unknown similarity metric '{metric}', supported metrics: {', '.join(METRICS.keys())}")
+  if maskVoxels is not None:
+    inside = maskVoxels != 0
+    fixedVoxels = fixedVoxels[inside]
+    movingVoxels = movingVoxels[inside]
+  if fixedVoxels.size == 0:
+    return None
+  return METRICS[metric](fixedVoxels, movingVoxels)
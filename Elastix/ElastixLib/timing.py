@@ -0,0 +1,111 @@
+import contextlib
+import json
+import os
+import time
+
+
+def getFileSize(path):
+  """Size of a file in bytes, including the separate pixel data file of .mhd images. Missing files have zero size."""
+  size = 0
+  paths = [path]
+  if path.endswith(".mhd"):
+    paths += [path[:-4] + ".raw", path[:-4] + ".zraw"]
+  for filePath in paths:
+    try:
+      size += os.path.getsize(filePath)
+    except OSError:
+      pass
+  return size
+
+
+class TimingReport:
+  """Wall time and amount of data read and written in each phase of a registration.
+
+  Each phase is a dict with name, startTime, endTime (seconds since the epoch), bytesRead, bytesWritten,
+  and details (dict of additional information, such as the parameter file of an elastix stage).
+  """
+
+  def __init__(self, name=""):
+    self.name = name
+    self.phases = []
+
+  def beginPhase(self, name, **details):
+    phase = {
+      "name": name,
+      "startTime": time.time(),
+      "endTime": None,
+      "bytesRead": 0,
+      "bytesWritten": 0,
+      "details": details
+    }
+    self.phases.append(phase)
+    return phase
+
+  def endPhase(self, phase):
+    if phase["endTime"] is None:
+      phase["endTime"] = time.time()
+
+  @contextlib.contextmanager
+  def measure(self, name, **details):
+    """Context manager that records a phase. Byte counts can be set in the yielded phase dict."""
+    phase = self.beginPhase(name, **details)
+    try:
+      yield phase
+    finally:
+      self.endPhase(phase)
+
+  @staticmethod
+  def getDuration(phase):
+    return ((phase["endTime"] or time.time()) - phase["startTime"])
+
+  def getTotalTime(self):
+    if not self.phases:
+      return 0.0
+    endTimes = [phase["endTime"] or time.time() for phase in self.phases]
+    return max(endTimes) - min(phase["startTime"] for phase in self.phases)
+
+  def getPhaseDurations(self):
+    """Returns phase name -> total duration in seconds (phases that occur multiple times are summed)."""
+    durations = {}
+    for phase in self.phases:
+      durations[phase["name"]] = durations.get(phase["name"], 0.0) + self.getDuration(phase)
+    return durations
+
+  def toText(self):
+    lines = [f"Timing report {self.name}: {self.getTotalTime():.2f} s"]
+    for phase in self.phases:
+      line = f"  {phase['name']}: {self.getDuration(phase):.2f} s"
+      if phase["bytesRead"] or phase["bytesWritten"]:
+        line += f" (read {phase['bytesRead'] / 1024 / 1024:.1f} MB, written {phase['bytesWritten'] / 1024 / 1024:.1f} MB)"
+      lines.append(line)
+    return "\n".join(lines)
+
+  def toChromeTraceEvents(self, processId=0, threadId=0):
+    """Returns list of complete ("X") events in Chrome trace event format, timestamps are in microseconds."""
+    events = [{"name": "thread_name", "ph": "M", "pid": processId, "tid": threadId, "args": {"name": self.name}}]
+    for phase in self.phases:
+      args = {"bytesRead": phase["bytesRead"], "bytesWritten": phase["bytesWritten"]}
+      args.update(phase["details"])
+      events.append({
+        "name": phase["name"],
+        "cat": "elastix",
+        "ph": "X",
+        "ts": int(phase["startTime"] * 1e6),
+        "dur": int(self.getDuration(phase) * 1e6),
+        "pid": processId,
+        "tid": threadId,
+        "args": args
+      })
+    return events
+
+
+def writeChromeTrace(timingReports, filePath):
+  """Write timing reports to a JSON file that can be opened in chrome://tracing or https://ui.perfetto.dev.
+
+  Each report is shown as a separate thread.
+  """
+  events = []
+  for threadId, timingReport in enumerate(timingReports):
+    events += timingReport.toChromeTraceEvents(os.getpid(), threadId)
+  with open(filePath, 'w') as file:
+    json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
@@ -0,0 +1,216 @@
+import itertools
+import math
+import os
+
+import numpy as np
+import slicer
+import vtk
+from vtk.util import numpy_support
+
+from ElastixLib.parameters import readParameterFile, getParameterValue
+
+# elastix uses LPS physical coordinate system, Slicer uses RAS
+LPS_TO_RAS = np.diag([-1.0, -1.0, 1.0])
+
+NO_INITIAL_TRANSFORM = "NoInitialTransform"
+
+
+class UnsupportedTransformError(ValueError):
+  pass
+
+
+def createTransformFromParameterFile(parameterFilePath):
+  """Create a VTK transform from an elastix TransformParameters.N.txt file, including all its initial transforms.
+
+  The returned transform is the resampling transform (from fixed to moving, i.e., the "transform from parent"
+  of the output transform node) in RAS coordinate system. B-spline transforms are represented natively by their
+  coefficients instead of a dense displacement field.
+
+  :raises UnsupportedTransformError: if any of the chained transforms cannot be represented
+  """
+  transforms = []
+  for parameters in _readParameterFileChain(parameterFilePath):
+    # elastix applies the initial transform first
+    transforms.insert(0, _createTransform(parameters))
+
+  if len(transforms) == 1:
+    return transforms[0]
+  compositeTransform = vtk.vtkGeneralTransform()
+  compositeTransform.PostMultiply()
+  for transform in transforms:
+    compositeTransform.Concatenate(transform)
+  return compositeTransform
+
+
+def getBSplineGridSpacing(parameterFilePath):
+  """Returns the smallest B-spline control point spacing (in mm) in the transform chain, None if there is no B-spline."""
+  spacings = []
+  for parameters in _readParameterFileChain(parameterFilePath):
+    if "GridSpacing" in parameters:
+      spacings.append(min(parameters["GridSpacing"]))
+  return min(spacings) if spacings else None
+
+
+def createGridTransform(transform, referenceVolumeNode, spacing):
+  """Sample transform on a regular grid that covers referenceVolumeNode with the given spacing (in mm).
+
+  This is much smaller than a displacement field that has the same resolution as the reference volume
+  and it is exact for linear transforms and accurate for B-spline transforms if spacing is not larger than
+  the control point spacing.
+  """
+  ijkToRas = vtk.vtkMatrix4x4()
+  referenceVolumeNode.GetIJKToRASMatrix(ijkToRas)
+  extent = referenceVolumeNode.GetImageData().GetExtent()
+  corners = []
+  for i, j, k in itertools.product(extent[0:2], extent[2:4], extent[4:6]):
+    corners.append(ijkToRas.MultiplyPoint([i, j, k, 1])[:3])
+  boundsMin = np.min(corners, axis=0)
+  boundsMax = np.max(corners, axis=0)
+  gridSize = [int(math.ceil((boundsMax[axis] - boundsMin[axis]) / spacing)) + 1 for axis in range(3)]
+
+  transformToGrid = vtk.vtkTransformToGrid()
+  transformToGrid.SetInput(transform)
+  transformToGrid.SetGridOrigin(*boundsMin)
+  transformToGrid.SetGridSpacing(spacing, spacing, spacing)
+  transformToGrid.SetGridExtent(0, gridSize[0] - 1, 0, gridSize[1] - 1, 0, gridSize[2] - 1)
+  transformToGrid.SetGridScalarType(vtk.VTK_DOUBLE)
+  transformToGrid.Update()
+
+  gridTransform = slicer.vtkOrientedGridTransform()
+  gridTransform.SetDisplacementGridData(transformToGrid.GetOutput())
+  gridTransform.SetInterpolationModeToCubic()
+  return gridTransform
+
+
+def _readParameterFileChain(parameterFilePath):
+  """Yields parameters of a transform parameter file and then its initial transform parameter files."""
+  visitedFilePaths = set()
+  filePath = parameterFilePath
+  while filePath and filePath != NO_INITIAL_TRANSFORM:
+    filePath = os.path.abspath(filePath)
+    if filePath in visitedFilePaths:
+      raise UnsupportedTransformError(f"Circular reference to initial transform {filePath}")
+    visitedFilePaths.add(filePath)
+    parameters = readParameterFile(filePath)
+    yield parameters
+    initialFilePath = getParameterValue(parameters, "InitialTransformParametersFileName", NO_INITIAL_TRANSFORM)
+    if initialFilePath != NO_INITIAL_TRANSFORM:
+      if getParameterValue(parameters, "HowToCombineTransforms", "Compose") != "Compose":
+        raise UnsupportedTransformError("Only composition of transforms is supported")
+      if not os.path.isabs(initialFilePath):
+        initialFilePath = os.path.join(os.path.dirname(filePath), initialFilePath)
+    filePath = initialFilePath
+
+
+def _createTransform(parameters):
+  if getParameterValue(parameters, "FixedImageDimension", 3) != 3:
+    raise UnsupportedTransformError("Only 3D transforms are supported")
+  transformType = getParameterValue(parameters, "Transform")
+  if transformType == "File":
+    return _createTransformFromFile(getParameterValue(parameters, "TransformFileName"))
+  if transformType in ["BSplineTransform", "RecursiveBSplineTransform"]:
+    return _createBSplineTransform(parameters)
+
+  transformParameters = parameters.get("TransformParameters", [])
+  center = np.array(parameters.get("CenterOfRotationPoint", [0.0, 0.0, 0.0]), dtype=float)
+  if transformType == "TranslationTransform":
+    matrix = np.eye(3)
+    translation = np.array(transformParameters[0:3], dtype=float)
+  elif transformType == "EulerTransform":
+    matrix = _eulerRotationMatrix(transformParameters[0:3],
+                                  getParameterValue(parameters, "ComputeZYX", "false") == "true")
+    translation = np.array(transformParameters[3:6], dtype=float)
+  elif transformType == "SimilarityTransform":
+    matrix = _versorRotationMatrix(transformParameters[0:3]) * transformParameters[6]
+    translation = np.array(transformParameters[3:6], dtype=float)
+  elif transformType == "AffineTransform":
+    matrix = np.array(transformParameters[0:9], dtype=float).reshape(3, 3)
+    translation = np.array(transformParameters[9:12], dtype=float)
+  else:
+    raise UnsupportedTransformError(f"Transform type '{transformType}' is not supported")
+
+  # x -> A * (x - c) + c + t, converted from LPS to RAS
+  offset = center + translation - matrix.dot(center)
+  matrixRas = LPS_TO_RAS.dot(matrix).dot(LPS_TO_RAS)
+  offsetRas = LPS_TO_RAS.dot(offset)
+  transformMatrix = vtk.vtkMatrix4x4()
+  for row in range(3):
+    for col in range(3):
+      transformMatrix.SetElement(row, col, matrixRas[row, col])
+    transformMatrix.SetElement(row, 3, offsetRas[row])
+  transform = vtk.vtkTransform()
+  transform.SetMatrix(transformMatrix)
+  return transform
+
+
+def _eulerRotationMatrix(angles, computeZYX):
+  cx, cy, cz = [math.cos(angle) for angle in angles]
+  sx, sy, sz = [math.sin(angle) for angle in angles]
+  rotationX = np.array([[1, 0, 0], [0, cx, -sx], [0, sx, cx]])
+  rotationY = np.array([[cy, 0, sy], [0, 1, 0], [-sy, 0, cy]])
+  rotationZ = np.array([[cz, -sz, 0], [sz, cz, 0], [0, 0, 1]])
+  if computeZYX:
+    return rotationZ.dot(rotationY).dot(rotationX)
+  return rotationZ.dot(rotationX).dot(rotationY)
+
+
+def _versorRotationMatrix(versor):
+  x, y, z = versor
+  w = math.sqrt(max(0.0, 1.0 - x * x - y * y - z * z))
+  return np.array([
+    [1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+    [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+    [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)]])
+
+
+def _createBSplineTransform(parameters):
+  if getParameterValue(parameters, "BSplineTransformSplineOrder", 3) != 3:
+    raise UnsupportedTransformError("Only cubic B-spline transforms are supported")
+  if getParameterValue(parameters, "UseCyclicTransform", "false") == "true":
+    raise UnsupportedTransformError("Cyclic B-spline transforms are not supported")
+
+  gridSize = [int(value) for value in parameters["GridSize"]]
+  gridIndex = np.array(parameters.get("GridIndex", [0, 0, 0]), dtype=float)
+  gridSpacing = np.array(parameters["GridSpacing"], dtype=float)
+  gridOrigin = np.array(parameters["GridOrigin"], dtype=float)
+  # elastix writes the direction matrix column by column
+  gridDirection = np.array(parameters.get("GridDirection", [1, 0, 0, 0, 1, 0, 0, 0, 1]), dtype=float).reshape(3, 3).T
+  numberOfGridPoints = gridSize[0] * gridSize[1] * gridSize[2]
+  transformParameters = np.array(parameters["TransformParameters"], dtype=float)
+  if len(transformParameters) != 3 * numberOfGridPoints:
+    raise UnsupportedTransformError("Number of B-spline coefficients does not match the grid size")
+
+  # origin of the first grid point (grid index may be non-zero)
+  gridOrigin = gridOrigin + gridDirection.dot(gridSpacing * gridIndex)
+
+  # all x components are stored first, then all y, then all z; grid points are ordered with x index changing fastest
+  coefficientsRas = LPS_TO_RAS.dot(transformParameters.reshape(3, numberOfGridPoints)).T
+  coefficientArray = numpy_support.numpy_to_vtk(np.ascontiguousarray(coefficientsRas), deep=True,
+                                                array_type=vtk.VTK_DOUBLE)
+  coefficients = vtk.vtkImageData()
+  coefficients.SetDimensions(gridSize)
+  coefficients.SetOrigin(LPS_TO_RAS.dot(gridOrigin))
+  coefficients.SetSpacing(gridSpacing)
+  coefficients.GetPointData().SetScalars(coefficientArray)
+
+  gridDirectionRas = LPS_TO_RAS.dot(gridDirection)
+  gridDirectionMatrix = vtk.vtkMatrix4x4()
+  for row in range(3):
+    for col in range(3):
+      gridDirectionMatrix.SetElement(row, col, gridDirectionRas[row, col])
+
+  bsplineTransform = slicer.vtkOrientedBSplineTransform()
+  bsplineTransform.SetBorderModeToZero()
+  bsplineTransform.SetCoefficientData(coefficients)
+  bsplineTransform.SetGridDirectionMatrix(gridDirectionMatrix)
+  return bsplineTransform
+
+
+def _createTransformFromFile(transformFilePath):
+  if not transformFilePath or not os.path.isfile(transformFilePath):
+    raise UnsupportedTransformError(f"Transform file not found: {transformFilePath}")
+  transformNode = slicer.util.loadTransform(transformFilePath)
+  try:
+    return transformNode.GetTransformFromParent()
+  finally:
+    slicer.mrmlScene.RemoveNode(transformNode)
@@ -1,3 +1,6 @@
+import os
+import tempfile
+
 import slicer
 import qt
 
@@ -6,11 +9,12 @@ def showFolder(path):
   qt.QDesktopServices().openUrl(qt.QUrl("file:///" + path, qt.QUrl.TolerantMode))
 
 
-def createTempDirectory():
-  tempDir = qt.QDir(getTempDirectoryBase())
-  tempDirName = qt.QDateTime().currentDateTime().toString("yyyyMMdd_hhmmss_zzz")
-  fileInfo = qt.QFileInfo(qt.QDir(tempDir), tempDirName)
-  return createDirectory(fileInfo.absoluteFilePath())
+def createTempDirectory(baseDirectory=None):
+  if baseDirectory is None:
+    baseDirectory = getTempDirectoryBase()
+  # timestamp makes the folders easy to find, the random suffix prevents collisions between concurrent jobs
+  tempDirNamePrefix = qt.QDateTime().currentDateTime().toString("yyyyMMdd_hhmmss_zzz")
+  return tempfile.mkdtemp(prefix=f"{tempDirNamePrefix}_", dir=baseDirectory)
 
 
 def getTempDirectoryBase():
@@ -26,6 +30,62 @@ def createDirectory(path):
     raise RuntimeError(f"Failed to create directory {path}")
 
 
+# file in a temporary directory that contains the ID of the process that uses the directory
+OWNER_FILE_NAME = ".owner"
+
+
+def markDirectoryOwner(directory):
+  """Mark directory as used by this process, see isDirectoryOwnerRunning."""
+  with open(os.path.join(directory, OWNER_FILE_NAME), 'w') as file:
+    file.write(str(os.getpid()))
+
+
+def isDirectoryOwnerRunning(directory):
+  """Returns True if the directory is marked by a process (see markDirectoryOwner) that is still running."""
+  try:
+    with open(os.path.join(directory, OWNER_FILE_NAME), 'r') as file:
+      pid = int(file.read().strip())
+  except (OSError, ValueError):
+    return False
+  return isProcessRunning(pid)
+
+
+def isProcessRunning(pid):
+  if pid == os.getpid():
+    return True
+  import platform
+  if platform.system() == 'Windows':
+    # os.kill would terminate the process on Windows
+    import ctypes
+    PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+    STILL_ACTIVE = 259
+    handle = ctypes.windll.kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+    if not handle:
+      return False
+    try:
+      exitCode = ctypes.c_ulong()
+      ctypes.windll.kernel32.GetExitCodeProcess(handle, ctypes.byref(exitCode))
+      return exitCode.value == STILL_ACTIVE
+    finally:
+      ctypes.windll.kernel32.CloseHandle(handle)
+  try:
+    os.kill(pid, 0)
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    # process exists but it belongs to another user
+    return True
+  return True
+
+
+def getNumberOfAvailableCores():
+  try:
+    # only count the cores that this process is allowed to run on (Linux)
+    return len(os.sched_getaffinity(0))
+  except AttributeError:
+    return os.cpu_count() or 1
+
+
 def getContentSuffixes(content, presets):
   numbers = []
   for oPreset in presets:
@@ -0,0 +1,137 @@
+import logging
+import os
+import re
+import shutil
+import time
+
+import slicer
+
+from ElastixLib.cache import getDirectorySize
+from ElastixLib.utils import createDirectory, createTempDirectory, getTempDirectoryBase, markDirectoryOwner, \
+  isDirectoryOwnerRunning, OWNER_FILE_NAME
+
+# working directory names start with a timestamp (see createTempDirectory)
+WORKSPACE_NAME_PATTERN = re.compile(r"^\d{8}_\d{6}_\d{3}")
+
+
+class WorkspaceManager:
+  """Creates working directories for registration jobs and keeps the total size of temporary files under a quota.
+
+  Working directories of jobs whose files are deleted after completion are placed on a RAM-backed file system
+  (/dev/shm) if the estimated size of the files fits in the RAM budget, which makes writing and reading of
+  input and output files faster. All other working directories are placed in the Slicer temporary folder.
+  When the quota is exceeded, least recently modified working directories of earlier jobs are deleted, except
+  directories that are used by a running process (another Slicer instance may use the same folders).
+  """
+
+  RAM_BUDGET_SETTINGS_KEY = "Elastix/RamWorkspaceBudgetMB"
+  DEFAULT_RAM_BUDGET_MB = 2048
+  QUOTA_SETTINGS_KEY = "Elastix/TemporaryFilesQuotaMB"
+  DEFAULT_QUOTA_MB = 20480
+  RAM_DISK_PATH = "/dev/shm"
+  # do not scan the temporary folders more often than this
+  GARBAGE_COLLECTION_INTERVAL_SEC = 60
+  # recently modified directories are not deleted, as their owner may not have marked them yet
+  MINIMUM_GARBAGE_AGE_SEC = 60
+
+  def __init__(self, ramBudgetBytes=None, quotaBytes=None):
+    if ramBudgetBytes is None:
+      ramBudgetBytes = int(slicer.util.settingsValue(self.RAM_BUDGET_SETTINGS_KEY, self.DEFAULT_RAM_BUDGET_MB,
+                                                     converter=int)) * 1024 * 1024
+    if quotaBytes is None:
+      quotaBytes = int(slicer.util.settingsValue(self.QUOTA_SETTINGS_KEY, self.DEFAULT_QUOTA_MB,
+                                                 converter=int)) * 1024 * 1024
+    self.ramBudgetBytes = ramBudgetBytes
+    self.quotaBytes = quotaBytes
+    # working directory path -> estimated size in bytes (for directories in RAM)
+    self._ramWorkspaces = {}
+    self._activeWorkspaces = set()
+    self._lastGarbageCollectionTime = None
+    # folder of working directories that are not in RAM, None = Slicer temporary folder
+    self.diskWorkspaceBase = None
+
+  def getDiskWorkspaceBase(self):
+    return self.diskWorkspaceBase if self.diskWorkspaceBase else getTempDirectoryBase()
+
+  def getRamWorkspaceBase(self):
+    """Returns the folder for working directories in RAM, None if there is no RAM-backed file system."""
+    if not os.path.isdir(self.RAM_DISK_PATH) or not os.access(self.RAM_DISK_PATH, os.W_OK):
+      return None
+    userId = os.getuid() if hasattr(os, 'getuid') else 0
+    return createDirectory(os.path.join(self.RAM_DISK_PATH, f"SlicerElastix-{userId}"))
+
+  def createWorkspace(self, estimatedSizeBytes=0, allowRam=True):
+    """Create a new, uniquely named working directory.
+
+    :param estimatedSizeBytes: expected total size of files that will be written into the directory
+    :param allowRam: place the directory in RAM if it fits in the budget (files that are kept
+      after the registration should not be placed in RAM)
+    """
+    self.collectGarbage()
+    workspace = None
+    if allowRam and self._fitsInRam(estimatedSizeBytes):
+      workspace = createTempDirectory(self.getRamWorkspaceBase())
+      self._ramWorkspaces[workspace] = estimatedSizeBytes
+    if workspace is None:
+      workspace = createTempDirectory(self.getDiskWorkspaceBase())
+    markDirectoryOwner(workspace)
+    self._activeWorkspaces.add(workspace)
+    return workspace
+
+  def releaseWorkspace(self, workspace, delete=True):
+    self._activeWorkspaces.discard(workspace)
+    inRam = self._ramWorkspaces.pop(workspace, None) is not None
+    if delete:
+      shutil.rmtree(workspace, ignore_errors=True)
+      return
+    # kept files can be deleted by garbage collection
+    try:
+      os.remove(os.path.join(workspace, OWNER_FILE_NAME))
+    except OSError:
+      pass
+    if inRam:
+      # files must be kept, move them out of RAM
+      diskWorkspace = os.path.join(self.getDiskWorkspaceBase(), os.path.basename(workspace))
+      shutil.move(workspace, diskWorkspace)
+      logging.info(f"Working directory is moved from {workspace} to {diskWorkspace}")
+
+  def isInRam(self, workspace):
+    return workspace in self._ramWorkspaces
+
+  def _fitsInRam(self, estimatedSizeBytes):
+    ramWorkspaceBase = self.getRamWorkspaceBase() if self.ramBudgetBytes > 0 else None
+    if ramWorkspaceBase is None:
+      return False
+    if sum(self._ramWorkspaces.values()) + estimatedSizeBytes > self.ramBudgetBytes:
+      return False
+    return shutil.disk_usage(ramWorkspaceBase).free > estimatedSizeBytes
+
+  def collectGarbage(self, force=False):
+    """Delete least recently modified working directories that are not in use until the total size is under the quota."""
+    now = time.time()
+    if not force and self._lastGarbageCollectionTime is not None \
+        and now - self._lastGarbageCollectionTime < self.GARBAGE_COLLECTION_INTERVAL_SEC:
+      return
+    self._lastGarbageCollectionTime = now
+
+    workspaceBases = [self.getDiskWorkspaceBase()]
+    ramWorkspaceBase = self.getRamWorkspaceBase()
+    if ramWorkspaceBase:
+      workspaceBases.append(ramWorkspaceBase)
+    workspaces = []
+    for workspaceBase in workspaceBases:
+      for entry in os.scandir(workspaceBase):
+        if not entry.is_dir() or not WORKSPACE_NAME_PATTERN.match(entry.name):
+          continue
+        workspaces.append((entry.stat().st_mtime, entry.path, getDirectorySize(entry.path)))
+
+    totalSize = sum(size for mtime, path, size in workspaces)
+    for mtime, path, size in sorted(workspaces):
+      if totalSize <= self.quotaBytes:
+        break
+      if path in self._activeWorkspaces or now - mtime < self.MINIMUM_GARBAGE_AGE_SEC \
+          or isDirectoryOwnerRunning(path):
+        continue
+      shutil.rmtree(path, ignore_errors=True)
+      totalSize -= size
+      logging.info(f"Removed old working directory {path} ({size / 1024 / 1024:.1f} MB)")
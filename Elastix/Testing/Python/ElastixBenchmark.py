@@ -0,0 +1,64 @@
+"""Benchmark of registration presets on synthetic phantoms (no network access is needed).
+
+Usage:
+
+  Slicer --no-main-window --python-script ElastixBenchmark.py --presets default0 default-rigid --sizes 64 128
+    --output results.json --csv results.csv --baseline baseline.json
+
+Exits with a non-zero code if a registration failed or a regression is found compared to the baseline.
+"""
+
+import argparse
+import sys
+
+import slicer
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description="Elastix registration benchmark")
+  parser.add_argument("--presets", nargs="+", default=None, help="preset IDs (default: default0)")
+  parser.add_argument("--sizes", nargs="+", type=int, default=None, help="phantom sizes in voxels (default: 64 128 256 512)")
+  parser.add_argument("--deformation", type=float, default=4.0, help="magnitude of the known B-spline deformation (mm)")
+  parser.add_argument("--threads", type=int, default=0, help="number of elastix threads (default: all cores)")
+  parser.add_argument("--output", default=None, help="write results to this JSON file")
+  parser.add_argument("--csv", default=None, help="write results to this CSV file")
+  parser.add_argument("--baseline", default=None, help="compare results to this JSON file")
+  parser.add_argument("--time-tolerance", type=float, default=0.25, help="allowed relative increase of wall time")
+  parser.add_argument("--error-tolerance", type=float, default=0.5, help="allowed increase of landmark error (mm)")
+  args = parser.parse_args(argv)
+
+  from Elastix import ElastixLogic
+  from ElastixLib import benchmark
+
+  logic = ElastixLogic()
+  logic.numberOfThreads = args.threads
+
+  def printResult(result):
+    print(", ".join(f"{field}: {result[field]}" for field in benchmark.RESULT_FIELDS if field in result))
+    sys.stdout.flush()
+
+  results = benchmark.runBenchmark(args.presets, args.sizes, logic, args.deformation, resultCallback=printResult)
+  if args.output:
+    benchmark.writeResultsJson(results, args.output, benchmark.getEnvironmentInformation(logic))
+  if args.csv:
+    benchmark.writeResultsCsv(results, args.csv)
+
+  failed = any(result["status"] != "completed" for result in results)
+  if args.baseline:
+    regressions = benchmark.compareWithBaseline(results, benchmark.readResultsJson(args.baseline),
+                                                args.time_tolerance, args.error_tolerance)
+    for presetId, size, description in regressions:
+      print(f"Regression: preset {presetId}, size {size}: {description}")
+    failed = failed or len(regressions) > 0
+  return 1 if failed else 0
+
+
+if __name__ == "__main__":
+  try:
+    exitCode = main(sys.argv[1:])
+  except Exception:
+    # Slicer would keep running if the script raised an exception
+    import traceback
+    traceback.print_exc()
+    exitCode = 1
+  slicer.util.exit(exitCode)